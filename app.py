@@ -1,44 +1,445 @@
 from flask import Flask, render_template, request, jsonify, Response
 import threading
 import queue
+import itertools
+from collections import deque
 import os
 import time
-from list_scraper import scrape_sothebys_list
+import atexit
+import heapq
+import uuid
+import json
+from concurrent.futures import Future
+from playwright.sync_api import sync_playwright
+from list_scraper import (scrape_sothebys_list, extract_lot_links, scrape_pages_parallel,
+                          wait_for_next_page, LOT_LINK_SELECTOR)
+from page_utils import wait_for_settle, scroll_until_stable, first_attribute, block_resources
 from image_extractor import ImageDownloader
+from http_cache import HttpCache
+from job_manifest import JobManifest
+from metrics import REGISTRY
+from tracing import Tracer, NULL_TRACER
 
 app = Flask(__name__)
 
-# 全局状态管理
+# 全局日志总线
 class TaskManager:
-    def __init__(self):
-        self.scrape_thread = None
-        self.download_thread = None
-        self.stop_flag = threading.Event()
-        self.log_queue = queue.Queue()
-        self.status = {
-            'scraping': False,
-            'downloading': False,
-            'scrape_progress': '',
-            'download_progress': ''
-        }
-        self.lock = threading.Lock()
+    """发布/订阅日志总线
+
+    日志按递增的序号写入有界环形缓冲区，每个 SSE 连接各自从自己的位置读取，
+    多个浏览器标签页都能收到完整日志；断线重连时通过 Last-Event-ID 从断点继续。
+
+    任务状态与结构化进度不进入日志缓冲区：每个任务只保留最新的快照和版本号，
+    读取方只拿到自己上次之后变化过的快照。
+    """
+
+    def __init__(self, capacity=5000):
+        self.buffer = deque(maxlen=capacity)  # (序号, 任务 ID, 日志行)
+        self.seq = 0
+        self.jobs = {}  # 任务 ID -> (版本号, 任务快照)
+        self.version = 0
+        self.cond = threading.Condition()
     
-    def log(self, message):
+    def log(self, message, job_id=None):
         """添加日志消息"""
         timestamp = time.strftime('%H:%M:%S')
         log_msg = f"[{timestamp}] {message}"
-        self.log_queue.put(log_msg)
+        with self.cond:
+            self.seq += 1
+            self.buffer.append((self.seq, job_id, log_msg))
+            self.cond.notify_all()
+        REGISTRY.inc('log_lines_total')
         print(log_msg)
+
+    def publish(self, snapshot):
+        """发布任务快照 (状态变化或结构化进度)，覆盖该任务之前的快照"""
+        with self.cond:
+            self.version += 1
+            self.jobs[snapshot['id']] = (self.version, snapshot)
+            self.cond.notify_all()
+        REGISTRY.inc('job_events_total')
     
-    def update_status(self, **kwargs):
-        """更新状态"""
-        with self.lock:
-            self.status.update(kwargs)
+    def read(self, after, version=None, job_id=None, timeout=15, limit=500):
+        """读取序号大于 after 的日志，没有新日志也没有任务更新时最多等待 timeout 秒
+
+        返回 (日志列表 [(序号, 日志行)], 新的读取位置, 任务快照列表, 新的快照版本)。
+        version 为空时不读取任务快照。job_id 不为空时只返回该任务的日志和快照，
+        但读取位置仍前进到最新，避免重复扫描其他任务的日志。
+        after 大于当前序号 (服务重启后浏览器带着旧的 Last-Event-ID 重连) 时从缓冲区开头读取。
+        """
+        with self.cond:
+            if after > self.seq:
+                after = 0
+            if self.seq <= after and (version is None or self.version <= version):
+                self.cond.wait(timeout)
+            jobs = []
+            if version is not None:
+                changed = sorted((v, snap) for v, snap in self.jobs.values()
+                                 if v > version and (job_id is None or snap['id'] == job_id))
+                jobs = [snap for _, snap in changed]
+                version = self.version
+            if not self.buffer:
+                return [], self.seq, jobs, version
+            # 序号连续，可以直接定位起点；早于缓冲区的部分已被覆盖
+            start = max(0, after - self.buffer[0][0] + 1)
+            entries = []
+            cursor = after
+            for seq, job, line in itertools.islice(self.buffer, start, None):
+                cursor = seq
+                if job_id is None or job == job_id:
+                    entries.append((seq, line))
+                    if len(entries) >= limit:
+                        break
+            return entries, max(cursor, after), jobs, version
 
 task_manager = TaskManager()
 
-def scrape_with_stop(url, output_file, stop_flag, log_callback):
-    """支持停止的抓取函数"""
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+
+
+class _WarmContext:
+    """一个预热的浏览器上下文及其已打开的页面数"""
+
+    def __init__(self, context):
+        self.context = context
+        self.pages = 0
+        self.closed = False
+        context.on("page", self._on_page)
+        context.on("close", self._on_close)
+
+    def _on_page(self, page):
+        self.pages += 1
+
+    def _on_close(self, context):
+        self.closed = True
+
+    def healthy(self):
+        """没有收到 close 事件，且能与浏览器完成一次往返 (读取 Cookie)"""
+        if self.closed:
+            return False
+        try:
+            self.context.cookies()
+        except Exception:
+            return False
+        return not self.closed
+
+
+class BrowserService:
+    """常驻浏览器服务，在抓取与下载任务之间共享
+
+    Playwright sync API 的对象只能在创建它的线程中使用，因此每个工作线程
+    持有一个 Chromium 和一个预热的上下文，任务以 fn(context) 的形式提交，
+    在工作线程中执行后通过 Future 返回结果：
+    - 浏览器在第一个任务到来时启动，之后一直保持运行
+    - 上下文以保存的 storage state 为初始状态 (Cookie Banner 已接受)
+    - 借出前检查浏览器是否仍连接，断开时重新启动；上下文收到 close 事件
+      或无法完成一次往返时重建
+    - 上下文打开 max_pages 个页面后、或任务出错后回收并重建
+    """
+
+    def __init__(self, workers=4, max_pages=50, headless=True, storage_state_path=None):
+        self.workers = workers
+        self.max_pages = max_pages
+        self.headless = headless
+        self.storage_state_path = storage_state_path
+        self.jobs = queue.Queue()
+        self.state_lock = threading.Lock()
+        self.stats = {'launches': 0, 'contexts': 0, 'jobs': 0, 'recycled': 0}
+        self.threads = [
+            threading.Thread(target=self._worker, name=f"browser-{i}", daemon=True) for i in range(workers)
+        ]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, fn):
+        """提交任务 fn(context)，返回 Future"""
+        future = Future()
+        self.jobs.put((fn, future))
+        return future
+
+    def run(self, fn):
+        """提交任务并等待结果 (fn 抛出的异常原样抛出)"""
+        return self.submit(fn).result()
+
+    def save_state(self, context):
+        """保存上下文的 storage state，之后新建的上下文都以此为初始状态"""
+        if not self.storage_state_path:
+            return
+        with self.state_lock:
+            context.storage_state(path=self.storage_state_path)
+
+    def _new_context(self, browser):
+        with self.state_lock:
+            state = self.storage_state_path if (self.storage_state_path and os.path.exists(self.storage_state_path)) else None
+        self.stats['contexts'] += 1
+        return _WarmContext(browser.new_context(user_agent=USER_AGENT, storage_state=state))
+
+    def _lease(self, playwright, browser, warm):
+        """借出前的健康检查：浏览器断开时重启，上下文失效或用满时重建"""
+        if browser is None or not browser.is_connected():
+            browser = playwright.chromium.launch(headless=self.headless)
+            self.stats['launches'] += 1
+            warm = None
+        if warm is not None and not warm.healthy():
+            # 上下文已关闭或浏览器不再响应：丢弃后重建，而不是等任务在上面失败
+            self._close_context(warm)
+            warm = None
+            self.stats['recycled'] += 1
+        if warm is not None and warm.pages >= self.max_pages:
+            self._close_context(warm)
+            warm = None
+        if warm is None:
+            warm = self._new_context(browser)
+        return browser, warm
+
+    def _close_context(self, warm):
+        try:
+            warm.context.close()
+        except Exception:
+            pass
+
+    def _worker(self):
+        playwright = None
+        browser = None
+        warm = None
+        try:
+            while True:
+                item = self.jobs.get()
+                if item is None:
+                    break
+                fn, future = item
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    if playwright is None:
+                        playwright = sync_playwright().start()
+                    browser, warm = self._lease(playwright, browser, warm)
+                    self.stats['jobs'] += 1
+                    result = fn(warm.context)
+                except BaseException as e:
+                    future.set_exception(e)
+                    # 出错后的上下文状态不可信，丢弃重建
+                    if warm is not None:
+                        self._close_context(warm)
+                        warm = None
+                    continue
+                # 关闭任务遗留的页面，上下文保持干净
+                try:
+                    for page in list(warm.context.pages):
+                        page.close()
+                except Exception:
+                    warm = None
+                future.set_result(result)
+        finally:
+            if warm is not None:
+                self._close_context(warm)
+            if browser is not None:
+                try:
+                    browser.close()
+                except Exception:
+                    pass
+            if playwright is not None:
+                playwright.stop()
+
+    def close(self):
+        for _ in self.threads:
+            self.jobs.put(None)
+        for t in self.threads:
+            t.join(timeout=10)
+
+
+def _env_int(name, default):
+    """读取整数环境变量，未设置或无效时使用默认值"""
+    try:
+        return max(1, int(os.environ[name]))
+    except (KeyError, ValueError):
+        return default
+
+
+# 常驻浏览器的线程数 (同时打开的浏览器上下文)
+BROWSER_WORKERS = _env_int('SOTHEBYS_BROWSER_WORKERS', min(os.cpu_count() or 1, 8))
+# 调度器的 worker 预算 (同时运行的任务占用的 worker 总数)，至少为 2，抓取和下载可以同时运行；
+# 超出浏览器线程数的任务在浏览器服务中排队
+JOB_WORKERS = _env_int('SOTHEBYS_JOB_WORKERS', max(2, BROWSER_WORKERS))
+
+browser_service = BrowserService(
+    workers=BROWSER_WORKERS,
+    storage_state_path=os.path.join("下载", ".browser_state.json"),
+)
+atexit.register(browser_service.close)
+
+JOBS_DIR = "任务"  # 每个抓取任务的列表文件
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+PROGRESS_INTERVAL = 0.5  # 同一任务的进度事件最多每 0.5 秒推送一次
+
+
+class Job:
+    """一个抓取或下载任务：独立的 ID、输出文件、停止标志和进度"""
+
+    def __init__(self, kind, target, params, priority=0, cost=1):
+        self.id = uuid.uuid4().hex[:8]
+        self.kind = kind          # 'scrape' 或 'download'
+        self.target = target      # target(job)，在调度器的任务线程中执行
+        self.params = params
+        self.priority = priority  # 越大越先执行
+        self.cost = cost          # 占用的 worker 预算 (浏览器数)
+        self.state = JOB_QUEUED
+        self.progress = ''
+        self.stats = {}           # 结构化进度 (计数、速率、预计剩余时间)
+        self.published = 0.0
+        self.error = None
+        self.stop_flag = threading.Event()
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.output_file = None
+        self.trace_file = None    # 启用追踪时的 Chrome trace 文件
+
+    def set_progress(self, text, stats=None):
+        """更新进度文本和结构化进度，按 PROGRESS_INTERVAL 节流推送给前端"""
+        self.progress = text
+        if stats is not None:
+            self.stats = stats
+        now = time.monotonic()
+        if now - self.published >= PROGRESS_INTERVAL:
+            self.published = now
+            self.publish()
+
+    def publish(self):
+        task_manager.publish(self.to_dict())
+
+    def log(self, message):
+        task_manager.log(f"[{self.kind} {self.id}] {message}", job_id=self.id)
+
+    def tracer(self, enabled):
+        """enabled 为 True 时返回写入 任务/<ID>_trace.json 的 Tracer，否则返回 None"""
+        if not enabled:
+            return None
+        self.trace_file = os.path.join(JOBS_DIR, f"{self.id}_trace.json")
+        return Tracer(self.trace_file)
+
+    def save_trace(self, tracer):
+        if tracer is not None:
+            tracer.save()
+            self.log(f"时间线已写入: {self.trace_file}")
+
+    def to_dict(self):
+        return {
+            'id': self.id, 'kind': self.kind, 'state': self.state, 'priority': self.priority,
+            'cost': self.cost, 'progress': self.progress, 'stats': self.stats, 'error': self.error,
+            'params': self.params,
+            'output_file': self.output_file, 'trace_file': self.trace_file,
+            'created': self.created, 'started': self.started, 'finished': self.finished,
+        }
+
+
+class JobScheduler:
+    """任务调度器：按优先级排队，在 worker 预算内同时运行多个任务
+
+    每个任务占用 cost 个 worker (抓取 1 个，下载为并行扫描数)，正在运行的任务
+    占用总和不超过 budget。队首任务放不下时后面的任务也继续等待，
+    保证高优先级任务不会被低优先级任务插队。
+    """
+
+    def __init__(self, budget):
+        self.budget = max(1, budget)
+        self.in_use = 0
+        self.jobs = {}    # ID -> Job
+        self.queue = []   # 堆：(-优先级, 序号, Job)
+        self.seq = 0
+        self.cond = threading.Condition()
+        self.dispatcher = threading.Thread(target=self._dispatch, name="job-dispatcher", daemon=True)
+        self.dispatcher.start()
+
+    def submit(self, kind, target, params, priority=0, cost=1):
+        job = Job(kind, target, params, priority, min(max(1, cost), self.budget))
+        with self.cond:
+            self.jobs[job.id] = job
+            self.seq += 1
+            heapq.heappush(self.queue, (-priority, self.seq, job))
+            self.cond.notify_all()
+        job.publish()
+        job.log(f"已加入队列 (优先级 {priority}，占用 {job.cost} 个 worker)")
+        return job
+
+    def get(self, job_id):
+        with self.cond:
+            return self.jobs.get(job_id)
+
+    def list(self):
+        with self.cond:
+            jobs = list(self.jobs.values())
+        return sorted(jobs, key=lambda j: j.created, reverse=True)
+
+    def running(self, kind=None):
+        return [j for j in self.list() if j.state == JOB_RUNNING and (kind is None or j.kind == kind)]
+
+    def cancel(self, job_id):
+        """取消任务：排队中的直接移除，运行中的设置停止标志；返回 False 表示任务不存在或已结束"""
+        with self.cond:
+            job = self.jobs.get(job_id)
+            if job is None or job.state not in (JOB_QUEUED, JOB_RUNNING):
+                return False
+            job.stop_flag.set()
+            if job.state == JOB_QUEUED:
+                job.state = JOB_CANCELLED
+                job.finished = time.time()
+                self.queue = [item for item in self.queue if item[2] is not job]
+                heapq.heapify(self.queue)
+                self.cond.notify_all()
+        job.publish()
+        job.log("正在停止任务...")
+        return True
+
+    def cancel_all(self):
+        for job in self.list():
+            self.cancel(job.id)
+
+    def _dispatch(self):
+        while True:
+            with self.cond:
+                while not self.queue or self.queue[0][2].cost > self.budget - self.in_use:
+                    self.cond.wait()
+                _, _, job = heapq.heappop(self.queue)
+                self.in_use += job.cost
+                job.state = JOB_RUNNING
+                job.started = time.time()
+            job.publish()
+            threading.Thread(target=self._run, args=(job,), name=f"job-{job.id}", daemon=True).start()
+
+    def _run(self, job):
+        try:
+            job.target(job)
+            state = JOB_CANCELLED if job.stop_flag.is_set() else JOB_DONE
+        except Exception as e:
+            job.error = str(e)
+            job.log(f"发生严重错误: {e}")
+            state = JOB_FAILED
+        with self.cond:
+            job.state = state
+            job.finished = time.time()
+            self.in_use -= job.cost
+            self.cond.notify_all()
+        # 结束时的快照带上最后一次 (可能被节流的) 进度
+        job.publish()
+
+
+scheduler = JobScheduler(budget=JOB_WORKERS)
+
+
+def scrape_with_stop(url, output_file, stop_flag, log_callback, page_workers=4, progress_callback=None, tracer=None):
+    """支持停止的抓取函数，出错时抛出异常 (由任务调度器记录为失败)"""
+    tracer = tracer or NULL_TRACER
+    report = progress_callback or (lambda text, stats=None: None)
+    parent = os.path.dirname(output_file)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
     log_callback("启动列表抓取器...")
     log_callback(f"目标 URL: {url}")
     
@@ -49,19 +450,19 @@ def scrape_with_stop(url, output_file, stop_flag, log_callback):
         f.write(f"# Date: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
         f.write(f"# 每页抓取完成后实时写入\n\n")
     
-    from playwright.sync_api import sync_playwright
-    
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        context = browser.new_context(
-            user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-        )
+    def scrape_in_context(context):
+        # 列表页拦截缩略图等资源；上下文之后还会借给其他任务，结束时撤销拦截
+        block_resources(context, 'list')
         page = context.new_page()
+        total_items = 0
+        pages_done = 0
+        error = None
 
         try:
             log_callback("正在加载页面...")
-            page.goto(url, timeout=60000)
-            page.wait_for_load_state("networkidle")
+            with tracer.stage('list_navigate', url=url):
+                page.goto(url, timeout=60000)
+                page.wait_for_load_state("networkidle")
             
             # 处理 Cookie Banner
             log_callback("检查 Cookie Banner...")
@@ -70,88 +471,66 @@ def scrape_with_stop(url, output_file, stop_flag, log_callback):
                 if cookie_btn.is_visible():
                     log_callback("发现 Cookie Banner，尝试关闭/接受...")
                     cookie_btn.click()
-                    time.sleep(2)
+                    wait_for_settle(page)
                     page.wait_for_load_state("networkidle")
+                    # 保存已接受 Cookie 的状态，之后新建的上下文直接带上
+                    browser_service.save_state(context)
             except Exception as e:
                 log_callback(f"处理 Cookie Banner 时出错 (非致命): {e}")
             
-            total_items = 0
             seen_urls = set()
             page_num = 1
             
+            def write_page(n, page_items):
+                """立即写入一页数据"""
+                nonlocal total_items, pages_done
+                pages_done += 1
+                if page_items:
+                    log_callback(f"第 {n} 页提取到 {len(page_items)} 个新商品，正在写入文件...")
+                    with open(output_file, 'a', encoding='utf-8') as f:
+                        for item in page_items:
+                            line = f"{item['url']} # {item['title']}\n"
+                            f.write(line)
+                    total_items += len(page_items)
+                    log_callback(f"✓ 已写入，累计 {total_items} 个商品")
+                else:
+                    log_callback(f"第 {n} 页未提取到新商品。")
+                report(f"第 {n} 页", {'pages': pages_done, 'items': total_items})
+            
             while not stop_flag.is_set():
                 log_callback(f"--- 正在处理第 {page_num} 页 ---")
-                task_manager.update_status(scrape_progress=f"第 {page_num} 页")
+                report(f"第 {page_num} 页")
                 
                 # 滚动到底部
                 log_callback("滚动到底部...")
                 try:
-                    page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-                    time.sleep(3)
-                    page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-                    time.sleep(2)
+                    with tracer.stage('list_scroll', page=page_num):
+                        scroll_until_stable(page)
                 except Exception as e:
                     log_callback(f"滚动时发生错误: {e}")
-                    time.sleep(2)
+                    wait_for_settle(page)
 
                 # 提取商品信息
                 log_callback("正在提取本页商品信息...")
-                links = page.locator("a[href*='/buy/auction/']").all()
-                
-                page_items = []  # 当前页的商品
-                for link in links:
-                    if stop_flag.is_set():
-                        log_callback("收到停止信号，中断抓取...")
-                        break
-                        
-                    try:
-                        href = link.get_attribute("href")
-                        if not href: continue
-                        
-                        if href.startswith("/"):
-                            full_url = "https://www.sothebys.com" + href
-                        else:
-                            full_url = href
-                            
-                        if full_url in seen_urls: continue
-                        if full_url == url: continue
-                        
-                        title = link.inner_text().strip()
-                        if not title:
-                            h_tag = link.locator("h3, h4, p, div[class*='title']").first
-                            if h_tag.count() > 0:
-                                title = h_tag.inner_text().strip()
-                        
-                        title = title.replace("\n", " ").replace("\r", "")
-                        
-                        if full_url not in seen_urls:
-                            is_product = False
-                            if "/buy/auction/" in full_url:
-                                if full_url.split("?")[0] != url.split("?")[0]:
-                                    is_product = True
-                            
-                            if is_product:
-                                seen_urls.add(full_url)
-                                page_items.append({"title": title, "url": full_url})
-
-                    except Exception:
-                        pass
+                try:
+                    page_items = extract_lot_links(page, url, seen_urls, tracer)
+                except Exception as e:
+                    log_callback(f"提取商品信息时出错: {e}")
+                    page_items = []
                 
                 # 立即写入本页数据
-                if page_items:
-                    log_callback(f"第 {page_num} 页提取到 {len(page_items)} 个新商品，正在写入文件...")
-                    with open(output_file, 'a', encoding='utf-8') as f:
-                        for item in page_items:
-                            line = f"{item['url']} # {item['title']}\n"
-                            f.write(line)
-                    total_items += len(page_items)
-                    log_callback(f"✓ 已写入，累计 {total_items} 个商品")
-                else:
-                    log_callback(f"第 {page_num} 页未提取到新商品。")
+                write_page(page_num, page_items)
 
                 if stop_flag.is_set():
                     break
 
+                # 识别到总页数时并行抓取剩余分页，否则逐页点击
+                if page_num == 1 and page_workers > 1:
+                    done, page_num = scrape_pages_parallel(page, url, seen_urls, page_workers, write_page,
+                                                           stop_flag=stop_flag, log=log_callback, tracer=tracer)
+                    if done:
+                        break
+
                 # 翻页逻辑
                 log_callback("正在检查分页...")
                 next_button = page.locator("button[aria-label='Go to next page.']").first
@@ -161,18 +540,16 @@ def scrape_with_stop(url, output_file, stop_flag, log_callback):
                 
                 if is_visible and is_enabled:
                     log_callback("发现 'Next' 按钮，准备点击下一页...")
+                    previous = first_attribute(page, LOT_LINK_SELECTOR)
                     try:
                         next_button.scroll_into_view_if_needed()
-                        time.sleep(1)
                         next_button.click()
                         
-                        try:
-                            page.wait_for_load_state("networkidle", timeout=10000)
-                        except:
-                            pass
+                        # 列表内容被替换并稳定后继续
+                        if not wait_for_next_page(page, previous, tracer=tracer):
+                            log_callback("等待列表更新超时，继续...")
                         
                         page_num += 1
-                        time.sleep(5)
                         
                     except Exception as e:
                         log_callback(f"点击下一页时出错: {e}")
@@ -185,36 +562,70 @@ def scrape_with_stop(url, output_file, stop_flag, log_callback):
                 log_callback(f"抓取已停止，共提取到 {total_items} 个商品。")
             else:
                 log_callback(f"抓取结束，共提取到 {total_items} 个商品。")
-            
-            # 更新文件头的总数
-            if total_items > 0:
-                log_callback("更新文件统计信息...")
-                with open(output_file, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                
-                # 在第二行后插入总数
-                lines.insert(2, f"# Total Items: {total_items}\n")
-                
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    f.writelines(lines)
-                log_callback("文件更新完成！")
-            else:
-                log_callback("警告：未提取到任何商品。")
 
         except Exception as e:
-            log_callback(f"发生严重错误: {e}")
+            error = e
+            if total_items:
+                log_callback(f"已写入的 {total_items} 个商品保留在文件中。")
         finally:
-            browser.close()
-            task_manager.update_status(scraping=False, scrape_progress='')
+            page.close()
+            context.unroute("**/*")
+
+        # 更新文件头的总数 (中途出错时同样记录已写入的商品数)
+        if total_items > 0:
+            log_callback("更新文件统计信息...")
+            with open(output_file, 'r', encoding='utf-8') as f:
+                lines = f.readlines()
+            
+            # 在第二行后插入总数
+            lines.insert(2, f"# Total Items: {total_items}\n")
+            
+            with open(output_file, 'w', encoding='utf-8') as f:
+                f.writelines(lines)
+            log_callback("文件更新完成！")
+        else:
+            log_callback("警告：未提取到任何商品。")
+        if error is not None:
+            raise error
+
+    # 借用常驻浏览器中的预热上下文，不再每次启动 Chromium
+    browser_service.run(scrape_in_context)
+
+_download_state = {}
+_download_state_lock = threading.Lock()
+
+
+def shared_download_state():
+    """所有下载任务共用的 HTTP 缓存和任务清单
+
+    多个下载任务可以同时运行，各自打开同一个 SQLite 文件会互相抢写锁，
+    因此整个进程只保留一个连接 (两者内部都有锁，可以跨线程使用)。
+    """
+    with _download_state_lock:
+        if not _download_state:
+            _download_state['cache'] = HttpCache(os.path.join("下载", ".http_cache.sqlite"))
+            _download_state['manifest'] = JobManifest(os.path.join("下载", ".manifest.sqlite"))
+        return _download_state['cache'], _download_state['manifest']
+
 
-def download_with_stop(stop_flag, log_callback):
-    """支持停止的下载函数"""
+def close_download_state():
+    with _download_state_lock:
+        for item in _download_state.values():
+            item.close()
+        _download_state.clear()
+
+
+atexit.register(close_download_state)
+
+
+def download_with_stop(stop_flag, log_callback, scan_workers=1, urls_file="urls.txt", progress_callback=None,
+                       tracer=None):
+    """支持停止的下载函数，出错时抛出异常 (由任务调度器记录为失败)"""
     log_callback("启动批量下载器...")
+    report = progress_callback or (lambda text, stats=None: None)
     
-    urls_file = "urls.txt"
     if not os.path.exists(urls_file):
-        log_callback(f"错误: {urls_file} 不存在")
-        return
+        raise FileNotFoundError(f"{urls_file} 不存在")
     
     # 读取任务
     tasks = []
@@ -231,55 +642,40 @@ def download_with_stop(stop_flag, log_callback):
                 tasks.append((url, title))
     
     log_callback(f"共读取到 {len(tasks)} 个任务。")
+    if scan_workers > 1:
+        log_callback(f"并行扫描浏览器数: {scan_workers}")
     
-    # 创建下载器
+    def on_progress(progress):
+        # 分阶段进度：扫描 / 下载，结构化计数与速率一并推送
+        report(f"扫描 {progress['scanned']}/{progress['total']} · 下载 {progress['downloaded']}/{progress['total']}",
+               progress)
+
+    # 创建下载器：重跑时未变化的图片返回 304 无需重新下载，中断后再次下载时跳过已完成的商品
+    cache, manifest = shared_download_state()
     downloader = ImageDownloader(
         min_width=3840,
         min_height=2160,
         headless=True,
         base_dir="下载",
-        stop_flag=stop_flag  # 传递停止标志
+        stop_flag=stop_flag,  # 传递停止标志
+        progress_callback=on_progress,
+        scan_workers=scan_workers,
+        cache=cache,
+        manifest=manifest,
+        browser_service=browser_service,  # 商品页在常驻浏览器的预热上下文中扫描
+        log=log_callback,  # 下载器的日志进入日志总线
+        tracer=tracer
     )
     
-    from playwright.sync_api import sync_playwright
-    
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        
-        for i, (url, title) in enumerate(tasks):
-            if stop_flag.is_set():
-                log_callback("收到停止信号，中断下载...")
-                break
-            
-            log_callback(f"\n{'='*20} 正在执行任务 [{i+1}/{len(tasks)}] {'='*20}")
-            task_manager.update_status(download_progress=f"{i+1}/{len(tasks)}")
-            
-            try:
-                context = browser.new_context()
-                page = context.new_page()
-                
-                fetched_title = downloader._scan_page(page, url)
-                
-                # 使用title(如果有),否则使用fetched_title,不添加序号
-                if title:
-                    final_title = title
-                else:
-                    final_title = fetched_title
-                
-                save_dir = downloader.sanitize_filename(final_title)
-                log_callback(f"保存目录: {save_dir}")
-                
-                context.close()
-                
-                # 下载图片
-                downloader._download_images(save_dir)
-                
-            except Exception as e:
-                log_callback(f"❌ 任务失败: {url}\n原因: {e}")
-        
-        browser.close()
+    # 扫描与下载流水线并行执行
+    progress = downloader.run_pipeline(tasks)
+    if stop_flag.is_set():
+        log_callback("收到停止信号，已中断下载。")
+    if progress.get('skipped'):
+        log_callback(f"跳过已完成的 {progress['skipped']} 个商品。")
+    if progress.get('failed'):
+        log_callback(f"有 {progress['failed']} 个任务失败。")
     
-    task_manager.update_status(downloading=False, download_progress='')
     log_callback("下载任务完成！")
 
 @app.route('/')
@@ -287,74 +683,180 @@ def index():
     """主页"""
     return render_template('index.html')
 
+def _latest_scrape_output():
+    """最近一个完成的抓取任务的输出文件"""
+    done = [j for j in scheduler.list() if j.kind == 'scrape' and j.state == JOB_DONE and j.output_file]
+    return max(done, key=lambda j: j.finished).output_file if done else None
+
 @app.route('/api/scrape', methods=['POST'])
 def start_scrape():
-    """启动抓取任务"""
-    data = request.json
+    """提交抓取任务"""
+    data = request.get_json(silent=True) or {}
     url = data.get('url')
+    try:
+        page_workers = int(data.get('page_workers', 4))
+        priority = int(data.get('priority', 0))
+        trace = bool(data.get('trace', False))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'page_workers 和 priority 必须是整数'})
+    page_workers = max(1, min(page_workers, 8))
     
     if not url:
         return jsonify({'success': False, 'message': '请提供URL'})
     
-    if task_manager.status['scraping']:
-        return jsonify({'success': False, 'message': '抓取任务正在进行中'})
-    
-    # 重置停止标志
-    task_manager.stop_flag.clear()
-    task_manager.update_status(scraping=True, scrape_progress='准备中...')
-    
-    # 启动抓取线程
-    task_manager.scrape_thread = threading.Thread(
-        target=scrape_with_stop,
-        args=(url, "urls.txt", task_manager.stop_flag, task_manager.log)
-    )
-    task_manager.scrape_thread.start()
+    def target(job):
+        # 每个抓取任务写入自己的列表文件，互不覆盖
+        job.output_file = os.path.join(JOBS_DIR, f"{job.id}_urls.txt")
+        tracer = job.tracer(trace)
+        try:
+            scrape_with_stop(url, job.output_file, job.stop_flag, job.log,
+                             page_workers=page_workers, progress_callback=job.set_progress, tracer=tracer)
+        finally:
+            job.save_trace(tracer)
     
-    return jsonify({'success': True, 'message': '抓取任务已启动'})
+    job = scheduler.submit('scrape', target, {'url': url, 'page_workers': page_workers, 'trace': trace},
+                           priority=priority)
+    return jsonify({'success': True, 'message': '抓取任务已加入队列', 'job_id': job.id})
 
 @app.route('/api/download', methods=['POST'])
 def start_download():
-    """启动下载任务"""
-    if task_manager.status['downloading']:
-        return jsonify({'success': False, 'message': '下载任务正在进行中'})
+    """提交下载任务"""
+    data = request.get_json(silent=True) or {}
     
-    # 重置停止标志
-    task_manager.stop_flag.clear()
-    task_manager.update_status(downloading=True, download_progress='准备中...')
+    # 并行扫描数不超过常驻浏览器数
+    try:
+        scan_workers = int(data.get('scan_workers', 1))
+        priority = int(data.get('priority', 0))
+        trace = bool(data.get('trace', False))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'scan_workers 和 priority 必须是整数'})
+    scan_workers = max(1, min(scan_workers, browser_service.workers))
     
-    # 启动下载线程
-    task_manager.download_thread = threading.Thread(
-        target=download_with_stop,
-        args=(task_manager.stop_flag, task_manager.log)
-    )
-    task_manager.download_thread.start()
+    # 指定抓取任务时下载它的列表，否则使用最近完成的抓取任务 (都没有时读取 urls.txt)
+    source = data.get('scrape_job')
+    if source:
+        scrape_job = scheduler.get(source)
+        if scrape_job is None or not scrape_job.output_file:
+            return jsonify({'success': False, 'message': f'抓取任务 {source} 不存在或尚未开始'})
+        urls_file = scrape_job.output_file
+    else:
+        urls_file = _latest_scrape_output() or "urls.txt"
     
-    return jsonify({'success': True, 'message': '下载任务已启动'})
+    def target(job):
+        tracer = job.tracer(trace)
+        try:
+            download_with_stop(job.stop_flag, job.log, scan_workers, urls_file=urls_file,
+                               progress_callback=job.set_progress, tracer=tracer)
+        finally:
+            job.save_trace(tracer)
+    
+    job = scheduler.submit('download', target, {'urls_file': urls_file, 'scan_workers': scan_workers, 'trace': trace},
+                           priority=priority, cost=scan_workers)
+    return jsonify({'success': True, 'message': '下载任务已加入队列', 'job_id': job.id})
 
 @app.route('/api/stop', methods=['POST'])
 def stop_task():
-    """停止当前任务"""
-    task_manager.stop_flag.set()
-    task_manager.log("正在停止任务...")
+    """停止任务：指定 job_id 时只停止该任务，否则停止全部任务"""
+    data = request.get_json(silent=True) or {}
+    job_id = data.get('job_id')
+    if job_id:
+        if not scheduler.cancel(job_id):
+            return jsonify({'success': False, 'message': f'任务 {job_id} 不存在或已结束'})
+        return jsonify({'success': True, 'message': '停止信号已发送'})
+    scheduler.cancel_all()
+    task_manager.log("正在停止全部任务...")
     return jsonify({'success': True, 'message': '停止信号已发送'})
 
 @app.route('/api/status', methods=['GET'])
 def get_status():
-    """获取当前状态"""
-    return jsonify(task_manager.status)
+    """获取当前状态 (兼容旧界面的汇总字段 + 任务列表)"""
+    scraping = scheduler.running('scrape')
+    downloading = scheduler.running('download')
+    return jsonify({
+        'scraping': bool(scraping),
+        'downloading': bool(downloading),
+        'scrape_progress': scraping[0].progress if scraping else '',
+        'download_progress': downloading[0].progress if downloading else '',
+        'jobs': [j.to_dict() for j in scheduler.list()],
+    })
+
+@app.route('/api/jobs', methods=['GET'])
+def list_jobs():
+    """列出所有任务 (最新的在前)"""
+    return jsonify({'jobs': [j.to_dict() for j in scheduler.list()],
+                    'budget': scheduler.budget, 'in_use': scheduler.in_use})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查看单个任务"""
+    job = scheduler.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': f'任务 {job_id} 不存在'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """取消单个任务"""
+    if not scheduler.cancel(job_id):
+        return jsonify({'success': False, 'message': f'任务 {job_id} 不存在或已结束'})
+    return jsonify({'success': True, 'message': '停止信号已发送'})
 
 @app.route('/api/logs')
 def stream_logs():
-    """SSE日志流"""
+    """SSE 日志流
+
+    每个连接独立读取日志总线：
+    - 重连时浏览器带上 Last-Event-ID (或 ?last_id=)，从断点继续
+    - 日志密集时一帧发送多行 (多个 data: 行，前端按换行拆分)
+    - 任务状态和结构化进度以 "job" 事件推送 (data 为任务的 JSON 快照)，
+      连接建立时先推送所有任务的当前快照，之后只推送变化的任务
+    - ?job=<ID> 只接收该任务的日志和快照
+    - 15 秒没有新日志时发送一次 SSE 注释作为心跳
+    """
+    job_id = request.args.get('job') or None
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_id')
+    try:
+        after = int(last_id)
+    except (TypeError, ValueError):
+        # 新连接先补发最近的 200 行
+        after = max(0, task_manager.seq - 200)
+
     def generate():
-        while True:
-            try:
-                log = task_manager.log_queue.get(timeout=1)
-                yield f"data: {log}\n\n"
-            except queue.Empty:
-                yield f"data: \n\n"  # 心跳
+        cursor = after
+        version = 0
+        REGISTRY.add('sse_clients', 1)
+        try:
+            while True:
+                entries, cursor, jobs, version = task_manager.read(cursor, version, job_id=job_id)
+                if not entries and not jobs:
+                    yield ": ping\n\n"
+                    continue
+                for snapshot in jobs:
+                    yield f"event: job\ndata: {json.dumps(snapshot, ensure_ascii=False)}\n\n"
+                if not entries:
+                    continue
+                data = "\n".join(f"data: {part}" for _, line in entries for part in line.split("\n"))
+                yield f"id: {entries[-1][0]}\n{data}\n\n"
+        finally:
+            # 客户端断开时 Flask 关闭生成器
+            REGISTRY.add('sse_clients', -1)
     
-    return Response(generate(), mimetype='text/event-stream')
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+@app.route('/api/metrics')
+def metrics():
+    """Prometheus 文本格式的运行指标 (各阶段耗时直方图、HTTP 状态码分布、任务与日志总线状态)"""
+    counts = dict.fromkeys((JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_CANCELLED), 0)
+    for job in scheduler.list():
+        counts[job.state] += 1
+    for state, n in counts.items():
+        REGISTRY.set('jobs', n, state=state)
+    REGISTRY.set('scheduler_workers_in_use', scheduler.in_use)
+    REGISTRY.set('scheduler_workers_budget', scheduler.budget)
+    REGISTRY.set('log_buffer_lines', len(task_manager.buffer))
+    for key, value in browser_service.stats.items():
+        REGISTRY.set('browser_service_' + key, value)
+    return Response(REGISTRY.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     # 确保下载目录存在
@@ -0,0 +1,7 @@
+"""离线基准测试
+
+- fixture_server：本地 HTTP 服务，模拟拍卖列表页、商品页和图片 CDN
+- run_bench：针对本地服务运行列表抓取、批量下载和 Web 任务函数，输出吞吐与资源占用
+
+用法见 README 的“基准测试”一节。
+"""
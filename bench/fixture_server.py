@@ -0,0 +1,348 @@
+"""基准测试用的本地站点：模拟 Sotheby's 拍卖列表页、商品页和图片 CDN
+
+- 列表页 /buy/auction/2024/bench-sale?page=N：每页 lots_per_page 个商品卡片，
+  带 "Go to page N." 分页按钮和 "Go to next page." 按钮 (点击后跳转到下一页)，缩略图懒加载
+- 商品页 /buy/auction/2024/bench-sale/lot-K：h1 标题、懒加载的缩略图 (data-src / srcset)、
+  滚动后才插入的图片，以及带原图地址和尺寸的 __NEXT_DATA__
+- 图片 /cdn/<商品>/<序号>.<格式>：原图为 JPEG/PNG/WebP，尺寸相对 target 尺寸取若干档
+  (其中一档小于过滤条件)，带 ?width=N 时返回缩略图；支持 ETag / If-None-Match
+
+latency_ms 为每个请求的首字节延迟，bandwidth_kbps 为单个连接的带宽 (0 表示不限速)。
+单独运行：python -m bench.fixture_server --port 8800
+"""
+import argparse
+import io
+import json
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from PIL import Image
+
+SALE_PATH = "/buy/auction/2024/bench-sale"
+FORMATS = ('jpeg', 'png', 'webp')
+CONTENT_TYPES = {'jpeg': 'image/jpeg', 'png': 'image/png', 'webp': 'image/webp'}
+CHUNK_SIZE = 16 * 1024
+
+
+class FixtureConfig:
+    """站点规模与网络条件"""
+
+    def __init__(self, pages=3, lots_per_page=12, images_per_lot=4, target_width=3840, target_height=2160,
+                 latency_ms=0, bandwidth_kbps=0, thumb_width=400):
+        self.pages = pages
+        self.lots_per_page = lots_per_page
+        self.images_per_lot = images_per_lot
+        self.target_width = target_width
+        self.target_height = target_height
+        self.latency_ms = latency_ms
+        self.bandwidth_kbps = bandwidth_kbps
+        self.thumb_width = thumb_width
+
+    @property
+    def total_lots(self):
+        return self.pages * self.lots_per_page
+
+    def image_size(self, index):
+        """第 index 张图的原图尺寸：横图、竖图、更大的横图、一张不满足过滤条件的小图"""
+        w, h = self.target_width, self.target_height
+        plan = [(w, h), (h, w), (w * 5 // 4, h * 5 // 4), (w // 2, h // 2)]
+        return plan[index % len(plan)]
+
+    def image_format(self, index):
+        return FORMATS[index % len(FORMATS)]
+
+    def expected_images(self):
+        """每个商品能通过尺寸过滤的图片数 (与 ImageDownloader._is_valid_size 的规则一致)"""
+        tw, th = self.target_width, self.target_height
+        passed = 0
+        for i in range(self.images_per_lot):
+            w, h = self.image_size(i)
+            if (w >= tw and h >= th) or (h >= tw and w >= th) or max(w, h) >= tw:
+                passed += 1
+        return passed
+
+
+def _render_image(width, height, fmt):
+    """渐变叠加噪点：压缩率接近照片，不会像纯色图那样小得不真实"""
+    gradient = Image.linear_gradient('L')
+    base = Image.merge('RGB', (gradient.resize((width, height)), gradient.rotate(90).resize((width, height)),
+                               gradient.rotate(180).resize((width, height))))
+    noise = Image.effect_noise((width, height), 48).convert('RGB')
+    image = Image.blend(base, noise, 0.2)
+    out = io.BytesIO()
+    if fmt == 'png':
+        image.save(out, 'PNG', compress_level=1)
+    else:
+        image.save(out, fmt.upper(), quality=85)
+    return out.getvalue()
+
+
+class ImageCache:
+    """按 (宽, 高, 格式) 缓存生成的图片，同一尺寸只生成一次"""
+
+    def __init__(self):
+        self.images = {}
+        self.lock = threading.Lock()
+        self.key_locks = {}
+
+    def get(self, width, height, fmt):
+        key = (width, height, fmt)
+        with self.lock:
+            data = self.images.get(key)
+            if data is not None:
+                return data
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            data = self.images.get(key)
+            if data is None:
+                data = _render_image(width, height, fmt)
+                with self.lock:
+                    self.images[key] = data
+        return data
+
+
+def _lot_id(page_num, index, config):
+    return (page_num - 1) * config.lots_per_page + index + 1
+
+
+def _list_page(config, page_num):
+    cards = []
+    for i in range(config.lots_per_page):
+        lot = _lot_id(page_num, i, config)
+        href = f"{SALE_PATH}/lot-{lot:04d}"
+        thumb = f"/cdn/lot-{lot:04d}/0.jpeg?width={config.thumb_width}"
+        cards.append(
+            f'<li class="card"><a href="{href}"><img data-src="{thumb}" alt=""></a>'
+            f'<a href="{href}"><h3>Bench Lot {lot}</h3></a>'
+            f'<p>Lot {lot}</p><p>Estimate: {lot * 1000:,} - {lot * 1500:,} HKD</p></li>'
+        )
+    pagination = "".join(
+        f'<button aria-label="Go to page {n}." onclick="location.href=\'?page={n}\'">{n}</button>'
+        for n in range(1, config.pages + 1)
+    )
+    disabled = " disabled" if page_num >= config.pages else ""
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Bench Sale - Page {page_num}</title></head>
+<body>
+<h1>Bench Sale</h1>
+<ul id="lots">{''.join(cards)}</ul>
+<nav aria-label="pagination">{pagination}
+<button aria-label="Go to next page."{disabled} onclick="location.href='?page={page_num + 1}'">Next</button></nav>
+<script>
+// 缩略图懒加载：进入视口后才设置 src
+const io = new IntersectionObserver(entries => entries.forEach(e => {{
+    if (e.isIntersecting) {{ e.target.src = e.target.dataset.src; io.unobserve(e.target); }}
+}}));
+document.querySelectorAll('img[data-src]').forEach(img => io.observe(img));
+</script>
+</body></html>"""
+
+
+def _lot_page(config, lot, base_url):
+    name = f"lot-{lot:04d}"
+    images = []
+    thumbs = []
+    for i in range(config.images_per_lot):
+        width, height = config.image_size(i)
+        url = f"/cdn/{name}/{i}.{config.image_format(i)}"
+        # __NEXT_DATA__ 中是绝对地址 (与真实站点一致)，DOM 中是相对地址
+        images.append({'url': base_url + url, 'width': width, 'height': height})
+        thumbs.append(
+            f'<img data-src="{url}?width={config.thumb_width}" '
+            f'srcset="{url}?width={config.thumb_width} 1x, {url}?width={config.thumb_width * 2} 2x" alt="">'
+        )
+    next_data = {'props': {'pageProps': {'lot': {'title': f"Bench Lot {lot}", 'lotNumber': lot, 'media': images}}}}
+    # 最后一张缩略图在滚动到底部后才插入页面
+    late = thumbs.pop() if len(thumbs) > 1 else ''
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Bench Lot {lot}</title></head>
+<body>
+<h1>Bench Lot {lot}</h1>
+<div id="gallery">{''.join(thumbs)}</div>
+<div style="height:3000px"></div>
+<div id="more"></div>
+<script id="__NEXT_DATA__" type="application/json">{json.dumps(next_data)}</script>
+<script>
+const io = new IntersectionObserver(entries => entries.forEach(e => {{
+    if (e.isIntersecting) {{ e.target.src = e.target.dataset.src; io.unobserve(e.target); }}
+}}));
+document.querySelectorAll('img[data-src]').forEach(img => io.observe(img));
+let inserted = false;
+window.addEventListener('scroll', () => {{
+    if (inserted || window.scrollY + window.innerHeight < document.body.scrollHeight - 10) return;
+    inserted = true;
+    document.getElementById('more').innerHTML = {json.dumps(late)};
+    document.querySelectorAll('#more img[data-src]').forEach(img => {{ img.src = img.dataset.src; }});
+}});
+</script>
+</body></html>"""
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive，与真实 CDN 一致
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        config = server.config
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        server.count('requests')
+        if config.latency_ms:
+            time.sleep(config.latency_ms / 1000)
+
+        path = parsed.path.rstrip('/')
+        if path == SALE_PATH:
+            page_num = int(query.get('page', ['1'])[0])
+            if not 1 <= page_num <= config.pages:
+                return self._send(404, b"not found", 'text/plain')
+            server.count('list_pages')
+            return self._send(200, _list_page(config, page_num).encode('utf-8'), 'text/html; charset=utf-8')
+        if path.startswith(SALE_PATH + "/lot-"):
+            lot = int(path.rsplit('-', 1)[1])
+            if not 1 <= lot <= config.total_lots:
+                return self._send(404, b"not found", 'text/plain')
+            server.count('lot_pages')
+            base_url = f"http://{self.headers.get('Host') or '%s:%d' % server.server_address[:2]}"
+            return self._send(200, _lot_page(config, lot, base_url).encode('utf-8'), 'text/html; charset=utf-8')
+        if path.startswith("/cdn/"):
+            return self._image(path, query)
+        self._send(404, b"not found", 'text/plain')
+
+    def _image(self, path, query):
+        server = self.server
+        config = server.config
+        try:
+            _, _, lot_name, filename = path.split('/')
+            index, fmt = filename.split('.')
+            index = int(index)
+        except ValueError:
+            return self._send(404, b"not found", 'text/plain')
+        if fmt not in CONTENT_TYPES or index >= config.images_per_lot:
+            return self._send(404, b"not found", 'text/plain')
+        width, height = config.image_size(index)
+        if 'width' in query:
+            # 缩略图按宽度等比缩小
+            thumb = min(int(query['width'][0]), width)
+            width, height = thumb, max(1, height * thumb // config.image_size(index)[0])
+        etag = f'"{lot_name}-{index}-{width}x{height}.{fmt}"'
+        if self.headers.get('If-None-Match') == etag:
+            server.count('not_modified')
+            return self._send(304, b"", None, {'ETag': etag})
+        server.count('images')
+        data = server.images.get(width, height, fmt)
+        self._send(200, data, CONTENT_TYPES[fmt], {'ETag': etag, 'Cache-Control': 'max-age=0'})
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        if self.command == 'HEAD' or not body:
+            return
+        bandwidth = self.server.config.bandwidth_kbps * 1024 / 8  # 字节/秒
+        try:
+            for start in range(0, len(body), CHUNK_SIZE):
+                chunk = body[start:start + CHUNK_SIZE]
+                self.wfile.write(chunk)
+                self.server.count('bytes', len(chunk))
+                if bandwidth:
+                    time.sleep(len(chunk) / bandwidth)
+        except (BrokenPipeError, ConnectionResetError):
+            # 下载器读到文件头判断尺寸不够后会直接关闭连接
+            self.close_connection = True
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """在后台线程中运行的本地站点，counters 记录请求数和发送的字节数"""
+
+    daemon_threads = True
+
+    def __init__(self, config=None, host='127.0.0.1', port=0):
+        super().__init__((host, port), FixtureHandler)
+        self.config = config or FixtureConfig()
+        self.images = ImageCache()
+        self.counters = {}
+        self.counter_lock = threading.Lock()
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def list_url(self):
+        return self.base_url + SALE_PATH
+
+    def lot_urls(self):
+        """所有商品页，格式与 urls.txt 的任务一致：[(URL, 标题)]"""
+        return [(f"{self.base_url}{SALE_PATH}/lot-{lot:04d}", f"Bench Lot {lot}")
+                for lot in range(1, self.config.total_lots + 1)]
+
+    def count(self, key, n=1):
+        with self.counter_lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def snapshot(self):
+        with self.counter_lock:
+            return dict(self.counters)
+
+    def warm_up(self):
+        """预先生成所有原图和缩略图，避免生成时间计入基准"""
+        config = self.config
+        for i in range(config.images_per_lot):
+            width, height = config.image_size(i)
+            fmt = config.image_format(i)
+            self.images.get(width, height, fmt)
+            for thumb in (config.thumb_width, config.thumb_width * 2):
+                t = min(thumb, width)
+                self.images.get(t, max(1, height * t // width), fmt)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="fixture-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def handle_error(self, request, client_address):
+        # 客户端提前断开 (尺寸不满足要求时关闭响应、进程退出时关闭空闲连接) 属于正常情况
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="基准测试用的本地拍卖站点")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址 (默认: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8800, help="监听端口 (默认: 8800)")
+    parser.add_argument("--pages", type=int, default=3, help="列表页数 (默认: 3)")
+    parser.add_argument("--lots-per-page", type=int, default=12, help="每页商品数 (默认: 12)")
+    parser.add_argument("--images-per-lot", type=int, default=4, help="每个商品的图片数 (默认: 4)")
+    parser.add_argument("--width", type=int, default=3840, help="过滤条件的宽度，原图尺寸以此为基准 (默认: 3840)")
+    parser.add_argument("--height", type=int, default=2160, help="过滤条件的高度 (默认: 2160)")
+    parser.add_argument("--latency-ms", type=int, default=0, help="每个请求的首字节延迟 (默认: 0)")
+    parser.add_argument("--bandwidth-kbps", type=int, default=0, help="单个连接的带宽 kbit/s，0 表示不限速 (默认: 0)")
+    args = parser.parse_args()
+
+    server = FixtureServer(FixtureConfig(args.pages, args.lots_per_page, args.images_per_lot, args.width, args.height,
+                                         args.latency_ms, args.bandwidth_kbps), args.host, args.port)
+    print("正在生成图片...")
+    server.warm_up()
+    print(f"列表页: {server.list_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,316 @@
+"""离线基准测试：针对本地模拟站点运行抓取与下载，输出吞吐和资源占用
+
+每个场景在独立的 spawn 子进程和临时目录中运行，峰值内存与 CPU 时间互不干扰：
+- list：list_scraper.scrape_sothebys_list 抓取全部列表页
+- download-http：ImageDownloader.run_batch，HTTP 快速扫描
+- download-browser：ImageDownloader.run_batch，Playwright 扫描
+- app-scrape / app-download：Web 服务的任务函数 scrape_with_stop / download_with_stop
+  (与 Web 界面一样借用常驻浏览器；download_with_stop 固定使用 3840x2160 过滤条件)
+
+输出 商品/分钟、图片/秒、传输字节 (服务端统计)、峰值 RSS 和 CPU 时间；
+--output 保存 JSON 结果，--baseline 与之前的结果比较，吞吐下降超过 --tolerance 时退出码为 1。
+
+python -m bench.run_bench --scenarios download-http --output bench.json
+python -m bench.run_bench --baseline bench.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from bench.fixture_server import FixtureServer, FixtureConfig
+
+SCENARIOS = ('list', 'download-http', 'download-browser', 'app-scrape', 'app-download')
+GATED_FIELDS = ('lots_per_min', 'images_per_s')  # 参与回归比较的吞吐指标
+
+
+def _write_urls(path, tasks):
+    with open(path, 'w', encoding='utf-8') as f:
+        for url, title in tasks:
+            f.write(f"{url} # {title}\n")
+
+
+def _count_urls(path):
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding='utf-8') as f:
+        return sum(1 for line in f if line.strip() and not line.startswith('#'))
+
+
+def _counter(summary, key):
+    return summary['counters'].get(key, 0)
+
+
+def _run_list(ctx):
+    from list_scraper import scrape_sothebys_list
+    items = scrape_sothebys_list(ctx['list_url'], "urls.txt", page_workers=ctx['page_workers'])
+    return {'lots': len(items), 'images': 0}
+
+
+def _run_download(ctx, scan_mode):
+    from image_extractor import ImageDownloader
+    downloader = ImageDownloader(
+        min_width=ctx['width'], min_height=ctx['height'], base_dir="下载", scan_workers=ctx['scan_workers'],
+        engine=ctx['engine'], scan_mode=scan_mode,
+    )
+    downloader.run_batch(ctx['tasks'])
+    return None  # 商品数和图片数从指标中读取
+
+
+def _run_app_scrape(ctx):
+    import app
+    try:
+        app.scrape_with_stop(ctx['list_url'], "urls.txt", threading.Event(), print, page_workers=ctx['page_workers'])
+    finally:
+        app.browser_service.close()
+    return {'lots': _count_urls("urls.txt"), 'images': 0}
+
+
+def _run_app_download(ctx):
+    import app
+    _write_urls("urls.txt", ctx['tasks'])
+    try:
+        app.download_with_stop(threading.Event(), print, ctx['scan_workers'], urls_file="urls.txt")
+    finally:
+        app.browser_service.close()
+    return None
+
+
+RUNNERS = {
+    'list': _run_list,
+    'download-http': lambda ctx: _run_download(ctx, 'http'),
+    'download-browser': lambda ctx: _run_download(ctx, 'browser'),
+    'app-scrape': _run_app_scrape,
+    'app-download': _run_app_download,
+}
+
+
+def _reset_peak_rss():
+    """重置本进程的内存峰值 (VmHWM)，返回能否读取 /proc/self/status
+
+    spawn 子进程经 fork+exec 启动，ru_maxrss 会继承父进程的峰值 (父进程生成了全部图片)，
+    所以 Linux 上改为在场景开始时清零 VmHWM，结束时读取。
+    """
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+        return _read_status_kb('VmHWM') is not None
+    except OSError:
+        return False
+
+
+def _read_status_kb(field):
+    try:
+        with open("/proc/self/status", encoding='utf-8') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _run_scenario(name, ctx, results):
+    """子进程入口：在临时目录中运行一个场景，结果放入 results 队列"""
+    from metrics import REGISTRY
+    hwm = _reset_peak_rss()
+    workdir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    os.chdir(workdir)
+    log = open("bench.log", 'w', encoding='utf-8')
+    if not ctx['verbose']:
+        sys.stdout = log  # 下载器的日志写入临时目录，不刷屏
+    error = None
+    started = time.perf_counter()
+    try:
+        counts = RUNNERS[name](ctx)
+    except Exception as e:
+        counts = None
+        error = f"{type(e).__name__}: {str(e).strip().splitlines()[0] if str(e).strip() else ''}"
+    seconds = time.perf_counter() - started
+    summary = REGISTRY.summary()
+    if counts is None:
+        counts = {'lots': _counter(summary, 'lots_total{result="downloaded"}'),
+                  'images': _counter(summary, 'image_requests_total{result="saved"}')}
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    peak_kb = (_read_status_kb('VmHWM') if hwm else None) or own.ru_maxrss  # Linux 上 ru_maxrss 单位为 KB
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)  # 已退出的浏览器与驱动进程
+    sys.stdout = sys.__stdout__
+    log.close()
+    results.put({
+        'scenario': name, 'error': error, 'seconds': round(seconds, 3),
+        'lots': counts['lots'], 'images': counts['images'],
+        'cpu_seconds': round(own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime, 3),
+        'rss_peak_mb': round(peak_kb / 1024, 1),
+        'children_rss_peak_mb': round(children.ru_maxrss / 1024, 1),
+        'stages': {key: {'count': v['count'], 'mean': v['mean'], 'p95': v['p95']}
+                   for key, v in summary['histograms'].items()},
+        'workdir': workdir,
+    })
+    if not ctx['keep']:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_once(server, name, ctx, timeout):
+    """运行一次场景并补上服务端统计的流量与吞吐"""
+    before = server.snapshot()
+    mp = multiprocessing.get_context('spawn')
+    results = mp.Queue()
+    proc = mp.Process(target=_run_scenario, args=(name, ctx, results))
+    proc.start()
+    try:
+        result = results.get(timeout=timeout)
+    except Exception:
+        proc.terminate()
+        result = {'scenario': name, 'error': f"超时 ({timeout} 秒)", 'seconds': float(timeout), 'lots': 0,
+                  'images': 0, 'cpu_seconds': 0.0, 'rss_peak_mb': 0.0, 'children_rss_peak_mb': 0.0, 'stages': {}}
+    proc.join()
+    after = server.snapshot()
+
+    seconds = max(result['seconds'], 1e-6)
+    sent = after.get('bytes', 0) - before.get('bytes', 0)
+    result['bytes'] = sent
+    result['requests'] = after.get('requests', 0) - before.get('requests', 0)
+    result['lots_per_min'] = round(result['lots'] / seconds * 60, 2)
+    result['images_per_s'] = round(result['images'] / seconds, 2)
+    result['mb_per_s'] = round(sent / seconds / (1024 * 1024), 2)
+    return result
+
+
+def run_scenario(server, name, ctx, repeat, timeout):
+    """运行 repeat 次，取耗时的中位数那一次 (减少偶然抖动)"""
+    runs = [run_once(server, name, ctx, timeout) for _ in range(max(1, repeat))]
+    ok = [r for r in runs if not r['error']] or runs
+    median = statistics.median_low([r['seconds'] for r in ok])
+    return next(r for r in ok if r['seconds'] == median)
+
+
+def check_expected(result, config, ctx):
+    """检查结果是否完整：所有商品都已处理，下载场景另外比对满足过滤条件的图片数"""
+    if result['lots'] != config.total_lots:
+        expected, got = config.total_lots, result['lots']
+    elif result['scenario'] in ('list', 'app-scrape'):
+        expected, got = config.total_lots, result['lots']
+    else:
+        size = (3840, 2160) if result['scenario'] == 'app-download' else (ctx['width'], ctx['height'])
+        # 过滤条件与站点原图基准尺寸一致时才能算出预期图片数
+        same = size == (config.target_width, config.target_height)
+        expected, got = (config.total_lots * config.expected_images() if same else None), result['images']
+    result['expected'] = expected
+    result['complete'] = expected is None or got == expected
+
+
+def compare(results, baseline, tolerance):
+    """与基线比较吞吐，返回回归列表 [(场景, 指标, 基线值, 当前值)]"""
+    previous = {r['scenario']: r for r in baseline.get('results', []) if not r.get('error')}
+    regressions = []
+    for r in results:
+        base = previous.get(r['scenario'])
+        if base is None or r['error']:
+            continue
+        for field in GATED_FIELDS:
+            if base.get(field) and r[field] < base[field] * (1 - tolerance):
+                regressions.append((r['scenario'], field, base[field], r[field]))
+    return regressions
+
+
+def print_table(results):
+    header = f"{'场景':<18}{'耗时(s)':>9}{'商品':>6}{'图片':>6}{'商品/分':>9}{'图片/s':>8}{'MB':>9}{'MB/s':>7}" \
+             f"{'CPU(s)':>8}{'RSS(MB)':>9}{'子进程RSS':>10}"
+    print(header)
+    for r in results:
+        if r['error']:
+            print(f"{r['scenario']:<18}失败: {r['error']}")
+            continue
+        flag = '' if r.get('complete', True) else f"  (不完整，预期 {r['expected']})"
+        print(f"{r['scenario']:<18}{r['seconds']:>9.2f}{r['lots']:>6}{r['images']:>6}{r['lots_per_min']:>9.1f}"
+              f"{r['images_per_s']:>8.2f}{r['bytes'] / 1024 / 1024:>9.1f}{r['mb_per_s']:>7.1f}"
+              f"{r['cpu_seconds']:>8.1f}{r['rss_peak_mb']:>9.1f}{r['children_rss_peak_mb']:>10.1f}{flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="离线基准测试 (本地模拟站点)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"逗号分隔的场景列表 (默认: 全部): {', '.join(SCENARIOS)}")
+    parser.add_argument("--pages", type=int, default=3, help="列表页数 (默认: 3)")
+    parser.add_argument("--lots-per-page", type=int, default=12, help="每页商品数 (默认: 12)")
+    parser.add_argument("--images-per-lot", type=int, default=4, help="每个商品的图片数 (默认: 4)")
+    parser.add_argument("--width", type=int, default=3840, help="过滤条件宽度，站点原图尺寸以此为基准 (默认: 3840)")
+    parser.add_argument("--height", type=int, default=2160, help="过滤条件高度 (默认: 2160)")
+    parser.add_argument("--latency-ms", type=int, default=20, help="每个请求的首字节延迟 (默认: 20)")
+    parser.add_argument("--bandwidth-kbps", type=int, default=0, help="单个连接的带宽 kbit/s，0 表示不限速 (默认: 0)")
+    parser.add_argument("--scan-workers", type=int, default=2, help="下载场景的并行扫描数 (默认: 2)")
+    parser.add_argument("--page-workers", type=int, default=4, help="列表场景的并行分页数 (默认: 4)")
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads", help="下载后端 (默认: threads)")
+    parser.add_argument("--repeat", type=int, default=1, help="每个场景运行次数，取耗时中位数 (默认: 1)")
+    parser.add_argument("--timeout", type=int, default=900, help="单次场景的超时秒数 (默认: 900)")
+    parser.add_argument("--output", default=None, help="把结果保存为 JSON 文件")
+    parser.add_argument("--baseline", default=None, help="与之前保存的 JSON 结果比较")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="允许的吞吐下降比例 (默认: 0.1)")
+    parser.add_argument("--verbose", action="store_true", help="显示各场景的运行日志")
+    parser.add_argument("--keep", action="store_true", help="保留各场景的临时目录 (含日志和下载结果)")
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = [n for n in names if n not in RUNNERS]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}")
+
+    config = FixtureConfig(args.pages, args.lots_per_page, args.images_per_lot, args.width, args.height,
+                           args.latency_ms, args.bandwidth_kbps)
+    server = FixtureServer(config).start()
+    print(f"本地站点: {server.list_url} ({config.total_lots} 个商品，每个 {config.images_per_lot} 张图)")
+    print("正在生成图片...")
+    server.warm_up()
+
+    ctx = {
+        'list_url': server.list_url, 'tasks': server.lot_urls(), 'width': args.width, 'height': args.height,
+        'scan_workers': args.scan_workers, 'page_workers': args.page_workers, 'engine': args.engine,
+        'verbose': args.verbose, 'keep': args.keep,
+    }
+    results = []
+    try:
+        for name in names:
+            print(f"运行场景: {name} ...")
+            result = run_scenario(server, name, ctx, args.repeat, args.timeout)
+            check_expected(result, config, ctx)
+            results.append(result)
+    finally:
+        server.stop()
+
+    print()
+    print_table(results)
+
+    report = {
+        'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'config': {k: v for k, v in vars(args).items() if k not in ('output', 'baseline', 'verbose', 'keep')},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已保存: {args.output}")
+
+    failed = [r for r in results if r['error'] or not r.get('complete', True)]
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        changed = [k for k, v in report['config'].items()
+                   if k not in ('scenarios', 'repeat', 'timeout', 'tolerance') and baseline.get('config', {}).get(k) != v]
+        if changed:
+            print(f"\n⚠️ 基线的运行参数不同 ({', '.join(changed)})，比较结果仅供参考")
+        regressions = compare(results, baseline, args.tolerance)
+        for scenario, field, before, now in regressions:
+            print(f"⚠️ 回归: {scenario} {field} {before} -> {now}")
+        if not regressions:
+            print(f"\n与基线相比没有超过 {args.tolerance:.0%} 的吞吐下降。")
+    if failed:
+        print(f"\n{len(failed)} 个场景失败或结果不完整。")
+    sys.exit(1 if regressions or failed else 0)
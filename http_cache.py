@@ -0,0 +1,144 @@
+import os
+import sqlite3
+import threading
+import time
+
+
+class HttpCache:
+    """持久化 HTTP 缓存 (SQLite)，列表抓取与图片下载共用
+
+    每个 URL 记录 ETag / Last-Modified，重跑时发送条件请求，服务器返回 304
+    说明内容未变化，不需要读取响应体：
+    - 图片：记录最终尺寸、是否通过过滤以及保存路径
+    - 页面/JSON：记录响应体本身，304 时直接返回缓存内容
+
+    条目按最近访问时间做 LRU 淘汰，上限由 max_entries (条目数) 和
+    max_body_bytes (缓存响应体总字节数) 控制。
+
+    数据库使用 WAL 模式，每次写入立即提交，不长时间占用写锁；
+    查询只在内存中记录访问时间，随下一次写入一并落盘。
+    """
+
+    def __init__(self, path, max_entries=100000, max_body_bytes=256 * 1024 * 1024, timeout=30):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_body_bytes = max_body_bytes
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self._writes = 0
+        self._accessed = {}  # URL -> 最近访问时间，尚未写入数据库
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT,"
+                " status TEXT, fmt TEXT, width INTEGER, height INTEGER, path TEXT,"
+                " body BLOB, body_size INTEGER DEFAULT 0, accessed REAL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self._db.commit()
+
+    def lookup(self, url):
+        """返回缓存条目 (dict)，不存在时返回 None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT etag, last_modified, status, fmt, width, height, path, body FROM entries WHERE url = ?",
+                (url,),
+            ).fetchone()
+            if not row:
+                return None
+            self._accessed[url] = time.time()
+        keys = ('etag', 'last_modified', 'status', 'fmt', 'width', 'height', 'path', 'body')
+        return dict(zip(keys, row))
+
+    @staticmethod
+    def conditional_headers(entry):
+        """根据缓存条目生成条件请求头，没有校验信息时返回 None"""
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers or None
+
+    def store_image(self, url, headers, status, info, path=None):
+        """记录图片的校验信息与处理结果 (status: 'accepted' 或 'rejected')"""
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return  # 服务器不支持条件请求，缓存没有意义
+        fmt, width, height = info
+        self._put(url, (etag, last_modified, status, fmt, width, height, path, None, 0))
+
+    def store_body(self, url, headers, body):
+        """记录页面/JSON 的响应体"""
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        self._put(url, (etag, last_modified, 'body', None, None, None, None, body, len(body)))
+
+    def fetch(self, session, url, timeout=30):
+        """带条件请求的 GET，返回 (响应体 bytes, 是否命中缓存)；请求失败时抛出异常"""
+        entry = self.lookup(url)
+        headers = self.conditional_headers(entry) if entry and entry.get('body') is not None else None
+        resp = session.get(url, headers=headers, timeout=timeout)
+        if resp.status_code == 304 and headers:
+            return entry['body'], True
+        resp.raise_for_status()
+        self.store_body(url, resp.headers, resp.content)
+        return resp.content, False
+
+    def _put(self, url, values):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries"
+                " (url, etag, last_modified, status, fmt, width, height, path, body, body_size, accessed)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url,) + tuple(values) + (time.time(),),
+            )
+            self._accessed.pop(url, None)
+            self._writes += 1
+            self._flush_accessed()
+            # 每 100 次写入检查一次容量
+            if self._writes % 100 == 0:
+                self._evict()
+            self._db.commit()
+
+    def _flush_accessed(self):
+        """把内存中记录的访问时间写入数据库 (调用方持有锁，随当前事务提交)"""
+        if self._accessed:
+            self._db.executemany(
+                "UPDATE entries SET accessed = ? WHERE url = ?", [(t, u) for u, t in self._accessed.items()]
+            )
+            self._accessed.clear()
+
+    def _evict(self):
+        """LRU 淘汰：超出条目数或响应体总字节数上限时删除最久未访问的条目"""
+        count, body_bytes = self._db.execute("SELECT COUNT(*), COALESCE(SUM(body_size), 0) FROM entries").fetchone()
+        if count > self.max_entries:
+            self._db.execute(
+                "DELETE FROM entries WHERE url IN (SELECT url FROM entries ORDER BY accessed LIMIT ?)",
+                (count - self.max_entries,),
+            )
+        while body_bytes > self.max_body_bytes:
+            rows = self._db.execute(
+                "SELECT url, body_size FROM entries WHERE body_size > 0 ORDER BY accessed LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+            for url, size in rows:
+                self._db.execute("DELETE FROM entries WHERE url = ?", (url,))
+                body_bytes -= size
+                if body_bytes <= self.max_body_bytes:
+                    break
+
+    def close(self):
+        with self._lock:
+            self._flush_accessed()
+            self._evict()
+            self._db.commit()
+            self._db.close()
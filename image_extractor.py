@@ -1,135 +1,1357 @@
-import time
 import os
+import asyncio
 import requests
 import re
 import threading
+import time
+import itertools
 import argparse
+import queue
+import uuid
+import hashlib
+import json
+import multiprocessing
+import multiprocessing.util
+from collections import deque
+from contextlib import contextmanager, asynccontextmanager
 from io import BytesIO
+from html.parser import HTMLParser
 from PIL import Image
-from urllib.parse import unquote, urlparse, parse_qs
+from requests.adapters import HTTPAdapter
+from urllib.parse import unquote, urlparse, parse_qs, urljoin, urlsplit, urlunsplit
 from playwright.sync_api import sync_playwright
-from concurrent.futures import ThreadPoolExecutor
+from image_store import ImageStore, link_file
+from http_cache import HttpCache
+from page_utils import scroll_until_stable, block_resources
+from metrics import REGISTRY, dump_summary
+from tracing import Tracer, NULL_TRACER
+from job_manifest import (
+    JobManifest, LOT_DOWNLOADED, LOT_FALLBACK, LOT_SCANNED,
+    IMAGE_DOWNLOADED, IMAGE_REJECTED, IMAGE_FAILED,
+)
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# 单张图片请求的结果
+FETCH_SAVED = 'saved'        # 已保存
+FETCH_REJECTED = 'rejected'  # 尺寸不满足要求
+FETCH_GONE = 'gone'          # 服务器明确返回不存在 (4xx) 或内容不是图片，重试也无意义
+FETCH_ERROR = 'error'        # 网络错误、超时、5xx 等，可重试
+
+# 伪造 User-Agent 防止被拦截
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+}
+
+# 探测尺寸时每次读取的块大小，以及最多读取的前缀字节数
+PROBE_CHUNK_SIZE = 16 * 1024
+PROBE_MAX_BYTES = 256 * 1024
+
+# 每个在途请求预留的缓冲字节 (文件头探测缓冲 + 一个写入块)
+STREAM_RESERVE_BYTES = PROBE_MAX_BYTES + PROBE_CHUNK_SIZE
+
+# JPEG 中携带尺寸信息的 SOF 标记
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def _probe_jpeg(data):
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # 填充字节
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # 无长度的独立标记
+            i += 2
+            continue
+        length = int.from_bytes(data[i + 2:i + 4], 'big')
+        if marker in _JPEG_SOF_MARKERS:
+            if i + 9 > len(data):
+                return None
+            height = int.from_bytes(data[i + 5:i + 7], 'big')
+            width = int.from_bytes(data[i + 7:i + 9], 'big')
+            return 'jpeg', width, height
+        i += 2 + length
+    return None
+
+
+def _probe_webp(data):
+    if len(data) < 30:
+        return None
+    chunk = data[12:16]
+    if chunk == b'VP8 ' and data[23:26] == b'\x9d\x01\x2a':
+        width = int.from_bytes(data[26:28], 'little') & 0x3FFF
+        height = int.from_bytes(data[28:30], 'little') & 0x3FFF
+        return 'webp', width, height
+    if chunk == b'VP8L' and data[20] == 0x2F:
+        bits = int.from_bytes(data[21:25], 'little')
+        return 'webp', (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b'VP8X':
+        width = int.from_bytes(data[24:27], 'little') + 1
+        height = int.from_bytes(data[27:30], 'little') + 1
+        return 'webp', width, height
+    return None
+
+
+def probe_image_size(data):
+    """从图片开头的字节解析格式和尺寸，返回 (格式, 宽, 高)，数据不足或无法识别时返回 None"""
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        if len(data) < 24:
+            return None
+        return 'png', int.from_bytes(data[16:20], 'big'), int.from_bytes(data[20:24], 'big')
+    if data[:2] == b'\xff\xd8':
+        return _probe_jpeg(data)
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return _probe_webp(data)
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        if len(data) < 10:
+            return None
+        return 'gif', int.from_bytes(data[6:8], 'little'), int.from_bytes(data[8:10], 'little')
+
+    # 其它格式 (TIFF 等) 交给 Pillow 尝试只解析文件头
+    try:
+        with Image.open(BytesIO(data)) as img:
+            return img.format.lower(), img.size[0], img.size[1]
+    except Exception:
+        return None
+
+_NEXT_DATA_EXTS = ('.jpg', '.jpeg', '.png', '.webp')
+# __NEXT_DATA__ 中与图片 URL 同级的尺寸字段 (也会查找 dimensions / size 子对象)
+_WIDTH_KEYS = ('width', 'originalWidth', 'original_width', 'naturalWidth', 'pixelWidth', 'w')
+_HEIGHT_KEYS = ('height', 'originalHeight', 'original_height', 'naturalHeight', 'pixelHeight', 'h')
+# 图片/版本记录中存放 URL 的字段：只有 URL 放在这些字段里时，同级的宽高才被视为像素尺寸
+# (拍品对象常同时带有主图 URL 和作品的物理尺寸，如 60x80 cm)
+_IMAGE_URL_KEYS = ('url', 'src', 'href', 'uri', 'source', 'original', 'originalUrl', 'original_url',
+                   'imageUrl', 'image_url', 'imageSrc', 'renditionUrl')
+_PIXEL_UNITS = ('px', 'pixel', 'pixels')
+
+
+def _is_image_value(v):
+    return v.startswith('http') and any(ext in v.lower() for ext in _NEXT_DATA_EXTS)
+
+
+def _as_int(v):
+    if isinstance(v, bool):
+        return None
+    if isinstance(v, (int, float)):
+        return int(v) if v > 0 else None
+    if isinstance(v, str) and v.isdigit():
+        return int(v) or None
+    return None
+
+
+def _declared_dims(obj):
+    """读取字典中声明的宽高，返回 (宽, 高)，不完整或带有非像素单位时返回 (None, None)"""
+    for holder in (obj, obj.get('dimensions'), obj.get('size')):
+        if not isinstance(holder, dict):
+            continue
+        unit = holder.get('unit') or holder.get('units')
+        if isinstance(unit, str) and unit.lower() not in _PIXEL_UNITS:
+            continue
+        width = next((w for w in (_as_int(holder.get(k)) for k in _WIDTH_KEYS) if w), None)
+        height = next((h for h in (_as_int(holder.get(k)) for k in _HEIGHT_KEYS) if h), None)
+        if width and height:
+            return width, height
+    return None, None
+
+
+def iter_next_data_images(data):
+    """迭代遍历 __NEXT_DATA__，产出 (图片 URL, 声明宽度, 声明高度)
+
+    使用显式栈，不受递归深度限制。只有当字典像一条图片记录 (恰好有一个图片 URL，
+    且放在 url/src 等字段中) 时，同级的宽高字段才归属于它，未知时为 None。
+    """
+    stack = [data]
+    while stack:
+        obj = stack.pop()
+        if isinstance(obj, dict):
+            images = []
+            record = False
+            children = []
+            for k, v in obj.items():
+                if isinstance(v, str):
+                    if _is_image_value(v):
+                        images.append(v)
+                        record = k in _IMAGE_URL_KEYS
+                elif isinstance(v, (dict, list)):
+                    children.append(v)
+            width, height = _declared_dims(obj) if len(images) == 1 and record else (None, None)
+            for v in images:
+                yield v, width, height
+            stack.extend(reversed(children))
+        elif isinstance(obj, list):
+            stack.extend(reversed(obj))
+
+
+def _largest_srcset(srcset):
+    """从 srcset 中取出描述符最大的图片 URL (没有描述符时取最后一个)"""
+    best_url, best_size = None, -1.0
+    for part in srcset.split(','):
+        pieces = part.strip().split()
+        if not pieces:
+            continue
+        size = 0.0
+        if len(pieces) > 1 and pieces[1][:-1].replace('.', '', 1).isdigit():
+            size = float(pieces[1][:-1])
+        if size >= best_size:
+            best_url, best_size = pieces[0], size
+    return best_url
+
+
+class _PageImageParser(HTMLParser):
+    """HTTP 快速扫描用的 HTML 解析器：收集 <img>/<source>/srcset、og:image、
+    __NEXT_DATA__ 以及标题"""
+
+    _CAPTURE_TAGS = ('script', 'title', 'h1')
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.urls = []
+        self.next_data = None
+        self.title = ""
+        self.h1 = ""
+        self._capture = None
+        self._buf = []
+
+    def handle_starttag(self, tag, attrs):
+        a = dict(attrs)
+        if tag in ('img', 'source'):
+            for key in ('src', 'data-src'):
+                if a.get(key):
+                    self.urls.append(a[key])
+            for key in ('srcset', 'data-srcset'):
+                if a.get(key):
+                    u = _largest_srcset(a[key])
+                    if u:
+                        self.urls.append(u)
+        elif tag == 'meta' and a.get('property') in ('og:image', 'og:image:secure_url') and a.get('content'):
+            self.urls.append(a['content'])
+        elif tag == 'script' and a.get('id') == '__NEXT_DATA__':
+            self._start_capture('next_data')
+        elif tag == 'title' and not self.title:
+            self._start_capture('title')
+        elif tag == 'h1' and not self.h1:
+            self._start_capture('h1')
+
+    def _start_capture(self, name):
+        self._capture = name
+        self._buf = []
+
+    def handle_data(self, data):
+        if self._capture:
+            self._buf.append(data)
+
+    def handle_endtag(self, tag):
+        if not self._capture or tag not in self._CAPTURE_TAGS:
+            return
+        if (self._capture == 'next_data') != (tag == 'script'):
+            return
+        text = ''.join(self._buf)
+        if self._capture == 'next_data':
+            self.next_data = text
+        else:
+            setattr(self, self._capture, ' '.join(text.split()))
+        self._capture = None
+        self._buf = []
+
+
+# 完整 DOM 扫描：对每个元素调用 getComputedStyle 查找背景图 (样式计算开销大，保留作对照)
+_DOM_FULL_SCAN_JS = r"""() => {
+    const urls = [];
+    document.querySelectorAll('img').forEach(img => {
+        if (img.src) urls.push(img.src);
+        if (img.dataset.src) urls.push(img.dataset.src);
+        if (img.srcset) {
+            // 提取 srcset 中的最大图
+            const sources = img.srcset.split(',');
+            const lastSource = sources[sources.length - 1].trim().split(' ')[0];
+            if (lastSource) urls.push(lastSource);
+        }
+    });
+    document.querySelectorAll('*').forEach(el => {
+        const style = window.getComputedStyle(el);
+        const bg = style.backgroundImage;
+        if (bg && bg !== 'none') {
+            const match = bg.match(/url\(['"]?(.*?)['"]?\)/);
+            if (match) urls.push(match[1]);
+        }
+    });
+    return urls;
+}"""
+
+# 增量收集：记录当前及之后插入/修改的 <img>/<source> 地址 (滚动过程中被虚拟列表移除的图片也能保留)
+_DOM_COLLECTOR_JS = r"""() => {
+    if (window.__imageUrls) return;
+    const urls = window.__imageUrls = new Set();
+    const resolve = (u) => {
+        try { return new URL(u, document.baseURI).href; } catch (e) { return null; }
+    };
+    const add = (u) => {
+        const r = u && resolve(u);
+        if (r) urls.add(r);
+    };
+    const largest = (srcset) => {
+        let best = null, bestSize = -1;
+        for (const part of srcset.split(',')) {
+            const pieces = part.trim().split(/\s+/);
+            if (!pieces[0]) continue;
+            const size = pieces.length > 1 ? (parseFloat(pieces[1]) || 0) : 0;
+            if (size >= bestSize) { best = pieces[0]; bestSize = size; }
+        }
+        return best;
+    };
+    const grab = (el) => {
+        if (el.tagName !== 'IMG' && el.tagName !== 'SOURCE') return;
+        add(el.getAttribute('src'));
+        add(el.getAttribute('data-src'));
+        if (el.currentSrc) add(el.currentSrc);
+        for (const attr of ['srcset', 'data-srcset']) {
+            const v = el.getAttribute(attr);
+            if (v) add(largest(v));
+        }
+    };
+    window.__grabImage = grab;
+    window.__addImageUrl = add;
+    document.querySelectorAll('img, source').forEach(grab);
+    new MutationObserver(mutations => {
+        for (const m of mutations) {
+            if (m.type === 'attributes') {
+                grab(m.target);
+                continue;
+            }
+            m.addedNodes.forEach(n => {
+                if (n.nodeType !== 1) return;
+                grab(n);
+                n.querySelectorAll('img, source').forEach(grab);
+            });
+        }
+    }).observe(document.documentElement, {
+        childList: true, subtree: true, attributes: true,
+        attributeFilter: ['src', 'srcset', 'data-src', 'data-srcset'],
+    });
+}"""
+
+# 快速 DOM 扫描：增量收集的图片 + 内联样式背景 + 样式表中声明了背景图的规则，
+# 只对这些规则命中的元素计算样式；无法读取的跨域样式表才退回到逐个元素计算
+_DOM_FAST_SCAN_JS = r"""() => {
+    (""" + _DOM_COLLECTOR_JS + r""")();
+    const add = window.__addImageUrl;
+    document.querySelectorAll('img, source').forEach(window.__grabImage);
+
+    const addBackground = (bg) => {
+        if (!bg || bg === 'none') return;
+        for (const m of bg.matchAll(/url\(\s*['"]?(.*?)['"]?\s*\)/g)) add(m[1]);
+    };
+    document.querySelectorAll('[style*="url("]').forEach(el => addBackground(el.style.backgroundImage));
+
+    const selectors = [];
+    let opaque = false;
+    const walk = (rules) => {
+        for (const rule of rules) {
+            if (rule.selectorText && rule.style && (rule.style.backgroundImage || '').includes('url(')) {
+                selectors.push(rule.selectorText);
+            }
+            if (rule.cssRules) walk(rule.cssRules);
+        }
+    };
+    for (const sheet of document.styleSheets) {
+        try { walk(sheet.cssRules); } catch (e) { opaque = true; }
+    }
+    const elements = new Set(opaque ? document.querySelectorAll('*') : []);
+    for (const sel of selectors) {
+        try { document.querySelectorAll(sel).forEach(el => elements.add(el)); } catch (e) {}
+    }
+    elements.forEach(el => addBackground(getComputedStyle(el).backgroundImage));
+    return Array.from(window.__imageUrls);
+}"""
+
+
+class ByteBudget:
+    """所有下载线程共享的缓冲字节上限
+
+    每个请求开始前预留固定的缓冲额度，结束后归还；额度用完时新的请求等待，
+    从而限制所有并发下载同时占用的内存。
+    协程在 FIFO 等待队列上挂起，由 release 按顺序唤醒，不轮询。
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._cond = threading.Condition()
+        self._waiters = deque()  # 等待中的协程：(事件循环, future, 字节数)
+
+    def _fits(self, n):
+        # 额度为空时总是放行，避免单个请求超过上限时永远等待
+        return not self.used or self.used + n <= self.limit
+
+    def slots(self, n):
+        """每个请求预留 n 字节时最多能同时持有额度的请求数"""
+        return max(1, self.limit // n)
+
+    def acquire(self, n):
+        with self._cond:
+            while not self._fits(n):
+                self._cond.wait()
+            self.used += n
+
+    async def acquire_async(self, n):
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if not self._waiters and self._fits(n):
+                self.used += n
+                return
+            future = loop.create_future()
+            waiter = (loop, future, n)
+            self._waiters.append(waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._cond:
+                granted = waiter not in self._waiters
+                if not granted:
+                    self._waiters.remove(waiter)
+            if granted:
+                self.release(n)  # 额度已经分配给这个协程，取消时归还
+            raise
+
+    def release(self, n):
+        with self._cond:
+            self.used -= n
+            # 按到达顺序唤醒放得下的协程，额度在这里直接记到它们名下
+            while self._waiters and self._fits(self._waiters[0][2]):
+                loop, future, size = self._waiters.popleft()
+                self.used += size
+                loop.call_soon_threadsafe(_resolve_waiter, future)
+            self._cond.notify_all()
+
+
+def _advance(steps, value):
+    """推进生成器一步，返回 (是否结束, 产出值或返回值)
+
+    StopIteration 不能经由 Future 传回协程，在线程池中推进生成器时改为返回结束标记。
+    """
+    try:
+        return False, steps.send(value)
+    except StopIteration as done:
+        return True, done.value
+
+
+def _resolve_waiter(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class HttpPool:
+    """下载器共享的 HTTP 连接池
+
+    所有图片请求复用同一个 Session：默认请求头只设置一次，连接 keep-alive 复用，
+    每个主机最多 pool_size 个并发连接，超出的请求排队等待，避免大量线程同时
+    向同一 CDN 建立新的 TCP/TLS 连接而耗尽 socket。
+    """
+
+    def __init__(self, pool_size=16, max_hosts=32, headers=None):
+        self.pool_size = pool_size
+        self.session = requests.Session()
+        self.session.headers.update(headers or DEFAULT_HEADERS)
+        self.adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self._lock = threading.Lock()
+        self._host_slots = {}
+        self._requests = 0
+        self._waits = 0
+
+    def _slot(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.pool_size)
+                self._host_slots[host] = slot
+        return slot
+
+    @contextmanager
+    def get(self, url, **kwargs):
+        """发起 GET 请求，在 with 块内持有该主机的一个连接名额"""
+        slot = self._slot(url)
+        if not slot.acquire(blocking=False):
+            with self._lock:
+                self._waits += 1
+            slot.acquire()
+        try:
+            with self._lock:
+                self._requests += 1
+            resp = self.session.get(url, **kwargs)
+            try:
+                yield resp
+            finally:
+                resp.close()
+        finally:
+            slot.release()
+
+    def stats(self):
+        """连接池统计：请求数、复用次数、新建连接数、等待次数"""
+        new_connections = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                new_connections += pool.num_connections
+        with self._lock:
+            requests_count = self._requests
+            waits = self._waits
+        return {
+            'requests': requests_count,
+            'hits': max(0, requests_count - new_connections),
+            'new_connections': new_connections,
+            'waits': waits,
+        }
+
+    def close(self):
+        self.session.close()
+
+
+class AsyncEngine:
+    """asyncio 下载后端
+
+    所有请求运行在一个独立的事件循环线程中，用信号量限制同时在途的请求数，
+    少量 OS 线程即可支撑数千个并发请求。aiohttp 为可选依赖，仅在使用该后端时导入。
+    写盘、SQLite、哈希和 Pillow 解码等阻塞操作通过 offload 交给 I/O 线程池，不占用事件循环。
+    """
+
+    def __init__(self, concurrency=500, pool_size=16, headers=None):
+        try:
+            import aiohttp
+        except ImportError:
+            raise RuntimeError("asyncio 下载后端需要 aiohttp，请先执行: pip install aiohttp")
+        self._aiohttp = aiohttp
+        self.concurrency = concurrency
+        self.pool_size = pool_size
+        self.headers = headers or DEFAULT_HEADERS
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.io_pool = ThreadPoolExecutor(thread_name_prefix='async-io')
+        self._session = None
+        self._semaphore = None
+        self._stats = {'requests': 0, 'hits': 0, 'new_connections': 0, 'waits': 0}
+
+    def run(self, coro):
+        """在事件循环线程中执行协程并等待结果"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def offload(self, func, *args):
+        """在 I/O 线程池中执行阻塞函数，返回可等待的结果"""
+        return self.loop.run_in_executor(self.io_pool, func, *args)
+
+    def _ensure_session(self):
+        if self._session is None:
+            aiohttp = self._aiohttp
+            trace = aiohttp.TraceConfig()
+            trace.on_connection_create_end.append(self._on_new_connection)
+            trace.on_connection_reuseconn.append(self._on_reuse_connection)
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.pool_size)
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=None, sock_connect=15, sock_read=15),
+                trace_configs=[trace],
+            )
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._session
+
+    async def _on_new_connection(self, session, ctx, params):
+        self._stats['new_connections'] += 1
+
+    async def _on_reuse_connection(self, session, ctx, params):
+        self._stats['hits'] += 1
+
+    @asynccontextmanager
+    async def get(self, url, headers=None):
+        """发起 GET 请求，响应体以流的方式读取"""
+        session = self._ensure_session()
+        if self._semaphore.locked():
+            self._stats['waits'] += 1
+        async with self._semaphore:
+            self._stats['requests'] += 1
+            async with session.get(url, headers=headers) as resp:
+                yield resp
+
+    def stats(self):
+        return dict(self._stats)
+
+    def close(self):
+        if self._session is not None:
+            self.run(self._session.close())
+            self._session = None
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.io_pool.shutdown(wait=True)
+
+
+# URL 中常见的尺寸参数与路径片段，用于估计变体的分辨率
+_SIZE_PARAMS = ('width', 'w', 'height', 'h', 'size', 'maxwidth', 'maxheight')
+_PATH_SIZE_RE = re.compile(r'(?<![\d.])(\d{2,5})x(\d{2,5})(?![\d.])')
+# 只改变尺寸、质量或格式的 CDN 参数：去掉这些参数得到原图，其余参数 (如 id=) 可能决定是哪张图，保留
+_VARIANT_PARAMS = _SIZE_PARAMS + ('q', 'quality', 'fm', 'format', 'auto', 'fit')
+
+
+def _strip_variant_params(url):
+    """去掉 URL 中的尺寸、质量和格式参数，保留其他参数 (顺序不变)"""
+    parts = urlsplit(url)
+    kept = [p for p in parts.query.split('&')
+            if p and unquote(p.split('=', 1)[0]).lower() not in _VARIANT_PARAMS]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, '&'.join(kept), ''))
+
+
+def _size_hint(url):
+    """从 URL 估计图片的长边像素，无法估计时返回 0"""
+    parsed = urlparse(url)
+    hint = 0
+    for key, values in parse_qs(parsed.query).items():
+        if key.lower() in _SIZE_PARAMS:
+            for v in values:
+                if v.isdigit():
+                    hint = max(hint, int(v))
+    for w, h in _PATH_SIZE_RE.findall(parsed.path):
+        hint = max(hint, int(w), int(h))
+    return hint
+
+
+class ImageCandidate:
+    """同一张图片的所有 URL 变体
+
+    变体按可能得到的分辨率排序：不带参数的原图优先，其次是 URL 中标明尺寸较大的，
+    下载时依次尝试，第一个通过尺寸过滤的变体保存后即停止。
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.variants = {}  # url -> (优先级, 估计长边, 发现顺序)
+        self.declared = {}  # url -> (宽, 高)：页面数据中声明的尺寸
+
+    def add(self, url, priority):
+        if url in self.variants:
+            old = self.variants[url]
+            if old[0] >= priority:
+                return
+            self.variants[url] = (priority, old[1], old[2])
+            return
+        self.variants[url] = (priority, _size_hint(url), len(self.variants))
+
+    def declare(self, url, width, height):
+        """记录页面数据中声明的尺寸；声明在不带参数的原图上时适用于所有变体"""
+        self.declared[url] = (width, height)
+
+    def declared_size(self, url):
+        return self.declared.get(url) or self.declared.get(self.key)
+
+    def declares(self, url):
+        """该 URL 本身是否带有图片记录声明的尺寸 (而不是继承图片标识上的声明)"""
+        return url in self.declared
+
+    def ranked(self):
+        """返回 [(url, 估计长边), ...]，按优先级、估计长边从高到低排序"""
+        items = sorted(self.variants.items(), key=lambda kv: (-kv[1][0], -kv[1][1], kv[1][2]))
+        return [(url, rank[1]) for url, rank in items]
+
+
+class ScanResult:
+    """单个商品页的扫描结果 (每次扫描独立一份，可在多个扫描线程间并行)"""
+
+    def __init__(self, url):
+        self.url = url
+        self.title = ""
+        self.candidates = {}  # 图片标识 -> ImageCandidate
+
+    def _candidate(self, key):
+        cand = self.candidates.get(key)
+        if cand is None:
+            cand = ImageCandidate(key)
+            self.candidates[key] = cand
+        return cand
+
+    def add_next_data(self, data):
+        """加入 __NEXT_DATA__ 中的图片 URL 及其声明尺寸"""
+        for u, width, height in iter_next_data_images(data):
+            self.add_url(u, width, height)
+
+    def add_url(self, u, width=None, height=None):
+        if not u: return
+        if u.startswith('data:'): return
+
+        # 尝试从 URL 参数中提取原图 (针对 CDN 缩略图嵌套)
+        original_url = None
+        try:
+            qs = parse_qs(urlparse(u).query)
+            if 'url' in qs:
+                original_url = unquote(qs['url'][0])
+                if not original_url.startswith('http'):
+                    original_url = None
+        except Exception:
+            pass
+
+        # 以去除尺寸参数后的原图地址作为图片标识，同一张图的变体归为一组
+        # (/render?id=123 与 /render?id=456 是两张图，不能只按路径分组)
+        source = original_url or u
+        cand = self._candidate(_strip_variant_params(source))
+
+        # 1. 原始 URL
+        cand.add(u, 0)
+        if original_url:
+            # 2. 嵌套的原图及其去除参数的版本
+            cand.add(original_url, 1)
+            cand.add(_strip_variant_params(original_url), 2)
+        else:
+            # 3. 去除尺寸参数获取原图 (针对 .../image.jpg?width=800 这种)
+            cand.add(_strip_variant_params(u), 2)
+        if width and height:
+            cand.declare(u, width, height)
+
+    def candidate_list(self):
+        return list(self.candidates.values())
+
+    def variant_count(self):
+        return sum(len(c.variants) for c in self.candidates.values())
+
+
+# 商品文件夹中已保存图片的文件名: NNN_WxH.ext
+_LOT_FILE_RE = re.compile(r'^(\d{3,})_(\d+)x(\d+)\.(\w+)$')
+
+
+class _ImageFetch:
+    """一次图片请求的状态，在线程后端和 asyncio 后端的各个处理阶段之间传递"""
+
+    def __init__(self, url, lot, trace_id=None):
+        self.url = url
+        self.lot = lot
+        self.trace_id = trace_id  # asyncio 后端的异步事件 ID
+        self.started = time.perf_counter()
+        self.headers = None
+        self.info = None  # 文件头解析出的 (格式, 宽, 高)，无法识别时为 None
+        self.part_path = None
+        self.file = None
+        self.digest = None
+        self.received = 0
+        self.body_started = None
+
+    def open_part(self, path, head, digest=None):
+        """打开临时文件并写入已读取的文件头"""
+        self.part_path = path
+        self.digest = digest
+        self.file = open(path, "wb")
+        self.body_started = time.perf_counter()
+        self.write(head)
+
+    def write(self, chunk):
+        self.file.write(chunk)
+        self.received += len(chunk)
+        if self.digest:
+            self.digest.update(chunk)
+
+    def close_part(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def hexdigest(self):
+        return self.digest.hexdigest() if self.digest else None
+
+
+class LotState:
+    """单个商品下载过程中共享的状态：保存目录、文件编号、已保存内容的哈希"""
+
+    def __init__(self, save_dir, resume=False, lot_url=None):
+        self.save_dir = save_dir
+        self.lot_url = lot_url  # 商品页 URL，用于写入任务清单
+        self.next_index = 1
+        self.hashes = set()
+        self.saved = 0  # 本次保存 (或确认已存在) 的图片数
+        self.prefiltered = 0  # 按声明尺寸跳过、未发请求的变体数
+        self.inodes = set()  # 文件夹中已有图片的 (设备, inode)
+        self.existing = {}  # (宽, 高, 格式) -> 文件夹中已有的同尺寸图片
+        self.existing_hashes = {}  # 已有图片 -> 内容哈希 (需要比较时才计算)
+        if resume:
+            self._scan_existing()
+
+    def _scan_existing(self):
+        """重跑时从已有文件继续编号，并记录已有文件，避免覆盖或重复链接"""
+        if not os.path.isdir(self.save_dir):
+            return
+        for name in os.listdir(self.save_dir):
+            m = _LOT_FILE_RE.match(name)
+            if not m:
+                continue
+            self.next_index = max(self.next_index, int(m.group(1)) + 1)
+            key = (int(m.group(2)), int(m.group(3)), m.group(4))
+            self.existing.setdefault(key, []).append(os.path.join(self.save_dir, name))
+            try:
+                st = os.stat(os.path.join(self.save_dir, name))
+                self.inodes.add((st.st_dev, st.st_ino))
+            except OSError:
+                pass
+
+    def has_file(self, path):
+        """path 指向的内容是否已经在商品文件夹中 (硬链接/符号链接/同一文件)"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return (st.st_dev, st.st_ino) in self.inodes
+
+    def find_existing(self, info, digest):
+        """文件夹中是否已有内容相同的图片 (按文件名中的尺寸和格式筛选后比较哈希)
+
+        服务器不提供 ETag / Last-Modified 时缓存无法跳过请求，重跑会重新下载，
+        这里保证不会再保存一份副本。
+        """
+        fmt, width, height = info
+        for path in self.existing.get((width, height, fmt), ()):
+            known = self.existing_hashes.get(path)
+            if known is None:
+                try:
+                    known = self.existing_hashes[path] = _file_sha256(path)
+                except OSError:
+                    continue
+            if known == digest:
+                return path
+        return None
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 
 class ImageDownloader:
-    def __init__(self, min_width=3840, min_height=2160, headless=True, max_workers=100, base_dir=None, stop_flag=None):
+    def __init__(self, min_width=3840, min_height=2160, headless=True, max_workers=100, base_dir=None, stop_flag=None,
+                 queue_size=4, progress_callback=None, scan_workers=1, pool_size=16,
+                 engine='threads', concurrency=500, max_buffer_bytes=64 * 1024 * 1024, dedupe=False,
+                 cache_path=None, cache_size=100000, manifest_path=None, scan_mode='browser',
+                 settle_timeout=5.0, dom_scan='fast', block_resources=True, browser_service=None,
+                 scan_processes=0, log=None, tracer=None, cache=None, manifest=None):
         self.min_width = min_width
         self.min_height = min_height
         self.headless = headless
         self.max_workers = max_workers
         self.base_dir = base_dir  # 根目录，所有商品文件夹都会创建在这里
-        self.image_urls = set()
         self.counter_lock = threading.Lock()
-        self.counter = [1]
         self.stop_flag = stop_flag  # 停止标志
+        self.queue_size = queue_size  # 扫描 -> 下载 队列上限 (背压)
+        self.progress_callback = progress_callback  # 每个阶段进度变化时回调
+        self.scan_workers = scan_workers  # 并行扫描的浏览器数量
+        self.log = log or print  # 日志输出 (Web 服务传入日志总线，命令行直接打印)
+        self.tracer = tracer or NULL_TRACER  # 时间线追踪 (tracing.Tracer)，默认只记录指标
+        self.trace_ids = itertools.count(1)  # asyncio 后端异步事件的 ID
+        self.scan_processes = scan_processes  # >0 时商品页在多个扫描进程中扫描 (每个进程一个浏览器)
+        self.scan_pool = None
+        self.scan_pool_lock = threading.Lock()
+        self.http = HttpPool(pool_size=pool_size)  # 所有图片请求共享的连接池
+        self.engine = engine  # 下载后端: 'threads' (线程池) 或 'asyncio'
+        self.concurrency = concurrency  # asyncio 后端同时在途的请求上限
+        self.async_engine = None
+        self.buffer_budget = ByteBudget(max_buffer_bytes)  # 所有在途下载共享的缓冲上限
+        self.dedupe = dedupe  # 是否启用按内容哈希去重的图片仓库
+        self.store = None
+        self.cache_path = cache_path  # 持久化 HTTP 缓存文件，None 表示不启用
+        self.cache_size = cache_size  # 缓存条目上限 (LRU 淘汰)
+        self.manifest_path = manifest_path  # SQLite 任务清单，用于中断后续跑
+        # 调用方传入的缓存/清单由调用方关闭 (Web 服务中所有下载任务共用一个实例)
+        self.cache = cache
+        self.manifest = manifest
+        self.owns_cache = cache is None
+        self.owns_manifest = manifest is None
+        self.settle_timeout = settle_timeout  # 滚动后等待页面稳定的上限 (秒)
+        # 常驻浏览器服务 (需提供 run(fn) 方法，fn 接收一个浏览器上下文)；为空时每个扫描线程自己启动浏览器
+        self.browser_service = browser_service
+        self.block_resources = block_resources  # 扫描商品页时拦截图片/字体/视频/统计请求
+        self.dom_scan = dom_scan  # 'fast' (增量收集 + 样式表规则) 或 'full' (逐个元素 getComputedStyle)
+        self.scan_mode = scan_mode  # 'browser' (Playwright) 或 'http' (只请求 HTML，必要时回退到浏览器)
+        self.progress_lock = threading.Lock()
+        self.progress = {}
+        self.lot_queue = None
+
+    def _stopped(self):
+        return bool(self.stop_flag and self.stop_flag.is_set())
+
+    def _bump_progress(self, key, n=1):
+        """更新流水线进度并通知回调"""
+        with self.progress_lock:
+            self.progress[key] = self.progress.get(key, 0) + n
+            snapshot = self._progress_snapshot()
+        if self.progress_callback:
+            try:
+                self.progress_callback(snapshot)
+            except Exception:
+                pass
+
+    def _progress_snapshot(self):
+        """进度计数加上速率、预计剩余时间和队列深度 (调用方持有 progress_lock)"""
+        snapshot = dict(self.progress)
+        started = snapshot.pop('started', None)
+        if started is None:
+            return snapshot
+        elapsed = max(time.monotonic() - started, 1e-6)
+        snapshot['elapsed'] = round(elapsed, 1)
+        snapshot['images_per_s'] = round(snapshot.get('accepted', 0) / elapsed, 2)
+        snapshot['mb_per_s'] = round(snapshot.get('bytes', 0) / elapsed / (1024 * 1024), 2)
+        # 按已完成商品的平均速度估算剩余时间
+        done = snapshot.get('downloaded', 0) + snapshot.get('failed', 0) + snapshot.get('skipped', 0)
+        remaining = snapshot.get('total', 0) - done
+        snapshot['eta'] = round(remaining * elapsed / done) if done and remaining > 0 else None
+        # 扫描 -> 下载 队列的深度：长期为空说明扫描是瓶颈，长期占满说明下载是瓶颈
+        if self.lot_queue is not None:
+            snapshot['queue_depth'] = self.lot_queue.qsize()
+            snapshot['queue_size'] = self.queue_size
+        return snapshot
 
     def sanitize_filename(self, name):
         """清理文件名中的非法字符"""
         cleaned = re.sub(r'[\\/*?:"<>|]', '_', name)
         return cleaned.strip()[:100]
 
-    def _add_url(self, u):
-        if not u: return
-        # 1. 原始 URL
-        self.image_urls.add(u)
+    def _is_valid_size(self, width, height):
+        """尺寸过滤规则"""
+        # 尺寸过滤逻辑优化
+        # 原逻辑: width >= 3840 and height >= 2160 (只支持横向 4K)
+        # 新逻辑: 只要长边 >= 3840 (支持竖向 4K) 或者 满足横向 4K
+        # 考虑到用户可能设置了自定义宽高，我们使用更灵活的判断:
+        # 1. 严格匹配: 宽>=MW 且 高>=MH
+        # 2. 旋转匹配: 高>=MW 且 宽>=MH (竖图)
+        # 3. 只要长边足够大: max(w, h) >= MW (如果 MW 是主要标准)
         
-        # 2. 尝试去除参数获取原图 (针对 .../image.jpg?width=800 这种)
-        try:
-            clean_url = u.split('?')[0]
-            if clean_url != u:
-                self.image_urls.add(clean_url)
-        except:
-            pass
+        # 这里我们采用: 只要有一边达到 min_width (默认 3840)，或者 宽>=MW 且 高>=MH
+        if width >= self.min_width and height >= self.min_height:
+            return True
+        if height >= self.min_width and width >= self.min_height: # 竖向 4K
+            return True
+        if max(width, height) >= self.min_width: # 只要长边够长 (比如全景图或超长竖图)
+            return True
+        return False
 
-        # 3. 尝试从 URL 参数中提取原图 (针对 CDN 缩略图嵌套)
-        try:
-            parsed = urlparse(u)
-            qs = parse_qs(parsed.query)
-            if 'url' in qs:
-                original_url = unquote(qs['url'][0])
-                if original_url.startswith('http'):
-                    self.image_urls.add(original_url)
-                    # 同样添加去除参数的版本
-                    self.image_urls.add(original_url.split('?')[0])
-        except:
-            pass
+    def _probe_head(self, chunks):
+        """只读取响应开头的若干字节来解析尺寸，返回 (已读取的字节, 尺寸信息)"""
+        head = b''
+        for chunk in chunks:
+            head += chunk
+            info = probe_image_size(head)
+            if info:
+                return head, info
+            if len(head) >= PROBE_MAX_BYTES:
+                break
+        return head, None
 
-    def _process_image(self, img_url, save_dir):
-        """单个图片处理逻辑"""
+    def _should_fetch(self, img_url):
         # 检查停止标志
         if self.stop_flag and self.stop_flag.is_set():
-            return
-            
-        if img_url.startswith("data:"): return
-        if img_url.endswith('.svg') or img_url.endswith('.ico'): return
+            return False
+        if img_url.startswith("data:"): return False
+        if img_url.endswith('.svg') or img_url.endswith('.ico'): return False
+        return True
+
+    def _status_result(self, status):
+        if 400 <= status < 500 and status not in (408, 429):
+            return FETCH_GONE
+        return FETCH_ERROR
+
+    def _candidate_steps(self, candidate, lot):
+        """按排序依次尝试同一张图片的变体，保存第一个通过过滤的变体 (与下载后端无关)
 
+        生成器：产出需要请求的变体 URL，由下载后端通过 send() 送回 (FETCH_* 结果, 实测长边)，
+        结束时返回候选图片的最终状态。
+        """
+        errors = 0
+        measured = 0
+        ranked = candidate.ranked()
+        too_small = {url for url, _ in ranked if self._declared_too_small(candidate, url)}
+        if ranked and len(too_small) == len(ranked) and not any(candidate.declares(url) for url in too_small):
+            # 所有变体都只继承了图片标识上的尺寸，声明不一定适用于这些 URL，至少实测排在最前的变体；
+            # 图片记录直接声明的尺寸是可靠的像素尺寸，不再请求
+            too_small.discard(ranked[0][0])
+        for url, hint in ranked:
+            if self._stopped():
+                return None
+            # 已经实测过更大的版本仍不满足要求，标明尺寸更小的变体无需再请求
+            if hint and measured and hint <= measured:
+                continue
+            # 页面数据声明的尺寸已不满足要求，不发请求
+            if url in too_small:
+                self._count_prefiltered(lot)
+                continue
+            # 仓库中已有该 URL 的内容，直接链接，不再请求
+            if self._reuse_stored(url, lot):
+                return self._finish_candidate(candidate, lot, IMAGE_DOWNLOADED)
+            result, long_edge = yield url
+            REGISTRY.inc('image_requests_total', result=result)
+            if result == FETCH_SAVED:
+                return self._finish_candidate(candidate, lot, IMAGE_DOWNLOADED)
+            if result == FETCH_ERROR:
+                errors += 1
+            measured = max(measured, long_edge)
+        return self._finish_candidate(candidate, lot, IMAGE_FAILED if errors else IMAGE_REJECTED)
+
+    def _process_candidate(self, candidate, lot):
+        steps = self._candidate_steps(candidate, lot)
         try:
-            # 伪造 User-Agent 防止被拦截
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            }
-            resp = requests.get(img_url, headers=headers, timeout=15, stream=True)
-            if resp.status_code != 200: return
+            url = next(steps)
+            while True:
+                url = steps.send(self._process_image(url, lot))
+        except StopIteration as done:
+            return done.value
 
-            img_content = resp.content
-            with Image.open(BytesIO(img_content)) as img:
-                width, height = img.size
-                
-                # 尺寸过滤逻辑优化
-                # 原逻辑: width >= 3840 and height >= 2160 (只支持横向 4K)
-                # 新逻辑: 只要长边 >= 3840 (支持竖向 4K) 或者 满足横向 4K
-                # 考虑到用户可能设置了自定义宽高，我们使用更灵活的判断:
-                # 1. 严格匹配: 宽>=MW 且 高>=MH
-                # 2. 旋转匹配: 高>=MW 且 宽>=MH (竖图)
-                # 3. 只要长边足够大: max(w, h) >= MW (如果 MW 是主要标准)
-                
-                # 这里我们采用: 只要有一边达到 min_width (默认 3840)，或者 宽>=MW 且 高>=MH
-                is_valid = False
-                if width >= self.min_width and height >= self.min_height:
-                    is_valid = True
-                elif height >= self.min_width and width >= self.min_height: # 竖向 4K
-                    is_valid = True
-                elif max(width, height) >= self.min_width: # 只要长边够长 (比如全景图或超长竖图)
-                    is_valid = True
-                
-                if is_valid:
-                    with self.counter_lock:
-                        idx = self.counter[0]
-                        self.counter[0] += 1
-                    
-                    filename = f"{save_dir}/{idx:03d}_{width}x{height}.{img.format.lower()}"
-                    with open(filename, "wb") as f:
-                        f.write(img_content)
-                    print(f"[✔ 捕获目标] {width}x{height} -> {os.path.basename(filename)}")
-                else:
-                    # 调试日志：显示被忽略的图片尺寸，方便排查
-                    # 只显示稍微大一点的图，避免刷屏
-                    if width > 1000 or height > 1000:
-                        print(f"[跳过] {width}x{height} (不满足 {self.min_width}x{self.min_height}) - {img_url[-30:]}")
+    def _run_candidate(self, candidate, lot, submitted):
+        """线程池中执行一个候选图片，先记录它在线程池队列中等待的时间"""
+        self.tracer.observe('candidate_queue', submitted)
+        with self.tracer.span('candidate', cat='image', key=candidate.key):
+            return self._process_candidate(candidate, lot)
+
+    async def _process_candidate_async(self, candidate, lot):
+        # 生成器中有仓库查询与清单写入，每一步都在 I/O 线程池中推进
+        steps = self._candidate_steps(candidate, lot)
+        finished, value = await self.async_engine.offload(_advance, steps, None)
+        while not finished:
+            result = await self._process_image_async(value, lot)
+            finished, value = await self.async_engine.offload(_advance, steps, result)
+        return value
+
+    def _declared_too_small(self, candidate, url):
+        """根据 __NEXT_DATA__ 中声明的尺寸预先过滤变体"""
+        size = candidate.declared_size(url)
+        return size is not None and not self._is_valid_size(*size)
+
+    def _count_prefiltered(self, lot):
+        with self.counter_lock:
+            lot.prefiltered += 1
+        self._bump_progress('prefiltered')
+
+    def _finish_candidate(self, candidate, lot, state):
+        """记录候选图片的最终状态 (启用任务清单时写入清单)"""
+        if state == IMAGE_DOWNLOADED:
+            with self.counter_lock:
+                lot.saved += 1
+            self._bump_progress('accepted')
+        elif state == IMAGE_REJECTED:
+            self._bump_progress('rejected')
+        if self.manifest and lot.lot_url:
+            self.manifest.mark_image(lot.lot_url, candidate.key, state)
+        return state
+
+    def _accept_head(self, img_url, info):
+        """根据文件头解析出的尺寸决定是否继续下载"""
+        fmt, width, height = info
+        if self._is_valid_size(width, height):
+            return True
+        # 调试日志：显示被忽略的图片尺寸，方便排查
+        # 只显示稍微大一点的图，避免刷屏
+        if width > 1000 or height > 1000:
+            self.log(f"[跳过] {width}x{height} (不满足 {self.min_width}x{self.min_height}) - {img_url[-30:]}")
+        return False
+
+    def _identify_file(self, path):
+        """文件头无法识别时，由 Pillow 解析已落盘的完整文件"""
+        with Image.open(path) as img:
+            return img.format.lower(), img.size[0], img.size[1]
+
+    def _part_path(self, save_dir):
+        return os.path.join(save_dir, f".{uuid.uuid4().hex}.part")
+
+    def _next_filename(self, lot, info):
+        fmt, width, height = info
+        idx = lot.next_index
+        lot.next_index += 1
+        return f"{lot.save_dir}/{idx:03d}_{width}x{height}.{fmt}"
+
+    def _commit_image(self, part_path, lot, info, digest, img_url):
+        """临时文件写完后原子重命名为最终的 NNN_WxH.ext (启用去重时存入仓库再链接)
+
+        返回保存后的文件路径。
+        """
+        if self.store:
+            blob_path, is_new = self.store.put(part_path, digest, info, img_url)
+            filename = self._link_blob(blob_path, lot, info, digest, "捕获目标" if is_new else "已存在")
+            return filename or blob_path
+
+        fmt, width, height = info
+        existing = lot.find_existing(info, digest) if digest else None
+        if existing:
+            os.remove(part_path)
+            self.log(f"[✔ 已存在] {width}x{height} 与 {os.path.basename(existing)} 内容相同，不再保存副本")
+            return existing
+        with self.counter_lock:
+            filename = self._next_filename(lot, info)
+        os.replace(part_path, filename)
+        self.log(f"[✔ 捕获目标] {width}x{height} -> {os.path.basename(filename)}")
+        return filename
+
+    def _cache_validators(self, img_url):
+        """查询 HTTP 缓存，返回 (缓存条目, 条件请求头)；缓存不可用时返回 (None, None)"""
+        if not self.cache:
+            return None, None
+        entry = self.cache.lookup(img_url)
+        if not entry or entry['status'] not in ('accepted', 'rejected'):
+            return None, None
+        valid = self._is_valid_size(entry['width'], entry['height'])
+        # 过滤条件改变或文件已被删除时，缓存的结论不再适用，需要完整请求
+        if entry['status'] == 'rejected' and valid:
+            return None, None
+        if entry['status'] == 'accepted' and (not valid or not entry['path'] or not os.path.exists(entry['path'])):
+            return None, None
+        return entry, self.cache.conditional_headers(entry)
+
+    def _reuse_cached(self, entry, lot):
+        """服务器返回 304：直接使用缓存的结论，不读取响应体"""
+        info = (entry['fmt'], entry['width'], entry['height'])
+        width, height = entry['width'], entry['height']
+        if entry['status'] == 'rejected':
+            return FETCH_REJECTED, max(width, height)
+
+        path = entry['path']
+        with self.counter_lock:
+            if lot.has_file(path):
+                self.log(f"[✔ 未变化] {width}x{height} -> {os.path.basename(path)}")
+                return FETCH_SAVED, max(width, height)
+            filename = self._next_filename(lot, info)
+        link_file(path, filename)
+        self.log(f"[✔ 未变化] {width}x{height} -> {os.path.basename(filename)}")
+        return FETCH_SAVED, max(width, height)
+
+    def _cache_result(self, img_url, headers, status, info, path=None):
+        if self.cache:
+            self.cache.store_image(img_url, headers, status, info, path)
+
+    def _link_blob(self, blob_path, lot, info, digest, label):
+        """把仓库中的图片链接到商品文件夹，同一商品内相同内容只保留一份"""
+        fmt, width, height = info
+        with self.counter_lock:
+            if digest in lot.hashes:
+                self.log(f"[重复] {width}x{height} 与本商品已保存的图片内容相同，跳过")
+                return None
+            lot.hashes.add(digest)
+            if lot.has_file(blob_path):
+                self.log(f"[✔ 未变化] {width}x{height} 已在商品文件夹中")
+                return None
+            filename = self._next_filename(lot, info)
+        self.store.link(blob_path, filename)
+        self.log(f"[✔ {label}] {width}x{height} -> {os.path.basename(filename)}")
+        return filename
+
+    def _reuse_stored(self, img_url, lot):
+        """URL 已下载过且满足尺寸要求时，直接从仓库链接"""
+        if not self.store:
+            return False
+        hit = self.store.lookup_url(img_url)
+        if not hit:
+            return False
+        digest, fmt, width, height, blob_path = hit
+        if not self._is_valid_size(width, height):
+            return False
+        try:
+            self._link_blob(blob_path, lot, (fmt, width, height), digest, "已存在")
+            return True
+        except OSError:
+            return False
+
+    def _discard_part(self, part_path):
+        if part_path and os.path.exists(part_path):
+            try:
+                os.remove(part_path)
+            except OSError:
+                pass
+
+    def _skip_result(self):
+        return FETCH_ERROR if self._stopped() else FETCH_REJECTED, 0
+
+    def _on_response(self, fetch, status, headers, entry):
+        """收到响应头：304 时使用缓存的结论，非 200 时结束；返回 None 表示继续读取"""
+        REGISTRY.inc('http_responses_total', status=status)
+        fetch.headers = headers
+        if status == 304 and entry:
+            return self._reuse_cached(entry, fetch.lot)
+        if status != 200:
+            return self._status_result(status), 0
+        return None
+
+    def _on_head(self, fetch, head, info):
+        """读到文件头：尺寸不满足要求时结束 (关闭响应，剩余内容不再下载)，否则打开临时文件写入文件头"""
+        self.tracer.observe('image_probe', fetch.started, fetch.trace_id)
+        self._bump_progress('probed')
+        fetch.info = info
+        if not info and (fetch.headers.get('Content-Type') or '').lower().startswith('text/'):
+            # CDN 的 HTML 错误页等非图片内容：与 4xx 一样是确定的结果，不再读取剩余内容
+            self._bump_progress('bytes', len(head))
+            self.log(f"[跳过] 响应不是图片 ({fetch.headers.get('Content-Type')}): {fetch.url}")
+            return FETCH_GONE, 0
+        if info and not self._accept_head(fetch.url, info):
+            self._bump_progress('bytes', len(head))
+            self._cache_result(fetch.url, fetch.headers, 'rejected', info)
+            return FETCH_REJECTED, max(info[1], info[2])
+        # 启用仓库或文件夹中已有图片时边下载边计算哈希，用于去重
+        digest = hashlib.sha256() if self.store or fetch.lot.existing else None
+        fetch.open_part(self._part_path(fetch.lot.save_dir), head, digest)
+        return None
+
+    def _on_body_done(self, fetch):
+        """响应体读完 (或中途出错)：关闭临时文件，记录耗时与字节数"""
+        fetch.close_part()
+        self.tracer.observe('image_body', fetch.body_started, fetch.trace_id, bytes=fetch.received)
+        self._bump_progress('bytes', fetch.received)
+
+    def _complete_image(self, fetch):
+        """临时文件写完：文件头无法识别时由 Pillow 判断尺寸，通过后提交并写入缓存"""
+        info = fetch.info
+        if not info:
+            with self.tracer.stage('image_decode'):
+                try:
+                    info = self._identify_file(fetch.part_path)
+                except Image.UnidentifiedImageError:
+                    # 返回 200 但内容无法解码：重试也得到同样的内容，按确定的结果处理
+                    self.log(f"[跳过] 响应内容无法解码为图片: {fetch.url}")
+                    return FETCH_GONE, 0
+            if not self._is_valid_size(info[1], info[2]):
+                self._cache_result(fetch.url, fetch.headers, 'rejected', info)
+                return FETCH_REJECTED, max(info[1], info[2])
+
+        with self.tracer.stage('image_commit'):
+            filename = self._commit_image(fetch.part_path, fetch.lot, info, fetch.hexdigest(), fetch.url)
+        fetch.part_path = None
+        self._cache_result(fetch.url, fetch.headers, 'accepted', info, filename)
+        return FETCH_SAVED, max(info[1], info[2])
+
+    def _end_image(self, fetch):
+        self.tracer.observe('image_fetch', fetch.started, fetch.trace_id, url=fetch.url)
+        fetch.close_part()
+        self._discard_part(fetch.part_path)
+
+    def _process_image(self, img_url, lot):
+        """单个图片处理逻辑：先探测尺寸，通过过滤后边下载边写入临时文件
+
+        返回 (FETCH_* 结果, 实测长边像素)，请求失败时长边为 0。
+        这里只负责请求与读取，各阶段的判断与提交在 _on_response / _on_head / _complete_image 中，
+        与 asyncio 后端共用。
+        """
+        if not self._should_fetch(img_url):
+            return self._skip_result()
+
+        self.buffer_budget.acquire(STREAM_RESERVE_BYTES)
+        fetch = _ImageFetch(img_url, lot)
+        try:
+            entry, cond_headers = self._cache_validators(img_url)
+            with self.http.get(img_url, timeout=15, stream=True, headers=cond_headers) as resp:
+                done = self._on_response(fetch, resp.status_code, resp.headers, entry)
+                if done:
+                    return done
+                chunks = resp.iter_content(chunk_size=PROBE_CHUNK_SIZE)
+                done = self._on_head(fetch, *self._probe_head(chunks))
+                if done:
+                    return done
+                try:
+                    for chunk in chunks:
+                        fetch.write(chunk)
+                finally:
+                    self._on_body_done(fetch)
+            return self._complete_image(fetch)
         except Exception:
-            pass
+            return FETCH_ERROR, 0
+        finally:
+            self._end_image(fetch)
+            self.buffer_budget.release(STREAM_RESERVE_BYTES)
+
+    async def _process_image_async(self, img_url, lot):
+        """asyncio 版本的单个图片处理逻辑，只有请求与读取不同，判断与提交同 _process_image
+
+        判断与提交中的阻塞操作 (SQLite、写盘、哈希、Pillow) 都在 I/O 线程池中执行；
+        缓冲额度在拿到响应头之后才预留，排队等待连接的请求不占用额度。
+        """
+        if not self._should_fetch(img_url):
+            return self._skip_result()
+
+        offload = self.async_engine.offload
+        fetch = _ImageFetch(img_url, lot, next(self.trace_ids))
+        reserved = False
+        try:
+            entry, cond_headers = await offload(self._cache_validators, img_url)
+            async with self.async_engine.get(img_url, headers=cond_headers) as resp:
+                done = await offload(self._on_response, fetch, resp.status, resp.headers, entry)
+                if done:
+                    return done
+                queued = time.perf_counter()
+                await self.buffer_budget.acquire_async(STREAM_RESERVE_BYTES)
+                reserved = True
+                self.tracer.observe('image_wait', queued, fetch.trace_id)  # 等待缓冲预算
+                head = b''
+                info = None
+                async for chunk in resp.content.iter_chunked(PROBE_CHUNK_SIZE):
+                    head += chunk
+                    info = probe_image_size(head)
+                    if info or len(head) >= PROBE_MAX_BYTES:
+                        break
+                done = await offload(self._on_head, fetch, head, info)
+                if done:
+                    return done
+                # 小块攒到 PROBE_MAX_BYTES (仍在预留额度内) 再交给 I/O 线程写盘
+                try:
+                    pending, size = [], 0
+                    async for chunk in resp.content.iter_chunked(PROBE_CHUNK_SIZE):
+                        pending.append(chunk)
+                        size += len(chunk)
+                        if size >= PROBE_MAX_BYTES:
+                            await offload(fetch.write, b''.join(pending))
+                            pending, size = [], 0
+                    if pending:
+                        await offload(fetch.write, b''.join(pending))
+                finally:
+                    await offload(self._on_body_done, fetch)
+            return await offload(self._complete_image, fetch)
+        except Exception:
+            return FETCH_ERROR, 0
+        finally:
+            await offload(self._end_image, fetch)
+            if reserved:
+                self.buffer_budget.release(STREAM_RESERVE_BYTES)
+
+    async def _download_all_async(self, candidates, lot):
+        await asyncio.gather(*(self._process_candidate_async(c, lot) for c in candidates))
 
     def _scan_page(self, page, url):
-        """页面扫描逻辑"""
-        print(f"目标 URL: {url}")
-        self.image_urls.clear() # 清空上一页的记录
+        """页面扫描逻辑，返回本页独立的 ScanResult"""
+        self.log(f"目标 URL: {url}")
+        result = ScanResult(url)
         
         # 1. 监听网络请求
         def handle_response(response):
             try:
                 if response.request.resource_type == "image":
-                    self._add_url(response.url)
+                    result.add_url(response.url)
                 elif "image" in response.headers.get("content-type", ""):
-                    self._add_url(response.url)
+                    result.add_url(response.url)
             except:
                 pass
         
         # 移除旧的监听器 (如果有) - Playwright page 对象通常是新的，所以不需要
         page.on("response", handle_response)
+        if self.block_resources:
+            # 图片请求只记录 URL 后中止，不让浏览器下载下载阶段还要再请求一次的内容；
+            # 字体、视频和统计脚本直接中止
+            block_resources(page, 'lot', on_image=result.add_url)
 
         try:
-            page.goto(url, timeout=60000)
+            with self.tracer.stage('navigate'):
+                page.goto(url, timeout=60000)
         except Exception as e:
-            print(f"页面加载警告: {e}")
+            self.log(f"页面加载警告: {e}")
+
+        if self.dom_scan == 'fast':
+            # 滚动前开始增量收集图片地址
+            try:
+                page.evaluate(_DOM_COLLECTOR_JS)
+            except Exception as e:
+                self.log(f"安装图片收集器出错: {e}")
 
         # 2. 获取标题 (如果需要外部调用者处理，这里可以返回)
         page_title = ""
@@ -140,84 +1362,78 @@ class ImageDownloader:
             page_title = page.title()
 
         # 3. 模拟滚动
-        print("正在滚动页面以触发懒加载...")
+        self.log("正在滚动页面以触发懒加载...")
         try:
-            last_height = page.evaluate("document.body.scrollHeight")
-            while True:
-                page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-                time.sleep(1.5)
-                new_height = page.evaluate("document.body.scrollHeight")
-                if new_height == last_height:
-                    break
-                last_height = new_height
+            # 每次滚动后页面一稳定就继续，最长等待 settle_timeout
+            with self.tracer.stage('scroll'):
+                scroll_until_stable(page, timeout_ms=int(self.settle_timeout * 1000))
         except Exception as e:
-            print(f"滚动时出错: {e}")
+            self.log(f"滚动时出错: {e}")
 
         # 4. DOM 扫描
-        print("正在扫描 DOM 结构...")
+        self.log("正在扫描 DOM 结构...")
         try:
-            dom_images = page.evaluate("""() => {
-                const urls = [];
-                document.querySelectorAll('img').forEach(img => {
-                    if (img.src) urls.push(img.src);
-                    if (img.dataset.src) urls.push(img.dataset.src);
-                    if (img.srcset) {
-                        // 提取 srcset 中的最大图
-                        const sources = img.srcset.split(',');
-                        const lastSource = sources[sources.length - 1].trim().split(' ')[0];
-                        if (lastSource) urls.push(lastSource);
-                    }
-                });
-                document.querySelectorAll('*').forEach(el => {
-                    const style = window.getComputedStyle(el);
-                    const bg = style.backgroundImage;
-                    if (bg && bg !== 'none') {
-                        const match = bg.match(/url\\(['"]?(.*?)['"]?\\)/);
-                        if (match) urls.push(match[1]);
-                    }
-                });
-                return urls;
-            }""")
+            with self.tracer.stage('dom_scan'):
+                dom_images = page.evaluate(_DOM_FAST_SCAN_JS if self.dom_scan == 'fast' else _DOM_FULL_SCAN_JS)
             for u in dom_images:
-                self._add_url(u)
+                result.add_url(u)
         except Exception as e:
-            print(f"DOM 扫描出错: {e}")
+            self.log(f"DOM 扫描出错: {e}")
 
         # 5. 深度扫描 __NEXT_DATA__ (针对 Sotheby's 等 Next.js 站点)
-        print("正在扫描 __NEXT_DATA__ 数据...")
+        self.log("正在扫描 __NEXT_DATA__ 数据...")
         try:
-            import json
             next_data = page.evaluate("""() => {
                 const el = document.getElementById('__NEXT_DATA__');
                 return el ? el.innerText : null;
             }""")
             
             if next_data:
-                data = json.loads(next_data)
-                
-                # 递归查找所有 URL
-                def find_urls(obj):
-                    if isinstance(obj, dict):
-                        for k, v in obj.items():
-                            if isinstance(v, str):
-                                if v.startswith('http') and any(ext in v.lower() for ext in ['.jpg', '.jpeg', '.png', '.webp']):
-                                    self._add_url(v)
-                            else:
-                                find_urls(v)
-                    elif isinstance(obj, list):
-                        for item in obj:
-                            find_urls(item)
-                
-                find_urls(data)
-                print("已处理 __NEXT_DATA__ 中的潜在图片链接")
+                with self.tracer.stage('next_data'):
+                    result.add_next_data(json.loads(next_data))
+                self.log("已处理 __NEXT_DATA__ 中的潜在图片链接")
         except Exception as e:
-            print(f"__NEXT_DATA__ 扫描出错: {e}")
+            self.log(f"__NEXT_DATA__ 扫描出错: {e}")
             
-        return page_title
+        result.title = page_title
+        return result
+
+    def _scan_http(self, url):
+        """HTTP 快速扫描：不启动浏览器，直接解析页面 HTML 中的 __NEXT_DATA__ 和图片属性"""
+        self.log(f"目标 URL (HTTP): {url}")
+        result = ScanResult(url)
+
+        with self.tracer.stage('http_page'):
+            if self.cache:
+                body, _ = self.cache.fetch(self.http.session, url)
+            else:
+                with self.http.get(url, timeout=30) as resp:
+                    REGISTRY.inc('http_responses_total', status=resp.status_code)
+                    resp.raise_for_status()
+                    body = resp.content
+
+        with self.tracer.stage('html_parse'):
+            parser = _PageImageParser()
+            parser.feed(body.decode('utf-8', errors='replace'))
+            parser.close()
+
+        for u in parser.urls:
+            result.add_url(urljoin(url, u))
+        if parser.next_data:
+            try:
+                with self.tracer.stage('next_data'):
+                    result.add_next_data(json.loads(parser.next_data))
+            except ValueError as e:
+                self.log(f"__NEXT_DATA__ 解析出错: {e}")
 
-    def _download_images(self, output_dir):
-        """并发下载逻辑"""
-        print(f"分析完成！共发现 {len(self.image_urls)} 个潜在资源。")
+        result.title = parser.h1 or parser.title
+        return result
+
+    def _download_images(self, output_dir, candidates, lot_url=None):
+        """并发下载逻辑，每张图片 (含所有 URL 变体) 作为一个下载单元"""
+        candidates = list(candidates) # 使用副本进行迭代
+        variants = sum(len(c.variants) for c in candidates)
+        self.log(f"分析完成！共发现 {len(candidates)} 张图片 ({variants} 个 URL 变体)。")
         
         # 如果设置了 base_dir，则在其下创建子文件夹
         if self.base_dir:
@@ -228,74 +1444,455 @@ class ImageDownloader:
         if not os.path.exists(final_dir):
             os.makedirs(final_dir)
         
-        print(f"开始并发下载 (线程数: {self.max_workers})...")
-        # 重置计数器
-        self.counter = [1]
+        if self.dedupe and self.store is None:
+            self.store = ImageStore(os.path.join(self.base_dir or ".", ".store"))
+        if self.cache_path and self.cache is None:
+            self.cache = HttpCache(self.cache_path, max_entries=self.cache_size)
+        # 每个商品独立计数；启用仓库或缓存时从已有文件继续编号
+        lot = LotState(final_dir, resume=bool(self.store or self.cache or self.manifest), lot_url=lot_url)
         
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            for img_url in list(self.image_urls): # 使用副本进行迭代
-                executor.submit(self._process_image, img_url, final_dir)
+        if self.engine == 'asyncio':
+            if self.async_engine is None:
+                self.async_engine = AsyncEngine(concurrency=self.concurrency, pool_size=self.http.pool_size)
+                if self.http.pool_size < self.concurrency:
+                    # aiohttp 按主机限制连接数：图片都来自同一个 CDN 时，在途请求数不超过 --pool-size
+                    self.log(f"每个图片主机最多 {self.http.pool_size} 个连接 (--pool-size)，"
+                             f"同一主机的在途请求数以此为准，其余请求等待连接 (不占用缓冲额度)")
+            slots = self.buffer_budget.slots(STREAM_RESERVE_BYTES)
+            if slots < self.concurrency:
+                # 超出缓冲额度的请求在等待队列中排队，实际在途请求数以额度为准
+                self.log(f"开始异步下载 (并发上限: {self.concurrency}，缓冲额度最多容纳 {slots} 个在途请求)...")
+            else:
+                self.log(f"开始异步下载 (并发上限: {self.concurrency})...")
+            self.async_engine.run(self._download_all_async(candidates, lot))
+        else:
+            self.log(f"开始并发下载 (线程数: {self.max_workers})...")
+            executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            try:
+                for candidate in candidates:
+                    executor.submit(self._run_candidate, candidate, lot, time.perf_counter())
+            finally:
+                # 等待最后几张 (最慢的) 图片完成，时间线上可以看到长尾拖住了多久
+                with self.tracer.span('executor_drain', cat='lot', url=lot_url):
+                    executor.shutdown(wait=True)
         
-        print(f"任务结束。请查看文件夹: {final_dir}")
+        if lot.prefiltered:
+            self.log(f"按页面声明的尺寸跳过 {lot.prefiltered} 个变体 (未发请求)")
+        self.log(f"任务结束。请查看文件夹: {final_dir}")
+        return lot
+
+    def print_pool_stats(self):
+        stats = self.async_engine.stats() if self.async_engine else self.http.stats()
+        self.log(f"连接池统计: 请求 {stats['requests']}, 复用 {stats['hits']}, "
+              f"新建连接 {stats['new_connections']}, 等待 {stats['waits']}")
+
+    def close(self):
+        """释放下载后端占用的连接和事件循环"""
+        self.http.close()  # 会话关闭后仍可再次使用，连接池按需重建
+        if self.async_engine is not None:
+            self.async_engine.close()
+            self.async_engine = None
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+        if self.cache is not None and self.owns_cache:
+            self.cache.close()
+            self.cache = None
+        if self.manifest is not None and self.owns_manifest:
+            self.manifest.close()
+            self.manifest = None
 
     def run(self, url, output_dir=None):
         """执行单个下载任务"""
-        print(f"启动下载器...")
-        print(f"过滤标准: {self.min_width}x{self.min_height}")
+        self.log(f"启动下载器...")
+        self.log(f"过滤标准: {self.min_width}x{self.min_height}")
         
         with sync_playwright() as p:
             browser = p.chromium.launch(headless=self.headless)
             context = browser.new_context()
             page = context.new_page()
             
-            fetched_title = self._scan_page(page, url)
+            result = self._scan_page(page, url)
             
             if not output_dir:
-                output_dir = self.sanitize_filename(fetched_title)
+                output_dir = self.sanitize_filename(result.title)
             
-            print(f"保存目录: {output_dir}")
+            self.log(f"保存目录: {output_dir}")
             browser.close()
             
-            self._download_images(output_dir)
+            try:
+                self._download_images(output_dir, result.candidate_list())
+                self.print_pool_stats()
+            finally:
+                self.close()
 
-    def run_batch(self, tasks):
-        """批量执行任务，复用浏览器实例"""
-        print(f"启动批量下载器...")
-        print(f"任务数量: {len(tasks)}")
-        print(f"过滤标准: {self.min_width}x{self.min_height}")
-        
-        with sync_playwright() as p:
-            # 启动浏览器
-            browser = p.chromium.launch(headless=self.headless)
-            
-            for i, (url, title) in enumerate(tasks):
-                print(f"\n{'='*20} 正在执行任务 [{i+1}/{len(tasks)}] {'='*20}")
-                
+    def _scan_task_http(self, url, title):
+        """HTTP 快速扫描单个商品页，返回 (保存目录, 候选图片列表)"""
+        result = self._scan_http(url)
+        final_title = title if title else result.title
+        return self.sanitize_filename(final_title), result.candidate_list()
+
+    def _scan_task(self, browser, url, title):
+        """扫描单个商品页，返回 (保存目录, 候选图片列表)"""
+        # 为每个任务创建新上下文，确保隔离
+        context = browser.new_context()
+        try:
+            return self._scan_in_context(context, url, title)
+        finally:
+            context.close() # 关闭上下文
+
+    def _scan_with_service(self, url, title, submitted):
+        """常驻浏览器服务执行的扫描任务，记录等待浏览器 worker 的时间"""
+        def scan(context):
+            self.tracer.observe('browser_queue', submitted, url=url)
+            return self._scan_in_context(context, url, title)
+        return scan
+
+    def _scan_in_context(self, context, url, title):
+        """在给定上下文中打开新页面扫描商品页 (上下文可以来自常驻浏览器服务)"""
+        page = context.new_page()
+        try:
+            result = self._scan_page(page, url)
+        finally:
+            page.close()
+
+        # 确定输出目录
+        final_title = title if title else result.title
+        return self.sanitize_filename(final_title), result.candidate_list()
+
+    def _process_options(self):
+        """扫描进程中重建下载器所需的参数 (只包含扫描相关的设置)"""
+        return {
+            'headless': self.headless, 'pool_size': self.http.pool_size, 'scan_mode': self.scan_mode,
+            'settle_timeout': self.settle_timeout, 'dom_scan': self.dom_scan,
+            'block_resources': self.block_resources, 'trace': self.tracer.enabled,
+        }
+
+    def _start_scan_pool(self, processes):
+        # spawn：不继承主进程的线程与 Playwright 状态
+        self.scan_pool_size = processes
+        self.scan_pool = ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_scan_process, initargs=(self._process_options(),),
+        )
+
+    def _scan_remote(self, url, title, use_http):
+        """在扫描进程中扫描商品页；进程池损坏 (如扫描进程崩溃) 时重建一次再试
+
+        扫描进程随结果带回本次扫描记录的指标和时间线事件，合并到主进程的 REGISTRY 和 tracer。
+        """
+        pool = self.scan_pool
+        try:
+            result, stats, events = pool.submit(_scan_in_process, url, title, use_http).result()
+        except BrokenProcessPool:
+            with self.scan_pool_lock:
+                if self.scan_pool is pool:
+                    self.log("扫描进程异常退出，重建进程池...")
+                    pool.shutdown(wait=False)
+                    self._start_scan_pool(self.scan_pool_size)
+            result, stats, events = self.scan_pool.submit(_scan_in_process, url, title, use_http).result()
+        REGISTRY.merge(stats)
+        self.tracer.extend(events)
+        return result
+
+    def _lot_done(self, task_queue, workers):
+        """一个商品的扫描 (及可能的回退扫描) 全部结束；全部结束后通知扫描线程退出"""
+        with self.progress_lock:
+            self._outstanding -= 1
+            finished = self._outstanding <= 0
+        if finished:
+            for _ in range(workers):
+                task_queue.put(None)
+
+    def _download_stage(self, lot_queue, task_queue=None, workers=0):
+        """下载阶段：从队列中取出扫描结果并下载，直到收到结束标记
+
+        HTTP 快速扫描得到的商品若没有任何图片通过过滤，放回任务队列改用浏览器重新扫描。
+        """
+        while True:
+            item = lot_queue.get()
+            if item is None:
+                break
+            url, candidates, save_dir, fallback_task, counted = item
+            try:
+                if not self._stopped():
+                    with self.tracer.stage('lot_download', url=url):
+                        lot = self._download_images(save_dir, candidates, lot_url=url)
+                    if fallback_task and lot.saved == 0 and not self._stopped():
+                        self.log(f"HTTP 扫描的图片均未通过过滤，改用浏览器重新扫描: {url}")
+                        if self.manifest:
+                            # 先写入清单：重新扫描前中断时，续跑仍会用浏览器扫描这个商品
+                            self.manifest.mark_lot_fallback(url)
+                        try:
+                            os.rmdir(lot.save_dir)  # 只删除空文件夹，浏览器扫描可能得到不同的标题
+                        except OSError:
+                            pass
+                        self._bump_progress('fallback')
+                        REGISTRY.inc('lots_total', result='fallback')
+                        task_queue.put(fallback_task)
+                        continue
+                    if self.manifest:
+                        self.manifest.finish_lot(url)
+                    self._bump_progress('downloaded')
+                    REGISTRY.inc('lots_total', result='downloaded')
+            except Exception as e:
+                self.log(f"❌ 下载失败: {url}\n原因: {e}")
+                self._bump_progress('failed')
+                REGISTRY.inc('lots_total', result='download_failed')
+            if counted:
+                self._lot_done(task_queue, workers)
+
+    def _scan_stage(self, task_queue, lot_queue, total, workers):
+        """扫描阶段：从任务队列取商品页扫描，结果放入下载队列"""
+        try:
+            self._scan_loop(task_queue, lot_queue, total, workers)
+        except Exception as e:
+            self.log(f"❌ 扫描线程异常退出: {e}")
+
+    def _scan_loop(self, task_queue, lot_queue, total, workers):
+        # 浏览器按需启动：HTTP 快速扫描模式下只有回退时才需要
+        playwright = None
+        browser = None
+        try:
+            while not self._stopped():
                 try:
-                    # 为每个任务创建新上下文，确保隔离
-                    context = browser.new_context()
-                    page = context.new_page()
-                    
-                    fetched_title = self._scan_page(page, url)
-                    
-                    # 确定输出目录
-                    if title:
-                        final_title = title
-                    else:
-                        final_title = fetched_title
-                    
-                    save_dir = self.sanitize_filename(final_title)
-                    print(f"保存目录: {save_dir}")
-                    
-                    context.close() # 关闭上下文
-                    
-                    # 下载图片 (不需要浏览器)
-                    self._download_images(save_dir)
-                    
+                    task = task_queue.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if task is None:
+                    break
+
+                i, url, title, force_browser = task
+                self.log(f"\n{'='*20} 正在扫描任务 [{i+1}/{total}] {'='*20}")
+                use_http = self.scan_mode == 'http' and not force_browser
+                scan_started = time.perf_counter()
+                try:
+                    if use_http:
+                        try:
+                            if self.scan_pool is not None:
+                                save_dir, candidates = self._scan_remote(url, title, True)
+                            else:
+                                save_dir, candidates = self._scan_task_http(url, title)
+                        except Exception as e:
+                            # 反爬拦截 (403)、服务器错误或超时：页面本身可能需要浏览器才能打开
+                            self.log(f"HTTP 扫描失败 ({e})，改用浏览器扫描...")
+                            candidates = None
+                        if not candidates:
+                            if candidates is not None:
+                                self.log("HTTP 扫描未发现图片，改用浏览器扫描...")
+                            use_http = False
+                    if not use_http and self.scan_pool is not None:
+                        save_dir, candidates = self._scan_remote(url, title, False)
+                    elif not use_http and self.browser_service is not None:
+                        # 借用常驻浏览器服务的预热上下文 (在服务的线程中执行)
+                        save_dir, candidates = self.browser_service.run(
+                            self._scan_with_service(url, title, time.perf_counter()))
+                    elif not use_http:
+                        if browser is None:
+                            playwright = sync_playwright().start()
+                            browser = playwright.chromium.launch(headless=self.headless)
+                        save_dir, candidates = self._scan_task(browser, url, title)
                 except Exception as e:
-                    print(f"❌ 任务失败: {url}\n原因: {e}")
-            
-            browser.close()
+                    self.log(f"❌ 任务失败: {url}\n原因: {e}")
+                    REGISTRY.inc('lots_total', result='scan_failed')
+                    if self.manifest:
+                        self.manifest.mark_lot_failed(url, e)
+                    self._bump_progress('failed')
+                    self._lot_done(task_queue, workers)
+                    continue
+
+                self.tracer.observe('lot_scan', scan_started, url=url)
+                REGISTRY.inc('lots_total', result='scanned')
+                REGISTRY.inc('candidates_total', len(candidates))
+                if self.manifest:
+                    self.manifest.mark_scanned(url, save_dir, candidates)
+
+                self.log(f"[{i+1}/{total}] 保存目录: {save_dir}")
+                self._bump_progress('candidates', len(candidates))
+                if not force_browser:
+                    self._bump_progress('scanned')
+                fallback_task = (i, url, title, True) if use_http else None
+                # 队列已满时阻塞，等待下载阶段赶上
+                lot_queue.put((url, candidates, save_dir, fallback_task, True))
+
+            if self._stopped():
+                self.log("收到停止信号，中断扫描...")
+        finally:
+            if browser is not None:
+                browser.close()
+            if playwright is not None:
+                playwright.stop()
+
+    def _restore_candidates(self, lot_url):
+        """从任务清单恢复尚未完成的候选图片"""
+        candidates = []
+        for key, variants in self.manifest.unfinished_images(lot_url):
+            cand = ImageCandidate(key)
+            for url, priority, *size in variants:
+                cand.add(url, priority)
+                if size:
+                    cand.declare(url, *size)
+            candidates.append(cand)
+        return candidates
+
+    def _plan_resume(self, tasks):
+        """根据任务清单拆分任务：返回 (需要扫描的任务, 只需下载的商品, 已完成的商品数)
+
+        需要扫描的任务为 (序号, URL, 标题, 是否直接用浏览器扫描)。
+        """
+        if not self.manifest:
+            return [(i, url, title, False) for i, (url, title) in enumerate(tasks)], [], 0
+
+        self.manifest.add_lots(tasks)
+        to_scan, resumed, skipped = [], [], 0
+        for i, (url, title) in enumerate(tasks):
+            state, save_dir = self.manifest.lot(url)
+            final_dir = os.path.join(self.base_dir, save_dir) if (self.base_dir and save_dir) else save_dir
+            if state == LOT_DOWNLOADED and final_dir and os.path.isdir(final_dir):
+                skipped += 1
+            elif state == LOT_SCANNED and save_dir:
+                resumed.append((url, self._restore_candidates(url), save_dir))
+            else:
+                to_scan.append((i, url, title, state == LOT_FALLBACK))
+        if skipped or resumed:
+            self.log(f"续跑: 跳过已完成的 {skipped} 个商品，{len(resumed)} 个商品只需下载剩余图片")
+        return to_scan, resumed, skipped
+
+    def run_pipeline(self, tasks):
+        """流水线执行批量任务：浏览器扫描与图片下载并行进行
+
+        扫描阶段由 scan_workers 个扫描线程并行执行，每个扫描线程
+        把 (商品 URL, 候选图片, 保存目录) 放入有界队列，
+        下载阶段在独立线程中消费。队列满时扫描阶段会阻塞等待 (背压)，
+        避免扫描结果无限堆积。
+
+        scan_processes > 0 时改为多进程扫描：每个扫描进程有自己的浏览器，
+        扫描线程只负责把商品页交给进程池并把结果送入下载队列，
+        浏览器控制、JSON 解析和 URL 处理分散到多个 CPU 核上。
+
+        scan_mode='http' 时扫描线程只请求页面 HTML，浏览器仅在 HTTP 扫描
+        没有找到可用图片时才启动。
+
+        设置 manifest_path 时，已完成的商品直接跳过，已扫描的商品只下载
+        未完成或失败的图片，不再打开浏览器。
+        """
+        if self.manifest_path and self.manifest is None:
+            self.manifest = JobManifest(self.manifest_path)
+        to_scan, resumed, skipped = self._plan_resume(tasks)
+
+        with self.progress_lock:
+            # 等待浏览器重新扫描的商品在上次运行中已计入扫描数 (浏览器扫描不再重复计数)
+            rescans = sum(1 for task in to_scan if task[3])
+            self.progress = {'total': len(tasks), 'scanned': len(resumed) + rescans, 'downloaded': skipped,
+                             'failed': 0, 'skipped': skipped, 'fallback': 0,
+                             'candidates': sum(len(c) for _, c, _ in resumed), 'probed': 0,
+                             'accepted': 0, 'rejected': 0, 'prefiltered': 0, 'bytes': 0,
+                             'started': time.monotonic()}
+        if self.scan_mode == 'http':
+            self.log("扫描模式: HTTP 快速扫描 (无可用图片时回退到浏览器)")
+
+        lot_queue = queue.Queue(maxsize=max(1, self.queue_size))
+        self.lot_queue = lot_queue
+        task_queue = queue.Queue()
+        for task in to_scan:
+            task_queue.put(task)
+
+        # 扫描池：每个扫描线程拥有独立的 Playwright 实例和浏览器 (sync API 不能跨线程共享)
+        # 多进程模式下每个扫描进程对应一个扫描线程
+        parallel = self.scan_processes if self.scan_processes > 0 else self.scan_workers
+        workers = max(1, min(parallel, len(to_scan))) if to_scan else 0
+        if workers and self.scan_processes > 0:
+            self._start_scan_pool(workers)
+            self.log(f"多进程扫描 (扫描进程数: {workers})")
+        elif workers > 1:
+            self.log(f"并行扫描 (扫描线程数: {workers})")
+        self._outstanding = len(to_scan)
+        consumer = threading.Thread(target=self._download_stage, args=(lot_queue, task_queue, workers), daemon=True)
+        consumer.start()
+        scanners = [
+            threading.Thread(target=self._scan_stage, args=(task_queue, lot_queue, len(tasks), workers), daemon=True)
+            for _ in range(workers)
+        ]
+        try:
+            for t in scanners:
+                t.start()
+            # 已扫描过的商品直接进入下载阶段
+            for url, candidates, save_dir in resumed:
+                if self._stopped():
+                    break
+                lot_queue.put((url, candidates, save_dir, None, False))
+            for t in scanners:
+                t.join()
+        finally:
+            if self.scan_pool is not None:
+                self.scan_pool.shutdown()
+                self.scan_pool = None
+            # 通知下载阶段结束，并等待剩余任务下载完成
+            lot_queue.put(None)
+            consumer.join()
+            self.print_pool_stats()
+            self.close()
+
+        with self.progress_lock:
+            return self._progress_snapshot()
+
+    def run_batch(self, tasks):
+        """批量执行任务，复用浏览器实例，扫描与下载流水线并行"""
+        self.log(f"启动批量下载器...")
+        self.log(f"任务数量: {len(tasks)}")
+        self.log(f"过滤标准: {self.min_width}x{self.min_height}")
+
+        return self.run_pipeline(tasks)
+
+# ---- 多进程扫描 ----
+# 每个扫描进程持有一个精简的 ImageDownloader 和自己的浏览器，
+# 主进程的扫描线程把商品页交给进程池，拿回 (保存目录, 候选图片列表) 后照常进入下载阶段。
+_process_scanner = None
+
+
+class _ProcessScanner:
+    """扫描进程中的扫描器：浏览器在第一个需要浏览器的商品到来时启动"""
+
+    def __init__(self, options):
+        options = dict(options)
+        trace = options.pop('trace', False)
+        self.downloader = ImageDownloader(**options, tracer=Tracer() if trace else None)
+        self.playwright = None
+        self.browser = None
+        # 进程池关闭时释放浏览器 (multiprocessing 子进程退出时不执行 atexit)
+        multiprocessing.util.Finalize(self, self.close, exitpriority=10)
+
+    def scan(self, url, title, use_http):
+        if use_http:
+            return self.downloader._scan_task_http(url, title)
+        if self.browser is None or not self.browser.is_connected():
+            if self.playwright is None:
+                self.playwright = sync_playwright().start()
+            self.browser = self.playwright.chromium.launch(headless=self.downloader.headless)
+        return self.downloader._scan_task(self.browser, url, title)
+
+    def close(self):
+        if self.browser is not None:
+            try:
+                self.browser.close()
+            except Exception:
+                pass
+            self.browser = None
+        if self.playwright is not None:
+            self.playwright.stop()
+            self.playwright = None
+
+
+def _init_scan_process(options):
+    global _process_scanner
+    _process_scanner = _ProcessScanner(options)
+
+
+def _scan_in_process(url, title, use_http):
+    # 随结果带回本进程记录的指标增量和时间线事件 (扫描失败时留到下一次一起带回)
+    result = _process_scanner.scan(url, title, use_http)
+    return result, REGISTRY.drain(), _process_scanner.downloader.tracer.drain()
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="通用高清图片下载器 (复刻 ImageAssistant 核心逻辑)")
@@ -305,6 +1902,24 @@ if __name__ == "__main__":
     parser.add_argument("--headless", action="store_true", default=True, help="是否使用无头模式 (默认: True)")
     parser.add_argument("--no-headless", action="store_false", dest="headless", help="关闭无头模式 (显示浏览器)")
     parser.add_argument("--base-dir", type=str, default=None, help="所有商品文件夹的根目录 (默认: 当前目录)")
+    parser.add_argument("--queue-size", type=int, default=4, help="扫描与下载之间的队列上限 (默认: 4)")
+    parser.add_argument("--scan-workers", type=int, default=1, help="并行扫描商品页的浏览器数量 (默认: 1)")
+    parser.add_argument("--pool-size", type=int, default=16, help="每个图片主机的最大连接数 (默认: 16)")
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads", help="下载后端 (默认: threads)")
+    parser.add_argument("--concurrency", type=int, default=500, help="asyncio 后端同时在途的请求上限 (默认: 500)")
+    parser.add_argument("--max-buffer-mb", type=int, default=64, help="所有并发下载共享的内存缓冲上限, 单位 MB (默认: 64)")
+    parser.add_argument("--dedupe", action="store_true", help="启用按内容哈希去重的图片仓库 (保存在 <base-dir>/.store)")
+    parser.add_argument("--cache", type=str, default=None, help="持久化 HTTP 缓存文件路径, 重跑时发送条件请求 (默认: 不启用)")
+    parser.add_argument("--cache-size", type=int, default=100000, help="HTTP 缓存条目上限, 超出后按 LRU 淘汰 (默认: 100000)")
+    parser.add_argument("--scan-mode", choices=["browser", "http"], default="browser", help="商品页扫描方式: browser (Playwright) 或 http (只请求 HTML, 无可用图片时回退到浏览器) (默认: browser)")
+    parser.add_argument("--settle-timeout", type=float, default=5.0, help="每次滚动后等待页面稳定的上限秒数，页面稳定后立即继续 (默认: 5)")
+    parser.add_argument("--dom-scan", choices=["fast", "full"], default="fast", help="DOM 背景图扫描方式: fast (只计算样式表命中的元素) 或 full (逐个元素计算样式) (默认: fast)")
+    parser.add_argument("--no-block", action="store_false", dest="block_resources", help="扫描商品页时不拦截图片、字体、视频和统计请求")
+    parser.add_argument("--scan-processes", type=int, default=0, help="多进程扫描：扫描进程数，每个进程一个浏览器，0 表示不启用 (默认: 0)")
+    parser.add_argument("--manifest", type=str, default=None, help="SQLite 任务清单路径, 中断后再次运行会从上次停下的地方继续 (默认: 不启用)")
+    parser.add_argument("--metrics", type=str, default=None, help="运行结束时把各阶段耗时等指标的 JSON 摘要写入该文件 (默认只打印)")
+    parser.add_argument("--trace", type=str, default=None, help="记录每个阶段和每次图片请求的时间线, 以 Chrome trace 格式写入该文件 (默认: 不启用)")
+    parser.add_argument("--trace-sample-ms", type=int, default=0, help="追踪时每隔多少毫秒采样一次各线程正在执行的函数, 0 表示不采样 (默认: 0)")
     
     args = parser.parse_args()
     
@@ -312,7 +1927,23 @@ if __name__ == "__main__":
         min_width=args.width, 
         min_height=args.height, 
         headless=args.headless,
-        base_dir=args.base_dir
+        base_dir=args.base_dir,
+        queue_size=args.queue_size,
+        scan_workers=args.scan_workers,
+        pool_size=args.pool_size,
+        engine=args.engine,
+        concurrency=args.concurrency,
+        max_buffer_bytes=args.max_buffer_mb * 1024 * 1024,
+        dedupe=args.dedupe,
+        cache_path=args.cache,
+        cache_size=args.cache_size,
+        manifest_path=args.manifest,
+        scan_mode=args.scan_mode,
+        settle_timeout=args.settle_timeout,
+        dom_scan=args.dom_scan,
+        block_resources=args.block_resources,
+        scan_processes=args.scan_processes,
+        tracer=Tracer(args.trace, sample_ms=args.trace_sample_ms) if args.trace else None
     )
 
     # 判断输入是文件还是 URL
@@ -340,3 +1971,7 @@ if __name__ == "__main__":
     else:
         # 单个 URL 模式
         downloader.run(args.input)
+
+    dump_summary(args.metrics)
+    if args.trace:
+        print(f"时间线已写入: {downloader.tracer.save()}")
@@ -0,0 +1,91 @@
+import os
+import shutil
+import sqlite3
+import threading
+
+
+def link_file(src, dest):
+    """创建指向 src 的文件：硬链接 -> 符号链接 -> 复制"""
+    try:
+        os.link(src, dest)
+        return
+    except OSError:
+        pass
+    try:
+        os.symlink(os.path.abspath(src), dest)
+        return
+    except OSError:
+        pass
+    shutil.copy2(src, dest)
+
+
+class ImageStore:
+    """按内容哈希存储图片的 blob 仓库，用于跨商品去重
+
+    图片内容保存在 root/blobs/<前两位>/<哈希>.<格式>，商品文件夹中的
+    NNN_WxH.ext 只是指向 blob 的硬链接 (不支持时退回符号链接或复制)。
+    index.sqlite 记录 URL -> 哈希，已下载过的 URL 直接链接，不再请求。
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.blob_dir = os.path.join(root, "blobs")
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(root, "index.sqlite"), check_same_thread=False)
+        with self._lock:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                " hash TEXT PRIMARY KEY, fmt TEXT, width INTEGER, height INTEGER, size INTEGER)"
+            )
+            self._db.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, hash TEXT)")
+            self._db.commit()
+
+    def blob_path(self, digest, fmt):
+        return os.path.join(self.blob_dir, digest[:2], f"{digest}.{fmt}")
+
+    def lookup_url(self, url):
+        """查询 URL 是否下载过，返回 (哈希, 格式, 宽, 高, blob 路径)，blob 丢失时返回 None"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT b.hash, b.fmt, b.width, b.height FROM urls u JOIN blobs b ON u.hash = b.hash WHERE u.url = ?",
+                (url,),
+            ).fetchone()
+        if not row:
+            return None
+        path = self.blob_path(row[0], row[1])
+        if not os.path.exists(path):
+            return None
+        return row[0], row[1], row[2], row[3], path
+
+    def put(self, part_path, digest, info, url):
+        """把下载完成的临时文件存入仓库，返回 (blob 路径, 是否为新内容)
+
+        内容已存在时直接删除临时文件。调用后 part_path 不再可用。
+        """
+        fmt, width, height = info
+        path = self.blob_path(digest, fmt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        is_new = not os.path.exists(path)
+        if is_new:
+            size = os.path.getsize(part_path)
+            os.replace(part_path, path)
+        else:
+            size = os.path.getsize(path)
+            os.remove(part_path)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO blobs (hash, fmt, width, height, size) VALUES (?, ?, ?, ?, ?)",
+                (digest, fmt, width, height, size),
+            )
+            self._db.execute("INSERT OR REPLACE INTO urls (url, hash) VALUES (?, ?)", (url, digest))
+            self._db.commit()
+        return path, is_new
+
+    def link(self, blob_path, dest):
+        """在商品文件夹中创建指向 blob 的链接"""
+        link_file(blob_path, dest)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,140 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# 商品状态
+LOT_PENDING = 'pending'        # 尚未扫描
+LOT_SCANNED = 'scanned'        # 已扫描，候选图片已记录，仍有图片未完成
+LOT_DOWNLOADED = 'downloaded'  # 所有候选图片均已下载或被尺寸过滤
+LOT_FAILED = 'failed'          # 扫描失败，下次重新扫描
+LOT_FALLBACK = 'fallback'      # HTTP 扫描的图片均未通过过滤，下次直接用浏览器重新扫描
+
+# 图片状态
+IMAGE_PENDING = 'pending'
+IMAGE_DOWNLOADED = 'downloaded'
+IMAGE_REJECTED = 'rejected'    # 所有变体都不满足尺寸要求
+IMAGE_FAILED = 'failed'        # 请求失败，下次重试
+
+
+class JobManifest:
+    """SQLite 任务清单，记录每个商品及其候选图片的处理状态
+
+    批量任务中断 (停止、崩溃、重启) 后再次运行时：
+    - 已完成的商品直接跳过
+    - 已扫描的商品不再打开浏览器，只下载未完成或失败的图片
+    - 扫描失败的商品重新扫描
+    """
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS lots ("
+                " url TEXT PRIMARY KEY, title TEXT, save_dir TEXT, state TEXT,"
+                " error TEXT, updated REAL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS images ("
+                " lot_url TEXT, key TEXT, variants TEXT, state TEXT, path TEXT,"
+                " updated REAL, PRIMARY KEY (lot_url, key))"
+            )
+            self._db.commit()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            cur = self._db.execute(sql, params)
+            self._db.commit()
+            return cur
+
+    def add_lots(self, tasks):
+        """登记任务列表中的商品 (已登记的保持原状态)"""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR IGNORE INTO lots (url, title, state, updated) VALUES (?, ?, ?, ?)",
+                [(url, title, LOT_PENDING, now) for url, title in tasks],
+            )
+            self._db.commit()
+
+    def lot(self, url):
+        """返回 (状态, 保存目录)，未登记时返回 (None, None)"""
+        with self._lock:
+            row = self._db.execute("SELECT state, save_dir FROM lots WHERE url = ?", (url,)).fetchone()
+        return row if row else (None, None)
+
+    def mark_scanned(self, url, save_dir, candidates):
+        """记录扫描结果：每个候选图片及其 URL 变体 (含声明尺寸)，状态为 pending"""
+        now = time.time()
+        rows = []
+        for cand in candidates:
+            variants = [[u, rank[0]] + list(cand.declared.get(u, ())) for u, rank in cand.variants.items()]
+            rows.append((url, cand.key, json.dumps(variants), IMAGE_PENDING, now))
+        with self._lock:
+            self._db.execute("DELETE FROM images WHERE lot_url = ?", (url,))
+            self._db.executemany(
+                "INSERT INTO images (lot_url, key, variants, state, updated) VALUES (?, ?, ?, ?, ?)", rows
+            )
+            self._db.execute(
+                "UPDATE lots SET state = ?, save_dir = ?, error = NULL, updated = ? WHERE url = ?",
+                (LOT_SCANNED, save_dir, now, url),
+            )
+            self._db.commit()
+
+    def mark_lot_failed(self, url, error):
+        self._execute(
+            "UPDATE lots SET state = ?, error = ?, updated = ? WHERE url = ?",
+            (LOT_FAILED, str(error)[:500], time.time(), url),
+        )
+
+    def mark_lot_fallback(self, url):
+        """HTTP 扫描的结果没有可用图片，记录为等待浏览器重新扫描"""
+        self._execute(
+            "UPDATE lots SET state = ?, updated = ? WHERE url = ?", (LOT_FALLBACK, time.time(), url)
+        )
+
+    def mark_image(self, lot_url, key, state, path=None):
+        self._execute(
+            "UPDATE images SET state = ?, path = ?, updated = ? WHERE lot_url = ? AND key = ?",
+            (state, path, time.time(), lot_url, key),
+        )
+
+    def unfinished_images(self, lot_url):
+        """返回 [(key, [[url, 优先级 (, 宽, 高)], ...]), ...]：尚未完成或失败的候选图片"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT key, variants FROM images WHERE lot_url = ? AND state IN (?, ?)",
+                (lot_url, IMAGE_PENDING, IMAGE_FAILED),
+            ).fetchall()
+        return [(key, json.loads(variants)) for key, variants in rows]
+
+    def finish_lot(self, url):
+        """下载结束后更新商品状态：没有未完成图片时标记为已完成"""
+        with self._lock:
+            remaining = self._db.execute(
+                "SELECT COUNT(*) FROM images WHERE lot_url = ? AND state IN (?, ?)",
+                (url, IMAGE_PENDING, IMAGE_FAILED),
+            ).fetchone()[0]
+            if remaining == 0:
+                self._db.execute(
+                    "UPDATE lots SET state = ?, updated = ? WHERE url = ?", (LOT_DOWNLOADED, time.time(), url)
+                )
+                self._db.commit()
+        return remaining == 0
+
+    def summary(self):
+        """按状态统计商品数"""
+        with self._lock:
+            rows = self._db.execute("SELECT state, COUNT(*) FROM lots GROUP BY state").fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -1,10 +1,255 @@
 import time
 import argparse
+from urllib.parse import urljoin, urlparse, parse_qs, urlencode
 from playwright.sync_api import sync_playwright
+from metrics import REGISTRY, dump_summary
+from tracing import Tracer, NULL_TRACER
+from page_utils import (SETTLE_TIMEOUT_MS, wait_for_settle, scroll_until_stable, first_attribute, wait_for_change,
+                        block_resources)
 
-def scrape_sothebys_list(url, output_file="urls.txt"):
+LOT_LINK_SELECTOR = "a[href*='/buy/auction/']"
+NEXT_BUTTON_SELECTOR = "button[aria-label='Go to next page.']"
+
+# 在页面内一次性提取所有商品链接，避免每个链接多次 IPC 往返
+# 同一 URL 出现多次时 (图片链接 + 标题链接) 合并为一条记录，取第一个非空的标题
+EXTRACT_LOTS_JS = r"""
+() => {
+    const records = new Map();
+    const pick = (text, re) => {
+        const m = text.match(re);
+        return m ? m[1].trim() : '';
+    };
+    for (const a of document.querySelectorAll("a[href*='/buy/auction/']")) {
+        const href = a.getAttribute('href');
+        if (!href) continue;
+        const url = a.href;
+        let title = (a.innerText || '').trim();
+        if (!title) {
+            const h = a.querySelector("h3, h4, p, div[class*='title']");
+            if (h) title = (h.innerText || '').trim();
+        }
+        const card = a.closest("li, article, [class*='card'], [class*='Card']") || a.parentElement;
+        const text = card ? (card.innerText || '') : '';
+        let rec = records.get(url);
+        if (!rec) {
+            rec = {url: url, title: '', lot: '', estimate: ''};
+            records.set(url, rec);
+        }
+        if (!rec.title) rec.title = title;
+        if (!rec.lot) rec.lot = pick(text, /\bLot\s+(\d+[A-Za-z]?)\b/i);
+        if (!rec.estimate) rec.estimate = pick(text, /Estimate[:\s]*([^\n]+)/i);
+    }
+    return Array.from(records.values());
+}
+"""
+
+
+def extract_lot_links(page, list_url, seen_urls, tracer=None):
+    """单次 evaluate 提取本页商品，返回新发现的商品记录
+
+    每条记录为 {'title', 'url', 'lot', 'estimate'}，已出现在 seen_urls 中的
+    URL 以及列表页自身会被过滤，新 URL 会加入 seen_urls。
+    """
+    tracer = tracer or NULL_TRACER
+    base = list_url.split("?")[0]
+    items = []
+    with tracer.stage('list_extract'):
+        records = page.evaluate(EXTRACT_LOTS_JS)
+    for rec in records:
+        full_url = urljoin(page.url, rec['url'])
+        if full_url in seen_urls or full_url == list_url:
+            continue
+        # 排除列表页自身 (如 /buy/auction/2024/china-5000-years)
+        if "/buy/auction/" not in full_url or full_url.split("?")[0] == base:
+            continue
+        seen_urls.add(full_url)
+        title = rec['title'].replace("\n", " ").replace("\r", "")
+        items.append({"title": title, "url": full_url, "lot": rec['lot'], "estimate": rec['estimate']})
+    REGISTRY.inc('list_pages_total')
+    REGISTRY.inc('list_lots_total', len(items))
+    return items
+
+
+# 从分页控件读取总页数：aria-label 形如 "Go to page 12." 的按钮/链接，或分页导航中的纯数字按钮
+PAGE_COUNT_JS = r"""
+() => {
+    let max = 0;
+    for (const el of document.querySelectorAll("[aria-label*='page' i]")) {
+        const m = (el.getAttribute('aria-label') || '').match(/page\s+(\d+)/i);
+        if (m) max = Math.max(max, parseInt(m[1], 10));
+    }
+    for (const el of document.querySelectorAll("nav[aria-label*='pagination' i] button, nav[aria-label*='pagination' i] a")) {
+        const t = (el.innerText || '').trim();
+        if (/^\d+$/.test(t)) max = Math.max(max, parseInt(t, 10));
+    }
+    return max || null;
+}
+"""
+
+
+def detect_page_count(page):
+    """读取列表页的总页数，找不到分页控件时返回 None"""
+    try:
+        return page.evaluate(PAGE_COUNT_JS)
+    except Exception:
+        return None
+
+
+def has_next_page(page):
+    """页面上是否有可见且可用的 Next 按钮"""
+    try:
+        button = page.locator(NEXT_BUTTON_SELECTOR).first
+        return button.is_visible() and button.is_enabled()
+    except Exception:
+        return False
+
+
+def page_url(list_url, page_num):
+    """生成第 page_num 页的 URL (Sotheby's 分页使用 ?page=N 参数)"""
+    parsed = urlparse(list_url)
+    query = parse_qs(parsed.query)
+    query['page'] = [str(page_num)]
+    return parsed._replace(query=urlencode(query, doseq=True)).geturl()
+
+
+def _settle_list_page(tab, n, settle_ms, tracer):
+    """等待分页加载完成并滚动到底，两者超时都不影响提取"""
+    try:
+        tab.wait_for_load_state("networkidle", timeout=30000)
+    except Exception:
+        pass
+    try:
+        with tracer.stage('list_scroll', page=n):
+            scroll_until_stable(tab, timeout_ms=settle_ms)
+    except Exception:
+        pass
+
+
+def iter_pages_parallel(context, list_url, page_numbers, seen_urls, workers=4, stop_flag=None,
+                        settle_ms=SETTLE_TIMEOUT_MS, tracer=None, log=print):
+    """并行加载多个分页，按页码顺序产出 (页码, 新商品列表, 标签页)
+
+    每批最多 workers 个标签页同时导航，浏览器内并行加载与等待；
+    提取仍按页码顺序进行，去重结果与逐页点击一致。
+    导航或提取出错的分页单独重试一次，仍然失败时产出 (页码, None, 标签页)，其余分页照常继续。
+    标签页在下一次迭代前停留在该分页上，可以继续检查页面 (如 Next 按钮)。
+    """
+    tracer = tracer or NULL_TRACER
+    tabs = [context.new_page() for _ in range(max(1, min(workers, len(page_numbers))))]
+    try:
+        for start in range(0, len(page_numbers), len(tabs)):
+            if stop_flag is not None and stop_flag.is_set():
+                return
+            batch = list(zip(tabs, page_numbers[start:start + len(tabs)]))
+            errors = {}
+            # 先让所有标签页开始导航，再逐个等待，加载过程相互重叠
+            with tracer.stage('list_batch_load', pages=[n for _, n in batch]):
+                for tab, n in batch:
+                    try:
+                        tab.goto(page_url(list_url, n), wait_until="commit", timeout=60000)
+                    except Exception as e:
+                        errors[n] = e
+                for tab, n in batch:
+                    if n not in errors:
+                        _settle_list_page(tab, n, settle_ms, tracer)
+            for tab, n in batch:
+                page_items = None
+                if n not in errors:
+                    try:
+                        page_items = extract_lot_links(tab, list_url, seen_urls, tracer)
+                    except Exception as e:
+                        errors[n] = e
+                if page_items is None:
+                    page_items = _retry_page(tab, list_url, n, seen_urls, settle_ms, tracer, log, errors[n])
+                yield n, page_items, tab
+    finally:
+        for tab in tabs:
+            tab.close()
+
+
+def _retry_page(tab, list_url, n, seen_urls, settle_ms, tracer, log, error):
+    """单独重新加载一个出错的分页，仍然失败时返回 None"""
+    log(f"第 {n} 页加载失败 ({error})，重试一次...")
+    try:
+        tab.goto(page_url(list_url, n), wait_until="commit", timeout=60000)
+        _settle_list_page(tab, n, settle_ms, tracer)
+        return extract_lot_links(tab, list_url, seen_urls, tracer)
+    except Exception as e:
+        log(f"第 {n} 页重试仍然失败，跳过: {e}")
+        return None
+
+
+def scrape_pages_parallel(page, list_url, seen_urls, workers, on_page, stop_flag=None, log=print,
+                          settle_ms=SETTLE_TIMEOUT_MS, tracer=None):
+    """识别总页数后并行抓取第 2 页及之后的分页，每页结果按页码顺序交给 on_page(页码, 商品列表)
+
+    返回 (是否已处理完, 主标签页所在的页码)：
+    - (True, 页码)：剩余分页已处理完 (加载失败的分页记录日志后跳过)
+    - (False, 1)：未识别到分页或分页 URL 无效 (第一个成功加载的分页没有新商品)，调用方从第 1 页逐页点击
+    - (False, N)：分页控件没有显示全部页码 (如 "1 2 3 4 5 …")，第 N 页仍有可用的 Next 按钮；
+      主标签页已打开第 N 页，调用方从这里继续逐页点击
+    """
+    total = detect_page_count(page)
+    if not total or total < 2:
+        return False, 1
+
+    log(f"识别到共 {total} 页，使用 {workers} 个标签页并行抓取...")
+    pages = iter_pages_parallel(page.context, list_url, list(range(2, total + 1)), seen_urls, workers, stop_flag,
+                                settle_ms, tracer, log)
+    checked = False
+    skipped = []
+    more = False
+    try:
+        for n, page_items, tab in pages:
+            if page_items is None:
+                skipped.append(n)
+                continue
+            if not checked:
+                checked = True
+                if not page_items:
+                    log(f"第 {n} 页未提取到新商品，分页 URL 无效，回退到逐页点击。")
+                    return False, 1
+            on_page(n, page_items)
+            if n == total:
+                # 分页控件可能只显示前几页：最后一页仍能点 Next 时，后面还有分页
+                more = has_next_page(tab)
+    finally:
+        pages.close()
+    if skipped:
+        log(f"以下分页加载失败已跳过: {', '.join(map(str, skipped))}")
+    if not more or (stop_flag is not None and stop_flag.is_set()):
+        return True, total
+    log(f"第 {total} 页之后还有分页 (分页控件未显示全部页码)，从第 {total} 页继续逐页点击...")
+    try:
+        page.goto(page_url(list_url, total), wait_until="commit", timeout=60000)
+    except Exception as e:
+        log(f"打开第 {total} 页失败，无法继续翻页: {e}")
+        return True, total
+    _settle_list_page(page, total, settle_ms, tracer)
+    return False, total
+
+
+def wait_for_next_page(page, previous, settle_ms=SETTLE_TIMEOUT_MS, tracer=None):
+    """点击 Next 后等待列表被替换 (第一个商品链接变化)，再等待页面稳定"""
+    with (tracer or NULL_TRACER).stage('list_next_page'):
+        changed = wait_for_change(page, LOT_LINK_SELECTOR, previous, timeout_ms=settle_ms * 2)
+        wait_for_settle(page, timeout_ms=settle_ms)
+    return changed
+
+
+def scrape_sothebys_list(url, output_file="urls.txt", page_workers=4, settle_timeout=5.0, block=True, tracer=None):
+    """抓取拍卖列表页的所有商品，写入 output_file 并返回商品记录列表
+
+    page_workers > 1 时从第一页识别总页数，其余分页用多个标签页并行加载；
+    识别失败时回退到逐页点击 Next 按钮。每次滚动/翻页后页面一稳定就继续，
+    最长等待 settle_timeout 秒。block 为 True 时拦截图片、视频、字体和统计请求。
+    tracer 为 tracing.Tracer 时记录各阶段的时间线。
+    """
+    tracer = tracer or NULL_TRACER
+    settle_ms = int(settle_timeout * 1000)
     print(f"启动列表抓取器...")
     print(f"目标 URL: {url}")
+    items = []
     
     with sync_playwright() as p:
         # 启动浏览器 (无头模式)
@@ -12,14 +257,17 @@ def scrape_sothebys_list(url, output_file="urls.txt"):
         context = browser.new_context(
             user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
         )
+        if block:
+            # 列表页只需要商品链接，缩略图、视频、字体和统计脚本全部拦截 (并行分页的标签页同样生效)
+            block_resources(context, 'list')
         page = context.new_page()
 
         try:
             print("正在加载页面...")
-            page.goto(url, timeout=60000)
-            
-            # 等待页面初步加载
-            page.wait_for_load_state("networkidle")
+            with tracer.stage('list_navigate', url=url):
+                page.goto(url, timeout=60000)
+                # 等待页面初步加载
+                page.wait_for_load_state("networkidle")
             
             # --- 处理 Cookie Banner ---
             print("检查 Cookie Banner...")
@@ -29,14 +277,13 @@ def scrape_sothebys_list(url, output_file="urls.txt"):
                 if cookie_btn.is_visible():
                     print("发现 Cookie Banner，尝试关闭/接受...")
                     cookie_btn.click()
-                    time.sleep(2)
+                    wait_for_settle(page, timeout_ms=settle_ms)
                     page.wait_for_load_state("networkidle") # 等待可能发生的刷新
                 else:
                     print("未发现明显的 Cookie Banner。")
             except Exception as e:
                 print(f"处理 Cookie Banner 时出错 (非致命): {e}")
             
-            items = []
             seen_urls = set()
             page_num = 1
             
@@ -46,78 +293,37 @@ def scrape_sothebys_list(url, output_file="urls.txt"):
                 # 1. 滚动到底部确保所有元素加载 (Sotheby's 页面较长)
                 print("滚动到底部...")
                 try:
-                    page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-                    time.sleep(3) # 等待滚动后的懒加载
-                    
-                    # 再次滚动以防万一 (有些页面需要多次滚动)
-                    page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
-                    time.sleep(2)
+                    # 反复滚动直到页面高度不再变化，每次滚动后等待懒加载稳定
+                    with tracer.stage('list_scroll', page=page_num):
+                        scroll_until_stable(page, timeout_ms=settle_ms)
                 except Exception as e:
                     print(f"滚动时发生错误 (可能是页面刷新): {e}")
-                    time.sleep(2)
+                    wait_for_settle(page, timeout_ms=settle_ms)
                     # 尝试重新获取上下文或忽略，继续尝试提取
 
                 # --- 数据提取逻辑 ---
                 print("正在提取本页商品信息...")
                 
-                # 获取页面上所有链接元素
-                # 查找所有包含 /buy/auction/ 的链接
-                links = page.locator("a[href*='/buy/auction/']").all()
-                
-                current_page_items = 0
-                for link in links:
-                    try:
-                        href = link.get_attribute("href")
-                        if not href: continue
-                        
-                        # 补全相对路径
-                        if href.startswith("/"):
-                            full_url = "https://www.sothebys.com" + href
-                        else:
-                            full_url = href
-                            
-                        # 去重
-                        if full_url in seen_urls: continue
-                        
-                        # 简单的 URL 过滤
-                        if full_url == url: continue
-                        
-                        # 移除错误的 locale 过滤，因为商品链接也可能包含 locale
-                        # if "locale=" in full_url and "lot" not in full_url: continue 
-
-                        # 提取标题
-                        title = link.inner_text().strip()
-                        if not title:
-                            # 尝试找内部的 h3, h4, p
-                            h_tag = link.locator("h3, h4, p, div[class*='title']").first
-                            if h_tag.count() > 0:
-                                title = h_tag.inner_text().strip()
-                        
-                        # 清理标题换行
-                        title = title.replace("\n", " ").replace("\r", "")
-                        
-                        if full_url not in seen_urls:
-                            # 只有当 URL 看起来像商品时才添加
-                            # 只要包含 auction 且不是当前列表页即可，或者包含 china-5000-years
-                            # 排除一些显然不是商品的链接 (如 /buy/auction/2024/china-5000-years 自身)
-                            
-                            is_product = False
-                            if "/buy/auction/" in full_url:
-                                # 排除列表页自身 (简单判断长度或特定后缀)
-                                if full_url.split("?")[0] != url.split("?")[0]:
-                                    is_product = True
-                            
-                            if is_product:
-                                seen_urls.add(full_url)
-                                items.append({"title": title, "url": full_url})
-                                current_page_items += 1
-                                # print(f"发现: {title[:30]}... -> {full_url[-30:]}")
-
-                    except Exception as e:
-                        pass
+                try:
+                    page_items = extract_lot_links(page, url, seen_urls, tracer)
+                except Exception as e:
+                    print(f"提取商品信息时出错 (可能是页面刷新): {e}")
+                    page_items = []
+                items.extend(page_items)
+                current_page_items = len(page_items)
                 
                 print(f"第 {page_num} 页提取到 {current_page_items} 个新商品。")
 
+                # --- 并行分页 ---
+                if page_num == 1 and page_workers > 1:
+                    def on_page(n, page_items):
+                        items.extend(page_items)
+                        print(f"第 {n} 页提取到 {len(page_items)} 个新商品。")
+                    done, page_num = scrape_pages_parallel(page, url, seen_urls, page_workers, on_page,
+                                                           settle_ms=settle_ms, tracer=tracer)
+                    if done:
+                        break
+
                 # --- 翻页逻辑 ---
                 print(f"[{time.strftime('%H:%M:%S')}] 正在检查分页...")
                 
@@ -134,10 +340,11 @@ def scrape_sothebys_list(url, output_file="urls.txt"):
                     print(f"[{time.strftime('%H:%M:%S')}] 发现 'Next' 按钮，准备点击下一页...")
                     
                     # 尝试点击并等待导航
+                    # 记录当前第一个商品链接，用于判断列表是否已替换
+                    previous = first_attribute(page, LOT_LINK_SELECTOR)
                     try:
                         # 确保按钮在视图中
                         next_button.scroll_into_view_if_needed()
-                        time.sleep(1)
                         
                         # 记录当前 URL
                         current_url = page.url
@@ -146,13 +353,11 @@ def scrape_sothebys_list(url, output_file="urls.txt"):
                         print(f"[{time.strftime('%H:%M:%S')}] 点击 Next 按钮...")
                         next_button.click()
                         
-                        # 等待 URL 变化或网络空闲
+                        # 等待列表内容被替换
                         # 有时候点击不会立即触发 URL 变化，而是 AJAX 加载
                         # 但 Sotheby's 分页通常是 URL 变化 (page=2) 或 pushState
-                        try:
-                            page.wait_for_load_state("networkidle", timeout=10000)
-                        except:
-                            print(f"[{time.strftime('%H:%M:%S')}] 等待 networkidle 超时，继续...")
+                        if not wait_for_next_page(page, previous, settle_ms, tracer):
+                            print(f"[{time.strftime('%H:%M:%S')}] 等待列表更新超时，继续...")
                         
                         # 检查 URL 是否变化
                         new_url = page.url
@@ -162,7 +367,6 @@ def scrape_sothebys_list(url, output_file="urls.txt"):
                              print(f"[{time.strftime('%H:%M:%S')}] 页面 URL 未变化，可能是 AJAX 加载或翻页失败。")
                         
                         page_num += 1
-                        time.sleep(5) # 额外等待渲染
                         
                     except Exception as e:
                         print(f"[{time.strftime('%H:%M:%S')}] 点击下一页时出错: {e}")
@@ -170,7 +374,7 @@ def scrape_sothebys_list(url, output_file="urls.txt"):
                         try:
                             print(f"[{time.strftime('%H:%M:%S')}] 尝试强制点击...")
                             next_button.click(force=True)
-                            time.sleep(5)
+                            wait_for_next_page(page, previous, settle_ms, tracer)
                             page_num += 1
                         except Exception as e2:
                             print(f"[{time.strftime('%H:%M:%S')}] 强制点击也失败: {e2}")
@@ -181,33 +385,48 @@ def scrape_sothebys_list(url, output_file="urls.txt"):
                     break
             
             print(f"抓取结束，共提取到 {len(items)} 个商品。")
-            
-            # --- 写入文件 ---
-            if items:
-                print(f"正在写入 {output_file} ...")
-                # 读取现有内容以避免重复 (可选，但这里我们覆盖或追加)
-                # 用户希望有条理地写入
-                with open(output_file, "w", encoding="utf-8") as f: # 使用 'w' 覆盖，保证是最新的完整列表
-                    f.write(f"# Source: {url}\n")
-                    f.write(f"# Total Items: {len(items)}\n")
-                    f.write(f"# Date: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
-                    for item in items:
-                        line = f"{item['url']} # {item['title']}\n"
-                        f.write(line)
-                print("写入完成！")
-            else:
-                print("警告：未提取到任何商品。")
 
         except Exception as e:
             print(f"发生严重错误: {e}")
+            if items:
+                print(f"已提取的 {len(items)} 个商品仍会写入文件。")
         finally:
             browser.close()
 
+    # --- 写入文件 (中途出错时同样保存已提取的商品) ---
+    if items:
+        print(f"正在写入 {output_file} ...")
+        # 读取现有内容以避免重复 (可选，但这里我们覆盖或追加)
+        # 用户希望有条理地写入
+        with open(output_file, "w", encoding="utf-8") as f: # 使用 'w' 覆盖，保证是最新的完整列表
+            f.write(f"# Source: {url}\n")
+            f.write(f"# Total Items: {len(items)}\n")
+            f.write(f"# Date: {time.strftime('%Y-%m-%d %H:%M:%S')}\n\n")
+            for item in items:
+                line = f"{item['url']} # {item['title']}\n"
+                f.write(line)
+        print("写入完成！")
+    else:
+        print("警告：未提取到任何商品。")
+
+    return items
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Sotheby's 列表页抓取器")
     parser.add_argument("url", help="列表页 URL")
     parser.add_argument("--output", default="urls.txt", help="输出文件路径 (默认: urls.txt)")
+    parser.add_argument("--page-workers", type=int, default=4, help="并行加载分页的标签页数，1 表示逐页点击 (默认: 4)")
+    parser.add_argument("--settle-timeout", type=float, default=5.0, help="每次滚动/翻页后等待页面稳定的上限秒数 (默认: 5)")
+    parser.add_argument("--no-block", action="store_false", dest="block", help="不拦截图片、视频、字体和统计请求")
+    parser.add_argument("--metrics", default=None, help="运行结束时把各阶段耗时等指标的 JSON 摘要写入该文件 (默认只打印)")
+    parser.add_argument("--trace", default=None, help="记录各阶段的时间线，以 Chrome trace 格式写入该文件 (默认: 不启用)")
+    parser.add_argument("--trace-sample-ms", type=int, default=0, help="追踪时每隔多少毫秒采样一次各线程正在执行的函数，0 表示不采样 (默认: 0)")
     
     args = parser.parse_args()
     
-    scrape_sothebys_list(args.url, args.output)
+    tracer = Tracer(args.trace, sample_ms=args.trace_sample_ms) if args.trace else None
+    scrape_sothebys_list(args.url, args.output, page_workers=args.page_workers, settle_timeout=args.settle_timeout,
+                         block=args.block, tracer=tracer)
+    dump_summary(args.metrics)
+    if tracer:
+        print(f"时间线已写入: {tracer.save()}")
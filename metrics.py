@@ -0,0 +1,224 @@
+"""运行指标：计数器、瞬时值与分阶段耗时直方图
+
+进程内全局一个 REGISTRY，下载器、列表抓取器和 Web 服务都往里记录：
+- 计数器 inc(name, **labels)：图片结果、HTTP 状态码分布、日志行数等
+- 瞬时值 set(name, value, **labels)：SSE 连接数等
+- 直方图 observe(name, seconds, **labels) / stage(name)：各阶段耗时
+  (页面导航、滚动、DOM 扫描、__NEXT_DATA__ 遍历、图片请求、解码、写盘)
+
+Web 服务在 /api/metrics 以 Prometheus 文本格式输出，命令行运行结束时输出 JSON 摘要。
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# 直方图桶上限 (秒)，覆盖单张图片的毫秒级请求到整页扫描的分钟级耗时
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+STAGE_METRIC = 'stage_seconds'
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    inner = ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs)
+    return '{' + inner + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """累计分桶直方图，另外记录总和、次数和最大值"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一个桶为 +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for i, n in enumerate(other['counts']):
+            self.counts[i] += n
+        self.sum += other['sum']
+        self.count += other['count']
+        self.max = max(self.max, other['max'])
+
+    def quantile(self, q):
+        """按分桶估算分位数 (返回所在桶的上限，不超过实测最大值)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def state(self):
+        return {'counts': list(self.counts), 'sum': self.sum, 'count': self.count, 'max': self.max}
+
+
+class Metrics:
+    """线程安全的指标注册表"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}    # (名称, 标签) -> 数值
+        self.gauges = {}
+        self.histograms = {}  # (名称, 标签) -> Histogram
+
+    def inc(self, name, n=1, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, _label_key(labels))] = value
+
+    def add(self, name, n, **labels):
+        """调整瞬时值 (如连接数加一、减一)"""
+        key = (name, _label_key(labels))
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + n
+
+    def observe(self, name, seconds, **labels):
+        key = (name, _label_key(labels))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(self.buckets)
+            hist.observe(seconds)
+
+    @contextmanager
+    def time(self, name, **labels):
+        """记录 with 块的耗时 (块内抛出异常时同样记录)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def stage(self, stage):
+        """记录一个处理阶段的耗时：stage_seconds{stage="..."}"""
+        return self.time(STAGE_METRIC, stage=stage)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def drain(self):
+        """取出并清空计数器与直方图 (扫描进程把增量交给主进程合并)"""
+        with self.lock:
+            state = {
+                'counters': list(self.counters.items()),
+                'histograms': [(key, hist.state()) for key, hist in self.histograms.items()],
+            }
+            self.counters.clear()
+            self.histograms.clear()
+        return state
+
+    def merge(self, state):
+        """合并 drain() 的结果"""
+        with self.lock:
+            for key, n in state['counters']:
+                self.counters[key] = self.counters.get(key, 0) + n
+            for key, hist_state in state['histograms']:
+                hist = self.histograms.get(key)
+                if hist is None:
+                    hist = self.histograms[key] = Histogram(self.buckets)
+                hist.merge(hist_state)
+
+    def render_prometheus(self, prefix='sothebys_'):
+        """Prometheus 文本格式 (0.0.4)"""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted((key, hist.state()) for key, hist in self.histograms.items())
+
+        lines = []
+        declared = set()
+
+        def declare(name, kind):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in counters:
+            full = prefix + name
+            declare(full, 'counter')
+            lines.append(f"{full}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), value in gauges:
+            full = prefix + name
+            declare(full, 'gauge')
+            lines.append(f"{full}{_format_labels(labels)} {_format_value(value)}")
+        for (name, labels), state in histograms:
+            full = prefix + name
+            declare(full, 'histogram')
+            cumulative = 0
+            for bound, n in zip(list(self.buckets) + [float('inf')], state['counts']):
+                cumulative += n
+                lines.append(f"{full}_bucket{_format_labels(labels, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{full}_sum{_format_labels(labels)} {_format_value(state['sum'])}")
+            lines.append(f"{full}_count{_format_labels(labels)} {state['count']}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """JSON 摘要：计数器、瞬时值和各直方图的次数、总耗时、均值、p50/p95 与最大值"""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+            histograms = sorted(self.histograms.items())
+            result = {'counters': {}, 'gauges': {}, 'histograms': {}}
+            for (name, labels), value in counters:
+                result['counters'][name + _format_labels(labels)] = value
+            for (name, labels), value in gauges:
+                result['gauges'][name + _format_labels(labels)] = value
+            for (name, labels), hist in histograms:
+                result['histograms'][name + _format_labels(labels)] = {
+                    'count': hist.count,
+                    'total': round(hist.sum, 4),
+                    'mean': round(hist.sum / hist.count, 4) if hist.count else 0.0,
+                    'p50': round(hist.quantile(0.5), 4),
+                    'p95': round(hist.quantile(0.95), 4),
+                    'max': round(hist.max, 4),
+                }
+        return result
+
+
+REGISTRY = Metrics()
+
+
+def dump_summary(path=None, registry=REGISTRY):
+    """命令行运行结束时输出 JSON 摘要，指定 path 时同时写入文件"""
+    text = json.dumps(registry.summary(), ensure_ascii=False, indent=2)
+    print("运行指标:")
+    print(text)
+    if path:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text + "\n")
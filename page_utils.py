@@ -0,0 +1,144 @@
+"""Playwright 页面工具
+
+- 等待：用页面内的 MutationObserver 和资源加载事件判断页面是否已经稳定，
+  页面一安静下来就继续，代替固定时长的 sleep；每次等待都有上限。
+- 拦截：按模式中止不需要的资源请求 (图片、视频、字体、统计脚本)。
+"""
+from urllib.parse import urlparse
+
+SETTLE_QUIET_MS = 500     # 连续多久没有 DOM 变化/资源完成视为稳定
+SETTLE_TIMEOUT_MS = 5000  # 单次等待上限
+
+# 在页面内等待：记录最后一次 DOM 变化 (节点增删、图片地址变化) 和最后一个资源加载完成的时间，
+# 距今超过 quietMs 或总时长超过 timeoutMs 时返回实际等待的毫秒数
+_SETTLE_JS = r"""
+([quietMs, timeoutMs]) => new Promise(resolve => {
+    const start = performance.now();
+    let last = start;
+    const touch = () => { last = performance.now(); };
+    const observer = new MutationObserver(touch);
+    observer.observe(document.documentElement || document, {
+        childList: true, subtree: true, attributes: true,
+        attributeFilter: ['src', 'srcset', 'data-src', 'href'],
+    });
+    let perf = null;
+    try {
+        perf = new PerformanceObserver(touch);
+        perf.observe({type: 'resource'});
+    } catch (e) {}
+    const tick = () => {
+        const now = performance.now();
+        if (now - last >= quietMs || now - start >= timeoutMs) {
+            observer.disconnect();
+            if (perf) perf.disconnect();
+            resolve(now - start);
+        } else {
+            setTimeout(tick, 50);
+        }
+    };
+    setTimeout(tick, 50);
+})
+"""
+
+_FIRST_ATTR_JS = r"""
+([selector, attr]) => {
+    const el = document.querySelector(selector);
+    return el ? el.getAttribute(attr) : null;
+}
+"""
+
+_CHANGED_JS = r"""
+([selector, attr, previous]) => {
+    const el = document.querySelector(selector);
+    return !!el && el.getAttribute(attr) !== previous;
+}
+"""
+
+
+def wait_for_settle(page, quiet_ms=SETTLE_QUIET_MS, timeout_ms=SETTLE_TIMEOUT_MS):
+    """等待页面稳定，返回实际等待的秒数"""
+    try:
+        return page.evaluate(_SETTLE_JS, [quiet_ms, timeout_ms]) / 1000
+    except Exception:
+        # 等待期间页面发生导航时 evaluate 会失败，此时交给调用方的后续等待处理
+        return 0.0
+
+
+def scroll_to_bottom(page, quiet_ms=SETTLE_QUIET_MS, timeout_ms=SETTLE_TIMEOUT_MS):
+    """滚动到底部并等待懒加载稳定，返回滚动后的页面高度"""
+    page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+    wait_for_settle(page, quiet_ms, timeout_ms)
+    return page.evaluate("document.body.scrollHeight")
+
+
+def scroll_until_stable(page, quiet_ms=SETTLE_QUIET_MS, timeout_ms=SETTLE_TIMEOUT_MS, max_rounds=50):
+    """反复滚动到底部，直到页面高度不再增加 (无限滚动页面最多 max_rounds 轮)"""
+    last_height = page.evaluate("document.body.scrollHeight")
+    for _ in range(max_rounds):
+        new_height = scroll_to_bottom(page, quiet_ms, timeout_ms)
+        if new_height == last_height:
+            break
+        last_height = new_height
+    return last_height
+
+
+def first_attribute(page, selector, attr="href"):
+    """返回第一个匹配元素的属性值，用于判断翻页后内容是否已替换"""
+    try:
+        return page.evaluate(_FIRST_ATTR_JS, [selector, attr])
+    except Exception:
+        return None
+
+
+def wait_for_change(page, selector, previous, attr="href", timeout_ms=SETTLE_TIMEOUT_MS):
+    """等待第一个匹配元素的属性与 previous 不同 (AJAX 翻页后列表被替换)，超时返回 False"""
+    try:
+        page.wait_for_function(_CHANGED_JS, arg=[selector, attr, previous], timeout=timeout_ms)
+        return True
+    except Exception:
+        return False
+
+
+# 请求拦截：各模式下直接中止的资源类型 (Playwright resource_type)
+BLOCK_PROFILES = {
+    'list': ('image', 'media', 'font'),  # 列表页只需要商品链接
+    'lot': ('media', 'font'),            # 商品页的图片另行记录后中止，见 block_resources 的 on_image
+}
+
+# 统计、广告与第三方标签，任何模式下都不需要
+TRACKER_HOSTS = (
+    'google-analytics.com', 'googletagmanager.com', 'doubleclick.net', 'googlesyndication.com',
+    'facebook.net', 'connect.facebook.com', 'hotjar.com', 'segment.io', 'segment.com',
+    'optimizely.com', 'nr-data.net', 'newrelic.com', 'criteo.com', 'quantserve.com',
+    'bat.bing.com', 'analytics.tiktok.com', 'ads-twitter.com', 'pinimg.com', 'clarity.ms',
+)
+
+
+def _host_blocked(url, hosts):
+    host = (urlparse(url).hostname or '').lower()
+    return any(host == h or host.endswith('.' + h) for h in hosts)
+
+
+def block_resources(target, mode, on_image=None, hosts=TRACKER_HOSTS):
+    """在 page 或 context 上安装请求拦截，按 BLOCK_PROFILES[mode] 中止不需要的资源
+
+    on_image 不为空时，图片请求的 URL 交给 on_image 记录后中止，
+    浏览器不再下载图片内容 (下载阶段会自己请求)。
+    """
+    blocked_types = set(BLOCK_PROFILES.get(mode, ()))
+
+    def handle(route):
+        request = route.request
+        rtype = request.resource_type
+        try:
+            if rtype == 'image' and on_image is not None:
+                on_image(request.url)
+                route.abort()
+            elif rtype in blocked_types or _host_blocked(request.url, hosts):
+                route.abort()
+            else:
+                route.continue_()
+        except Exception:
+            pass  # 页面已关闭或请求已被处理
+
+    target.route("**/*", handle)
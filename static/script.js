@@ -7,6 +7,7 @@ const scrapeStopBtn = document.getElementById('scrape-stop-btn');
 const downloadBtn = document.getElementById('download-btn');
 const downloadStopBtn = document.getElementById('download-stop-btn');
 const urlInput = document.getElementById('url-input');
+const scanWorkersInput = document.getElementById('scan-workers-input');
 const scrapeStatus = document.getElementById('scrape-status');
 const downloadStatus = document.getElementById('download-status');
 const scrapeProgress = document.getElementById('scrape-progress');
@@ -16,21 +17,20 @@ const clearLogBtn = document.getElementById('clear-log-btn');
 
 // 状态管理
 let eventSource = null;
+let lastEventId = null;  // 最后收到的日志序号，重连时从这里继续
+const jobs = {};         // 任务 ID -> 最新的任务快照 (由日志流的 job 事件推送)
 
 // 初始化
 function init() {
     // 绑定事件
     scrapeBtn.addEventListener('click', startScrape);
-    scrapeStopBtn.addEventListener('click', stopTask);
+    scrapeStopBtn.addEventListener('click', event => stopTask(event, 'scrape'));
     downloadBtn.addEventListener('click', startDownload);
-    downloadStopBtn.addEventListener('click', stopTask);
+    downloadStopBtn.addEventListener('click', event => stopTask(event, 'download'));
     clearLogBtn.addEventListener('click', clearLog);
 
-    // 启动日志流
+    // 启动日志流 (任务状态和进度也由日志流推送，无需轮询)
     connectLogStream();
-
-    // 定期更新状态
-    setInterval(updateStatus, 1000);
 }
 
 // 连接日志流
@@ -39,16 +39,38 @@ function connectLogStream() {
         eventSource.close();
     }
 
-    eventSource = new EventSource('/api/logs');
+    const url = lastEventId ? `/api/logs?last_id=${encodeURIComponent(lastEventId)}` : '/api/logs';
+    eventSource = new EventSource(url);
+
+    // 每次连接建立后服务端都会先推送所有任务的快照：清空旧的任务表，
+    // 服务重启后上一个进程中的任务不会一直显示为运行中
+    eventSource.onopen = function () {
+        Object.keys(jobs).forEach(id => delete jobs[id]);
+        renderStatus();
+    };
 
+    // 一帧可能包含多行日志
     eventSource.onmessage = function (event) {
-        if (event.data.trim()) {
-            addLog(event.data);
+        if (event.lastEventId) {
+            lastEventId = event.lastEventId;
         }
+        event.data.split('\n').forEach(line => {
+            if (line.trim()) {
+                addLog(line);
+            }
+        });
     };
 
+    // 任务状态与结构化进度
+    eventSource.addEventListener('job', function (event) {
+        const job = JSON.parse(event.data);
+        jobs[job.id] = job;
+        renderStatus();
+    });
+
     eventSource.onerror = function () {
         console.error('日志流连接错误，5秒后重连...');
+        eventSource.close();
         setTimeout(connectLogStream, 5000);
     };
 }
@@ -81,42 +103,74 @@ function clearLog() {
     logContent.innerHTML = '<div class="log-placeholder">日志已清空</div>';
 }
 
-// 更新状态
-async function updateStatus() {
-    try {
-        const response = await fetch('/api/status');
-        const status = await response.json();
-
-        // 更新抓取状态
-        if (status.scraping) {
-            setStatus(scrapeStatus, 'active', '运行中');
-            scrapeBtn.disabled = true;
-            scrapeStopBtn.disabled = false;
-            scrapeProgress.textContent = status.scrape_progress || '处理中...';
-        } else {
-            setStatus(scrapeStatus, '', '就绪');
-            scrapeBtn.disabled = false;
-            scrapeStopBtn.disabled = true;
-            scrapeProgress.textContent = '';
-        }
+// 正在运行的某类任务中最早开始的一个
+function runningJob(kind) {
+    const running = Object.values(jobs).filter(job => job.kind === kind && job.state === 'running');
+    running.sort((a, b) => a.started - b.started);
+    return running[0] || null;
+}
 
-        // 更新下载状态
-        if (status.downloading) {
-            setStatus(downloadStatus, 'active', '运行中');
-            downloadBtn.disabled = true;
-            downloadStopBtn.disabled = false;
-            downloadProgress.textContent = status.download_progress || '处理中...';
-        } else {
-            setStatus(downloadStatus, '', '就绪');
-            downloadBtn.disabled = false;
-            downloadStopBtn.disabled = true;
-            downloadProgress.textContent = '';
-        }
-    } catch (error) {
-        console.error('更新状态失败:', error);
+// 字节数格式化
+function formatBytes(bytes) {
+    if (bytes >= 1024 * 1024 * 1024) return (bytes / 1024 / 1024 / 1024).toFixed(2) + ' GB';
+    if (bytes >= 1024 * 1024) return (bytes / 1024 / 1024).toFixed(1) + ' MB';
+    return Math.round(bytes / 1024) + ' KB';
+}
+
+// 秒数格式化
+function formatDuration(seconds) {
+    if (seconds === null || seconds === undefined) return '--';
+    const h = Math.floor(seconds / 3600);
+    const m = Math.floor((seconds % 3600) / 60);
+    const s = Math.floor(seconds % 60);
+    if (h) return `${h}时${m}分`;
+    if (m) return `${m}分${s}秒`;
+    return `${s}秒`;
+}
+
+// 抓取进度
+function scrapeLines(job) {
+    const stats = job.stats || {};
+    if (stats.pages === undefined) return [job.progress || '处理中...'];
+    return [`${job.progress} · 已完成 ${stats.pages} 页 · 商品 ${stats.items}`];
+}
+
+// 下载进度：商品 / 图片 / 流量与速率，队列深度用于判断瓶颈在扫描还是下载
+function downloadLines(job) {
+    const s = job.stats || {};
+    if (s.total === undefined) return [job.progress || '处理中...'];
+    const lines = [
+        `扫描 ${s.scanned}/${s.total} · 下载 ${s.downloaded}/${s.total}` + (s.failed ? ` · 失败 ${s.failed}` : ''),
+        `候选 ${s.candidates} · 探测 ${s.probed} · 通过 ${s.accepted} · 拒绝 ${s.rejected}`,
+        `${formatBytes(s.bytes || 0)} · ${s.mb_per_s || 0} MB/s · ${s.images_per_s || 0} 张/s · 剩余 ${formatDuration(s.eta)}`,
+    ];
+    if (s.queue_size !== undefined) {
+        lines.push(`下载队列 ${s.queue_depth}/${s.queue_size}`);
+    }
+    return lines;
+}
+
+// 按任务快照更新面板
+function renderPanel(kind, statusEl, startBtn, stopBtn, progressEl, formatLines) {
+    const job = runningJob(kind);
+    if (job) {
+        setStatus(statusEl, 'active', '运行中');
+        startBtn.disabled = true;
+        stopBtn.disabled = false;
+        progressEl.textContent = formatLines(job).join('\n');
+    } else {
+        setStatus(statusEl, '', '就绪');
+        startBtn.disabled = false;
+        stopBtn.disabled = true;
+        progressEl.textContent = '';
     }
 }
 
+function renderStatus() {
+    renderPanel('scrape', scrapeStatus, scrapeBtn, scrapeStopBtn, scrapeProgress, scrapeLines);
+    renderPanel('download', downloadStatus, downloadBtn, downloadStopBtn, downloadProgress, downloadLines);
+}
+
 // 设置状态指示器
 function setStatus(element, className, text) {
     element.className = 'status-indicator ' + className;
@@ -163,11 +217,13 @@ async function startScrape() {
 // 开始下载
 async function startDownload() {
     try {
+        const scanWorkers = parseInt(scanWorkersInput.value, 10) || 1;
         const response = await fetch('/api/download', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json'
-            }
+            },
+            body: JSON.stringify({ scan_workers: scanWorkers })
         });
 
         const result = await response.json();
@@ -184,17 +240,27 @@ async function startDownload() {
     }
 }
 
-// 停止任务
-async function stopTask(event) {
+// 停止任务：停止该面板正在运行的任务
+async function stopTask(event, kind) {
     // 阻止事件冒泡
     if (event) {
         event.preventDefault();
         event.stopPropagation();
     }
 
+    // 只停止本面板的任务；不带 job_id 的请求会停止全部任务
+    const job = runningJob(kind);
+    if (!job) {
+        renderStatus();
+        return;
+    }
     try {
         const response = await fetch('/api/stop', {
-            method: 'POST'
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({ job_id: job.id })
         });
 
         const result = await response.json();
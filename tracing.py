@@ -0,0 +1,195 @@
+"""时间线追踪：把每个阶段、每次图片请求记录为 Chrome trace 事件
+
+输出的 JSON 可以直接在 chrome://tracing 或 https://ui.perfetto.dev 中打开，
+每个线程 (扫描线程、浏览器线程、下载线程) 一行，慢商品和拖慢收尾的长尾图片一目了然。
+
+- Tracer.stage(name)：记录阶段耗时 (同时写入 metrics 的 stage_seconds 直方图)
+- Tracer.span(name)：只记录时间线，不计入指标
+- Tracer.complete(name, start, end)：事后补记一段时间 (如排队时间)，
+  async_id 不为空时记录为异步事件 (asyncio 后端同一线程内相互重叠的请求)
+- sample_ms > 0 时启动采样线程，定期记录每个线程正在执行的函数
+
+不启用追踪时使用 NULL_TRACER：stage 只记录指标，其余操作为空。
+时间戳取自 time.perf_counter_ns (Linux 上为系统级单调时钟)，多进程扫描的事件可以直接合并。
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from metrics import REGISTRY, STAGE_METRIC
+
+MAX_EVENTS = 2000000  # 事件数上限，超出后丢弃并计数，避免长任务占满内存
+
+
+def _now_us():
+    return time.perf_counter_ns() // 1000
+
+
+class Tracer:
+    """线程安全的 Chrome trace 事件收集器"""
+
+    enabled = True
+
+    def __init__(self, path=None, sample_ms=0, max_events=MAX_EVENTS):
+        self.path = path
+        self.sample_ms = sample_ms
+        self.max_events = max_events
+        self.pid = os.getpid()
+        self.events = []
+        self.dropped = 0
+        self.threads = set()  # 已写入线程名的 (pid, tid)
+        self.lock = threading.Lock()
+        self.sampler = None
+        self.sampling = threading.Event()
+        if sample_ms > 0:
+            self.start_sampler()
+
+    def _append(self, event):
+        tid = event['tid']
+        with self.lock:
+            if len(self.events) >= self.max_events:
+                self.dropped += 1
+                return
+            if (self.pid, tid) not in self.threads:
+                self.threads.add((self.pid, tid))
+                self.events.append({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                                    'args': {'name': threading.current_thread().name}})
+            self.events.append(event)
+
+    def complete(self, name, start, end, cat='stage', async_id=None, **args):
+        """记录一段已经结束的时间，start/end 为 time.perf_counter() 的秒数"""
+        ts = int(start * 1000000)
+        dur = max(0, int((end - start) * 1000000))
+        base = {'name': name, 'cat': cat, 'pid': self.pid, 'tid': threading.get_ident()}
+        if async_id is None:
+            self._append(dict(base, ph='X', ts=ts, dur=dur, args=args))
+        else:
+            self._append(dict(base, ph='b', ts=ts, id=async_id, args=args))
+            self._append(dict(base, ph='e', ts=ts + dur, id=async_id))
+
+    @contextmanager
+    def span(self, name, cat='stage', **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.complete(name, start, time.perf_counter(), cat, **args)
+
+    @contextmanager
+    def stage(self, name, **args):
+        """阶段耗时：同时写入指标直方图和时间线"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            REGISTRY.observe(STAGE_METRIC, end - start, stage=name)
+            self.complete(name, start, end, 'stage', **args)
+
+    def observe(self, name, start, async_id=None, **args):
+        """补记一个从 start 到现在的阶段 (指标 + 时间线)"""
+        end = time.perf_counter()
+        REGISTRY.observe(STAGE_METRIC, end - start, stage=name)
+        self.complete(name, start, end, 'stage', async_id, **args)
+
+    def instant(self, name, cat='event', **args):
+        self._append({'name': name, 'cat': cat, 'ph': 'i', 's': 't', 'ts': _now_us(), 'pid': self.pid,
+                      'tid': threading.get_ident(), 'args': args})
+
+    def start_sampler(self):
+        """采样线程：每 sample_ms 毫秒记录一次各线程栈顶的函数"""
+        if self.sampler is not None:
+            return
+        self.sampling.set()
+        self.sampler = threading.Thread(target=self._sample_loop, name="trace-sampler", daemon=True)
+        self.sampler.start()
+
+    def _sample_loop(self):
+        interval = self.sample_ms / 1000
+        own = threading.get_ident()
+        while self.sampling.is_set():
+            ts = _now_us()
+            for tid, frame in sys._current_frames().items():
+                if tid == own:
+                    continue
+                code = frame.f_code
+                name = f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+                event = {'name': name, 'cat': 'sample', 'ph': 'X', 'ts': ts, 'dur': int(interval * 1000000),
+                         'pid': self.pid, 'tid': tid}
+                with self.lock:
+                    if len(self.events) >= self.max_events:
+                        self.dropped += 1
+                    else:
+                        self.events.append(event)
+            time.sleep(interval)
+
+    def stop_sampler(self):
+        self.sampling.clear()
+        if self.sampler is not None:
+            self.sampler.join()
+            self.sampler = None
+
+    def drain(self):
+        """取出并清空已记录的事件 (扫描进程随结果交给主进程)"""
+        with self.lock:
+            events, self.events = self.events, []
+            self.threads.clear()  # 线程名元数据随事件一起交出，下次重新写入
+        return events
+
+    def extend(self, events):
+        with self.lock:
+            room = self.max_events - len(self.events)
+            if len(events) > room:
+                self.dropped += len(events) - max(room, 0)
+                events = events[:max(room, 0)]
+            self.events.extend(events)
+
+    def save(self, path=None):
+        """写出 Chrome trace JSON，返回文件路径"""
+        self.stop_sampler()
+        path = path or self.path
+        with self.lock:
+            events = list(self.events)
+            dropped = self.dropped
+        parent = os.path.dirname(path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                       'otherData': {'dropped_events': dropped}}, f, ensure_ascii=False)
+        return path
+
+
+class NullTracer:
+    """不启用追踪时的占位：stage 只记录指标，其余操作为空"""
+
+    enabled = False
+
+    def complete(self, name, start, end, cat='stage', async_id=None, **args):
+        pass
+
+    def span(self, name, cat='stage', **args):
+        return nullcontext()
+
+    def stage(self, name, **args):
+        return REGISTRY.stage(name)
+
+    def observe(self, name, start, async_id=None, **args):
+        REGISTRY.observe(STAGE_METRIC, time.perf_counter() - start, stage=name)
+
+    def instant(self, name, cat='event', **args):
+        pass
+
+    def drain(self):
+        return []
+
+    def extend(self, events):
+        pass
+
+    def save(self, path=None):
+        return None
+
+
+NULL_TRACER = NullTracer()